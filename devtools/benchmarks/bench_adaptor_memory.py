@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Peak memory and time of trajectory adaptors, old vs current code path.
+
+    python devtools/benchmarks/bench_adaptor_memory.py [--size-gb 1.0]
+
+`--tile` replicates the test system for the ParmEd cases, whose cost
+before the first frame grows with the number of atoms.
+
+Every case runs in a fresh interpreter so that peak RSS (ru_maxrss) is
+not shared. A synthetic trajectory of `--size-gb` float32 coordinates is
+built from the test system; "old" emulates the previous adaptor code
+(eager ParmEd coordinates, MDTraj frames copied again by the locking
+reader of the widget path). Backends that are not installed are skipped.
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import nglview as nv
+from nglview.base_adaptor import thread_safe_reader
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size-gb', type=float, default=1.0)
+parser.add_argument('--frames-played', type=int, default=1000)
+parser.add_argument('--tile', type=int, default=10)
+parser.add_argument('--case', help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+CASES = ['mdtraj-old', 'mdtraj-new', 'parmed-old', 'parmed-new']
+
+
+def peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def n_frames_for(n_atoms, itemsize):
+    return max(1, int(args.size_gb * 2**30 / (n_atoms * 3 * itemsize)))
+
+
+def random_coordinates(shape, dtype):
+    # filled in place, so building the data does not raise the peak RSS
+    xyz = np.empty(shape, dtype=dtype)
+    np.random.default_rng(0).random(out=xyz.reshape(-1), dtype=dtype)
+    return xyz
+
+
+def play(t):
+    # as the widget reads frames
+    reader = thread_safe_reader(t)
+    for index in range(min(args.frames_played, reader.n_frames)):
+        np.asarray(reader.get_coordinates(index), dtype='f4').tobytes()
+
+
+def run_mdtraj(old):
+    import mdtraj as md
+    traj = md.load(nv.datafiles.PDB)
+    n_frames = n_frames_for(traj.n_atoms, 4)
+    traj.xyz = random_coordinates((n_frames, traj.n_atoms, 3), 'f4')
+    base = peak_rss_mb()
+    t = nv.MDTrajTrajectory(traj)
+    if old:
+        t.concurrency = 'lock'
+    t0 = time.perf_counter()
+    play(t)
+    return base, time.perf_counter() - t0
+
+
+def run_parmed(old):
+    import parmed as pmd
+    structure = pmd.load_file(nv.datafiles.PDB) * args.tile
+    n_atoms = len(structure.atoms)
+    structure.coordinates = random_coordinates(
+        (n_frames_for(n_atoms, 8), n_atoms, 3), 'f8')
+    base = peak_rss_mb()
+    t0 = time.perf_counter()
+    t = nv.ParmEdTrajectory(structure)
+    if old:
+        t._get_xyz()
+    t.n_frames
+    # time until the widget could be shown
+    return base, time.perf_counter() - t0
+
+
+def child(case):
+    name, version = case.split('-')
+    run = {'mdtraj': run_mdtraj, 'parmed': run_parmed}[name]
+    try:
+        base, elapsed = run(version == 'old')
+    except ImportError:
+        return
+    print(f'{case:12s} data: {base:8.0f} MB   peak RSS: {peak_rss_mb():8.0f} '
+          f'MB   time: {elapsed:8.3f} s')
+
+
+if args.case:
+    child(args.case)
+else:
+    print(f'{args.size_gb} GB of coordinates, mdtraj: time to play '
+          f'{args.frames_played} frames, parmed: time to create the adaptor')
+    for case in CASES:
+        subprocess.run([
+            sys.executable, __file__, '--size-gb',
+            str(args.size_gb), '--frames-played',
+            str(args.frames_played), '--tile',
+            str(args.tile), '--case', case
+        ],
+                       check=True)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Compare `get_structure_string` against the old temp-file round trip.
+
+    python devtools/benchmarks/bench_structure_string.py [-n 5] [--tile 10]
+
+`--tile` replicates the test system to emulate larger topologies.
+Backends that are not installed are skipped. `--n-atoms` additionally times
+the array writers in `nglview.utils.structure_io` on a synthetic system.
+"""
+import argparse
+import os
+import timeit
+from tempfile import mkstemp
+
+import numpy as np
+
+import nglview as nv
+from nglview.utils.mmtf import write_mmtf
+from nglview.utils.structure_io import write_cif, write_pdb
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--number', type=int, default=5)
+parser.add_argument('--tile', type=int, default=1)
+parser.add_argument('--n-atoms', type=int, default=0)
+args = parser.parse_args()
+
+
+def file_round_trip(write_method, suffix='.pdb'):
+    # what adaptors did before: write to mkstemp file and read it back
+    fd, fname = mkstemp(suffix=suffix)
+    try:
+        write_method(fname)
+        with open(fname) as fh:
+            return fh.read()
+    finally:
+        os.close(fd)
+        os.remove(fname)
+
+
+def report(name, old, new):
+    t_old = min(timeit.repeat(old, number=1, repeat=args.number))
+    t_new = min(timeit.repeat(new, number=1, repeat=args.number))
+    print(f'{name:10s} file: {t_old:8.4f} s   memory: {t_new:8.4f} s   '
+          f'speedup: {t_old / t_new:6.1f}x')
+
+
+try:
+    import mdtraj as md
+except ImportError:
+    pass
+else:
+    traj = md.load(nv.datafiles.PDB)
+    for _ in range(args.tile - 1):
+        traj = traj.stack(md.load(nv.datafiles.PDB))
+    t = nv.MDTrajTrajectory(traj)
+    report('mdtraj', lambda: file_round_trip(traj[0].save_pdb),
+           t.get_structure_string)
+
+try:
+    import parmed as pmd
+except ImportError:
+    pass
+else:
+    structure = pmd.load_file(nv.datafiles.PDB) * args.tile
+    t = nv.ParmEdTrajectory(structure)
+    report(
+        'parmed', lambda: file_round_trip(lambda fn: structure.write_pdb(
+            fn, coordinates=structure.coordinates)), t.get_structure_string)
+
+try:
+    import ase.io
+except ImportError:
+    pass
+else:
+    atoms = ase.io.read(nv.datafiles.GRO) * (args.tile, 1, 1)
+    s = nv.ASEStructure(atoms)
+    report('ase', lambda: file_round_trip(atoms.write),
+           s.get_structure_string)
+
+try:
+    import MDAnalysis as mda
+except ImportError:
+    pass
+else:
+    u = mda.Universe(nv.datafiles.PDB)
+    u = mda.Merge(*[u.atoms] * args.tile)
+    t = nv.MDAnalysisTrajectory(u)
+    report('mdanalysis',
+           lambda: file_round_trip(lambda fn: u.atoms.write(fn)),
+           t.get_structure_string)
+
+if args.n_atoms:
+    n = args.n_atoms
+    arrays = dict(names=np.full(n, 'CA'),
+                  resnames=np.full(n, 'ALA'),
+                  resids=np.arange(n),
+                  xyz=np.random.uniform(-100, 100, (n, 3)),
+                  elements=np.full(n, 'C'))
+    for name, func in [('pdb', write_pdb), ('cif', write_cif),
+                       ('mmtf', write_mmtf)]:
+        t = min(
+            timeit.repeat(lambda: func(**arrays), number=1,
+                          repeat=args.number))
+        size = len(func(**arrays)) / 1e6
+        print(f'write_{name} {n} atoms: {t:8.4f} s  {size:8.1f} MB')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Peak memory and time of write_html against the number of embedded frames.
+
+    python devtools/benchmarks/bench_write_html_memory.py [--frames 250 1000 4000]
+        [--n-workers 1 4]
+
+Every case runs in a fresh interpreter so that peak RSS (ru_maxrss) is
+not shared. Frames are generated on the fly from the test system, so the
+trajectory itself takes no memory. "materialized" encodes all coordinates
+into the widget state before the page is built (the previous code path),
+"streaming" is the current `write_html`, which encodes the frames while the
+file is written, by `--n-workers` threads.
+"""
+import argparse
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import nglview as nv
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--frames', type=int, nargs='+', default=[250, 1000, 4000])
+parser.add_argument('--precision', type=float, default=None)
+parser.add_argument('--n-workers', type=int, nargs='+', default=[1])
+parser.add_argument('--case', help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+def peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class SyntheticTrajectory(nv.Trajectory, nv.Structure):
+    def __init__(self, n_frames):
+        nv.Trajectory.__init__(self)
+        nv.Structure.__init__(self)
+        self.ext = 'gro'
+        with open(nv.datafiles.GRO) as fh:
+            self._text = fh.read()
+        t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+        self._xyz = t.get_coordinates(0).copy()
+        t.close()
+        self._n_frames = n_frames
+
+    def get_structure_string(self):
+        return self._text
+
+    def get_coordinates(self, index):
+        noise = np.random.default_rng(index).random(self._xyz.shape, 'f4')
+        return self._xyz + noise
+
+    @property
+    def n_frames(self):
+        return self._n_frames
+
+
+def child(case):
+    mode, n_frames, n_workers = case.split('-')
+    n_frames = int(n_frames)
+    n_workers = int(n_workers)
+    view = nv.NGLWidget(SyntheticTrajectory(n_frames))
+    base = peak_rss_mb()
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'index.html')
+        if mode == 'materialized':
+            view._set_serialization(frame_range=(0, n_frames),
+                                    precision=args.precision,
+                                    n_workers=n_workers)
+            html = io.StringIO()
+            nv.write_html(html, [view])
+            with open(path, 'w') as fh:
+                fh.write(html.getvalue())
+        else:
+            nv.write_html(path, [view],
+                          frame_range=(0, n_frames),
+                          precision=args.precision,
+                          n_workers=n_workers)
+        size = os.path.getsize(path) / 2**20
+    print(f'{mode:13s} workers: {n_workers:2d}   frames: {n_frames:6d}   '
+          f'page: {size:8.1f} MB   '
+          f'peak RSS: {peak_rss_mb():8.0f} MB (+{peak_rss_mb() - base:.0f})'
+          f'   time: {time.perf_counter() - t0:7.2f} s')
+
+
+if args.case:
+    child(args.case)
+else:
+    for n_frames in args.frames:
+        cases = [f'materialized-{n_frames}-{args.n_workers[0]}']
+        cases += [f'streaming-{n_frames}-{n}' for n in args.n_workers]
+        for case in cases:
+            command = [sys.executable, __file__, '--case', case]
+            if args.precision is not None:
+                command += ['--precision', str(args.precision)]
+            subprocess.run(command, check=True)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Time random access XTC frame reads: nglview's reader (compiled and
+Python decoder) against MDTraj and MDAnalysis.
+
+    python devtools/benchmarks/bench_xtc_read.py [-n 5] [--tile 10]
+
+`--tile` replicates the test system (needs MDTraj to write the file) to
+emulate larger systems. Readers that are not installed are skipped.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+
+import nglview as nv
+from nglview.utils.trajectory_io import XTCReader
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--number', type=int, default=5)
+parser.add_argument('--tile', type=int, default=1)
+parser.add_argument('--frames', type=int, default=10)
+args = parser.parse_args()
+
+folder = tempfile.mkdtemp()
+xtc = os.path.join(folder, 'md.xtc')
+if args.tile > 1:
+    # coordinates only, the readers do not need a topology
+    from mdtraj.formats import XTCTrajectoryFile
+    with XTCTrajectoryFile(nv.datafiles.XTC) as fh:
+        xyz, time, step, box = fh.read()
+    shift = np.array([box[0].max(), 0, 0], dtype='f4')
+    xyz = np.concatenate([xyz + k * shift for k in range(args.tile)], axis=1)
+    with XTCTrajectoryFile(xtc, 'w') as fh:
+        fh.write(xyz, time=time, step=step, box=box)
+else:
+    shutil.copy(nv.datafiles.XTC, xtc)
+
+rng = np.random.default_rng(0)
+
+
+def report(name, read, n_frames):
+    indices = rng.integers(0, n_frames, args.frames)
+    # e.g. imports on the first read
+    read(0)
+    elapsed = min(
+        timeit.repeat(lambda: [read(int(i)) for i in indices],
+                      number=1,
+                      repeat=args.number))
+    print(f'{name:20s} {1000 * elapsed / args.frames:9.2f} ms/frame')
+
+
+reader = XTCReader(xtc)
+print(f'{reader.n_atoms} atoms, {reader.n_frames} frames')
+report('nglview', reader.read, reader.n_frames)
+with patch.object(XTCReader, 'compiled', False):
+    python_reader = XTCReader(xtc)
+    report('nglview (python)', python_reader.read, reader.n_frames)
+
+try:
+    from mdtraj.formats import XTCTrajectoryFile
+except ImportError:
+    pass
+else:
+    fh = XTCTrajectoryFile(xtc)
+
+    def read_mdtraj(index):
+        fh.seek(index)
+        return fh.read(n_frames=1)[0][0]
+
+    report('mdtraj', read_mdtraj, reader.n_frames)
+
+try:
+    from MDAnalysis.coordinates.XTC import XTCReader as MDAXTCReader
+except ImportError:
+    pass
+else:
+    mda_reader = MDAXTCReader(xtc)
+    report('MDAnalysis', lambda index: mda_reader[index].positions,
+           reader.n_frames)
+
+shutil.rmtree(folder)
@@ -0,0 +1,85 @@
+import * as _ from 'underscore'
+import * as NGL from "ngl"
+import * as widgets from "@jupyter-widgets/base"
+
+
+export
+class BlobModel extends widgets.WidgetModel {
+    // one model per unique structure (see nglview/blob.py), shared by all views
+    defaults(){
+        return _.extend(widgets.WidgetModel.prototype.defaults(), {
+            _model_name: 'BlobModel',
+            _model_module: 'nglview-js-widgets',
+            _model_module_version: require("../package.json").version,
+            data: null,
+            binary: false,
+            url: '',
+        })
+    }
+
+    initialize(attributes, options){
+        super.initialize(attributes, options)
+        // parsed structures by loader parameters, shared by the views;
+        // freed with the model
+        this.parsed = {}
+        this.on("destroy", () => { this.parsed = {} })
+    }
+
+    async getBlob(){
+        // pages written with write_html(external_data_dir=...) fetch the data
+        var data = this.get("data")
+        if (this.get("url")){
+            var response = await fetch(this.get("url"))
+            data = await response.arrayBuffer()
+        }
+        return new Blob([data], {
+            type: this.get("binary") ? "application/octet-binary" : "text/plain"
+        })
+    }
+}
+
+
+// read only parts of a structure that concatStructures does not copy
+var SHARED_STRUCTURE_FIELDS = [
+    "frames", "boxes", "unitcell", "biomolDict", "spacegroup", "header",
+    "extraData", "title", "id", "path"
+]
+
+
+function copyStructure(obj){
+    // each view gets its own atoms since trajectories update coordinates in
+    // place; the models (e.g. asTrajectory frames), unit cell and
+    // assemblies are shared
+    var structure = NGL.concatStructures(obj.name, obj)
+    SHARED_STRUCTURE_FIELDS.forEach((field) => {
+        if (obj[field] !== undefined){
+            structure[field] = obj[field]
+        }
+    })
+    return structure
+}
+
+
+export
+async function loadBlobModel(stage, manager, model_ref, params){
+    var model = await manager.get_model(model_ref.replace("IPY_MODEL_", ""))
+    var blob = await model.getBlob()
+    // all loader parameters (ext, asTrajectory, firstModelOnly, ...), as
+    // stage.loadFile passes them
+    var {defaultRepresentation, ...loaderParams} = params
+    var key = JSON.stringify(loaderParams)
+    if (!(key in model.parsed)){
+        model.parsed[key] = NGL.autoLoad(blob, loaderParams)
+    }
+    var obj = await model.parsed[key]
+    if (!(obj instanceof NGL.Structure)){
+        // e.g. volumes: let NGL parse it again
+        return stage.loadFile(blob, params)
+    }
+    var structure = copyStructure(obj)
+    var component = stage.addComponentFromObject(structure, params)
+    if (params.defaultRepresentation){
+        stage.defaultFileRepresentation(component)
+    }
+    return component
+}
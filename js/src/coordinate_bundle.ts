@@ -0,0 +1,122 @@
+// Decode the coordinate bundles written by nglview.write_html
+// (see nglview/utils/coordinate_bundle.py), once per trajectory or chunk.
+
+
+function base64ToBytes(base64: string): Uint8Array {
+    var binary = atob(base64)
+    var bytes = new Uint8Array(binary.length)
+    for (var i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i)
+    }
+    return bytes
+}
+
+
+async function inflate(bytes: Uint8Array): Promise<ArrayBuffer> {
+    // zlib format, as written by Python's zlib.compress
+    var stream = new Blob([bytes]).stream().pipeThrough(
+        new (window as any).DecompressionStream("deflate"))
+    return new Response(stream).arrayBuffer()
+}
+
+
+export
+async function decodeCoordinateBundle(bundle): Promise<Float32Array> {
+    var bytes
+    if (bundle.url) {
+        // written with write_html(external_data_dir=...)
+        var response = await fetch(bundle.url)
+        bytes = new Uint8Array(await response.arrayBuffer())
+    } else {
+        bytes = base64ToBytes(bundle.data)
+    }
+    var buffer = (bundle.compression === "deflate") ?
+        await inflate(bytes) : bytes.buffer
+    if (bundle.dtype === "f4") {
+        return new Float32Array(buffer)
+    }
+    // quantized frames, stored as differences to the previous frame; every
+    // key_interval-th frame is the difference to zero
+    var deltas = new Int32Array(buffer)
+    var size = bundle.n_atoms * 3
+    var coordinates = new Float32Array(deltas.length)
+    var current = new Int32Array(size)
+    var key_interval = bundle.key_interval || bundle.n_frames
+    for (var f = 0; f < bundle.n_frames; f++) {
+        var offset = f * size
+        if (f % key_interval === 0) {
+            current.fill(0)
+        }
+        for (var i = 0; i < size; i++) {
+            current[i] += deltas[offset + i]
+            coordinates[offset + i] = current[i] * bundle.precision
+        }
+    }
+    return coordinates
+}
+
+
+function getBundleFrame(bundle, coordinates: Float32Array, frame_index: number): Float32Array {
+    // view on the coordinates of a frame, null past the end of the trajectory
+    if (frame_index >= bundle.n_frames) {
+        return null
+    }
+    var size = bundle.n_atoms * 3
+    return coordinates.subarray(frame_index * size, (frame_index + 1) * size)
+}
+
+
+export
+class CoordinateSource {
+    // frames of one trajectory: a single bundle, or chunks of `chunk_size`
+    // frames that are decoded when the player gets to them
+    resource: any
+    maxChunks: number
+    chunks: Map<number, Promise<Float32Array>>
+
+    constructor(resource, maxChunks = 4) {
+        this.resource = resource
+        this.maxChunks = maxChunks
+        this.chunks = new Map()
+    }
+
+    decodeChunk(chunk_index: number): Promise<Float32Array> {
+        var chunks = this.resource.chunks
+        if (chunks === undefined) {
+            chunk_index = 0
+        } else if (chunk_index >= chunks.length) {
+            return null
+        }
+        var decoded = this.chunks.get(chunk_index)
+        if (decoded === undefined) {
+            var bundle = (chunks === undefined) ? this.resource : chunks[chunk_index]
+            decoded = decodeCoordinateBundle(bundle)
+            if (chunks !== undefined && this.chunks.size >= this.maxChunks) {
+                // least recently used first
+                this.chunks.delete(this.chunks.keys().next().value)
+            }
+        } else {
+            this.chunks.delete(chunk_index)
+        }
+        this.chunks.set(chunk_index, decoded)
+        return decoded
+    }
+
+    async getFrame(frame_index: number): Promise<Float32Array> {
+        var chunk_size = this.resource.chunk_size
+        if (chunk_size === undefined) {
+            return getBundleFrame(this.resource, await this.decodeChunk(0), frame_index)
+        }
+        var chunk_index = Math.floor(frame_index / chunk_size)
+        if (frame_index >= this.resource.n_frames) {
+            return null
+        }
+        var coordinates = this.decodeChunk(chunk_index)
+        // fetch the next chunk while this one is played
+        this.decodeChunk(chunk_index + 1)
+        this.chunks.delete(chunk_index)
+        this.chunks.set(chunk_index, coordinates)
+        return getBundleFrame(this.resource.chunks[chunk_index],
+                              await coordinates, frame_index % chunk_size)
+    }
+}
@@ -15,6 +15,8 @@ import 'jquery-ui/themes/base/all.css' // FIXME: remove?
 import { StageWidget } from "./gui"
 import { FullscreenModel, FullscreenView } from "./fullscreen"
 import { ColormakerRegistryModel, ColormakerRegistryView } from "./color"
+import { BlobModel, loadBlobModel } from "./blob"
+import { CoordinateSource } from "./coordinate_bundle"
 import { ThemeManagerModel, ThemeManagerView} from "./theme"
 
 NGL.nglview_debug = false
@@ -422,6 +424,7 @@ class NGLView extends widgets.DOMWidgetView{
         // Outside notebook
         if (that.model.comm === undefined){
             var ngl_coordinate_resource = that.model.get("_ngl_coordinate_resource");
+            await that.decodeCoordinateBundles(ngl_coordinate_resource)
             var n_frames = ngl_coordinate_resource['n_frames'] || 1
             that.model.set("max_frame", n_frames-1);  // trigger updating slider and player's max
             that.touch()
@@ -444,14 +447,39 @@ class NGLView extends widgets.DOMWidgetView{
         that.handleResize() // FIXME: really need this?
     }
 
-    updateCoordinatesFromDict(cdict, frame_index){
+    async decodeCoordinateBundles(cdict){
+        // decode each trajectory's bundle once (or its first chunk), frames
+        // are views on it
+        this._coordinateSources = {};
+        var keys = Object.keys(cdict).filter(k => (k !== 'n_frames'));
+        for (var i = 0; i < keys.length; i++) {
+            var resource = cdict[keys[i]];
+            if (!Array.isArray(resource)) {
+                var source = new CoordinateSource(resource);
+                this._coordinateSources[keys[i]] = source;
+                await source.getFrame(0);
+            }
+        }
+    }
+
+    async updateCoordinatesFromDict(cdict, frame_index){
         // update coordinates for given "index"
-        // cdict = Dict[int, List[base64]]
+        // cdict = Dict[int, bundle], or Dict[int, List[base64]] (older pages)
         var keys = Object.keys(cdict).filter(k => (k !== 'n_frames'));
+        this._coordinateFrame = frame_index;
 
         for (var i = 0; i < keys.length; i++) {
             var traj_index = keys[i];
-            var coordinates = this.decode_base64(cdict[traj_index][frame_index]);
+            var coordinates;
+            if (Array.isArray(cdict[traj_index])) {
+                coordinates = this.decode_base64(cdict[traj_index][frame_index]);
+            } else {
+                coordinates = await this._coordinateSources[traj_index].getFrame(frame_index);
+                if (this._coordinateFrame !== frame_index) {
+                    // the player moved on while the chunk was fetched
+                    return;
+                }
+            }
             if (coordinates && coordinates.byteLength > 0) {
                 this.updateCoordinates(coordinates, traj_index);
             }
@@ -953,50 +981,84 @@ class NGLView extends widgets.DOMWidgetView{
         })
     }
 
-    async _downloadImage(filename, params) {
+    _downloadImage(filename, params) {
         if (this.ngl_view_id == this.get_last_child_id()){
-            var blob = await this.stage.makeImage(params)
-            NGL.download(blob, filename);
+            return this.queueRender(async () => {
+                var blob = await this.stage.makeImage(params)
+                NGL.download(blob, filename);
+            })
+        }
+    }
+
+    queueRender(task) {
+        // movie frames and downloads are rendered one after the other,
+        // renderBarrier waits for the ones queued before it
+        this._renderQueue = (this._renderQueue || Promise.resolve()).then(task)
+            .catch((error) => console.error(error))
+        return this._renderQueue
+    }
+
+    tasksDone() {
+        // resolves once no representation is being built
+        return new Promise((resolve) => this.stage.tasks.onZeroOnce(resolve))
+    }
+
+    async renderBarrier(token) {
+        // ack once everything sent before this call is applied and drawn.
+        // Messages are handled in order, but representations may still be
+        // built (stage.tasks) and images rendered (queueRender).
+        if (this.ngl_view_id != this.get_last_child_id()){
+            return
+        }
+        await this.queueRender(async () => {
+            await this.tasksDone()
+            this.stage.viewer.requestRender()
+            await new Promise((resolve) =>
+                requestAnimationFrame(() => requestAnimationFrame(resolve)))
+        })
+        this.send({'type': 'render_ack', 'data': token})
+    }
+
+    async sendImage(blob, msg, format) {
+        // send the PNG bytes, or the raw RGBA pixels, as a binary buffer
+        if (format === "rgba") {
+            var bitmap = await createImageBitmap(blob)
+            var canvas = document.createElement("canvas")
+            canvas.width = bitmap.width
+            canvas.height = bitmap.height
+            var context = canvas.getContext("2d")
+            context.drawImage(bitmap, 0, 0)
+            var pixels = context.getImageData(0, 0, bitmap.width, bitmap.height).data
+            msg.format = "rgba"
+            msg.width = bitmap.width
+            msg.height = bitmap.height
+            this.send(msg, [pixels.buffer])
+        } else {
+            msg.format = "png"
+            this.send(msg, [await new Response(blob).arrayBuffer()])
         }
+        this.send({'type': 'async_message', 'data': 'ok'});
     }
 
     async _exportImage(wid, params) {
         if (this.ngl_view_id == this.get_last_child_id()){
-            var blob = await this.stage.makeImage(params)
-                var reader = new FileReader();
-                var arr_str;
-                reader.onload = function() {
-                    arr_str = (reader.result as string).replace("data:image/png;base64,", "");
-                    // this.model.set("_image_data", arr_str);
-                    // this.touch();
-                    this.send({
-                        "data": arr_str,
-                        "type": "image_data",
-                        "ID": wid,
-                    });
-                    this.send({'type': 'async_message', 'data': 'ok'});
-                }.bind(this);
-                reader.readAsDataURL(blob);
+            var {format, ...render_params} = params
+            var blob = await this.stage.makeImage(render_params)
+            await this.sendImage(blob, {"type": "image_data", "ID": wid}, format)
     }}
 
-    async handleMovieMaking(render_params) {
+    async handleMovieMaking(render_params, frame) {
+        // resolves once the image is sent, tagged with its frame
         console.log('handleMovieMaking: render_params', render_params)
         if (this.ngl_view_id == this.get_last_child_id()){
-            var blob = await this.stage.makeImage(render_params)
-            var reader = new FileReader();
-            var arr_str;
-            reader.onload = function() {
-                arr_str = (reader.result as string).replace("data:image/png;base64,", "");
-                // this.model.set("_image_data", arr_str);
-                // this.touch();
-                this.send({
-                    "data": arr_str,
-                    "type": "movie_image_data",
-                    }); // tell backend that image render is finished,
-                        // backend will send next frame's coordinates.
-                this.send({'type': 'async_message', 'data': 'ok'});
-            }.bind(this);
-            reader.readAsDataURL(blob);
+            var {format, ...params} = render_params
+            // representations updated with the new coordinates (e.g.
+            // surfaces) are built asynchronously
+            await this.tasksDone()
+            var blob = await this.stage.makeImage(params)
+            // tell backend that image render is finished,
+            // backend will send next frame's coordinates.
+            await this.sendImage(blob, {"type": "movie_image_data", "frame": frame}, format)
         }
     }
 
@@ -1021,6 +1083,10 @@ class NGLView extends widgets.DOMWidgetView{
                  });
              }
              return this.stage.loadFile(blob, msg.kwargs)
+         } else if (args0.type == 'blob_ref') {
+             // data is held by a BlobModel shared with other views
+             return loadBlobModel(this.stage, this.model.widget_manager,
+                                  args0.data, msg.kwargs)
          } else {
              var file = new File([""], args0.data);
              // FIXME: if not "any", typescipt complains there is no
@@ -1159,18 +1225,28 @@ class NGLView extends widgets.DOMWidgetView{
                 }
             }
         } else if (msg.type == 'binary_single') {
-            var coordinateMeta = msg.data;
-            keys = Object.keys(coordinateMeta);
-
-            for (i = 0; i < keys.length; i++) {
-                traj_index = keys[i];
-                coordinates = new Float32Array(msg.buffers[i].buffer);
-                if (coordinates.byteLength > 0) {
-                    this.updateCoordinates(coordinates, traj_index);
+            var applyCoordinates = () => {
+                var coordinateMeta = msg.data;
+                var keys = Object.keys(coordinateMeta);
+
+                for (var i = 0; i < keys.length; i++) {
+                    var traj_index = keys[i];
+                    var coordinates = new Float32Array(msg.buffers[i].buffer);
+                    if (coordinates.byteLength > 0) {
+                        this.updateCoordinates(coordinates, traj_index);
+                    }
                 }
             }
             if (msg.movie_making){
-                this.handleMovieMaking(msg.render_params)
+                // MovieMaker sends the next frames before this one's image
+                // is back: render them one after the other, each image is
+                // sent before the next frame's coordinates are applied
+                this.queueRender(() => {
+                    applyCoordinates()
+                    return this.handleMovieMaking(msg.render_params, msg.frame)
+                })
+            } else {
+                applyCoordinates()
             }
         } else if (msg.type == 'get') {
             if (msg.data == 'camera') {
@@ -1194,6 +1270,7 @@ module.exports = {
     'FullscreenView': FullscreenView,
     'ColormakerRegistryModel': ColormakerRegistryModel,
     'ColormakerRegistryView': ColormakerRegistryView,
+    'BlobModel': BlobModel,
     'ThemeManagerModel': ThemeManagerModel,
     'ThemeManagerView': ThemeManagerView,
 }
@@ -1,18 +1,24 @@
+import bisect
+import functools
 import os
-from contextlib import contextmanager
-import warnings
 import os.path
+import threading
 import uuid
-from functools import partial
+from collections import OrderedDict, deque
 from io import StringIO
-from tempfile import mkstemp
 from urllib.request import urlopen
 
 import numpy as np
 
 from . import config
-from .base_adaptor import Structure, Trajectory
-from .utils.py_utils import FileManager, tempfolder
+from .base_adaptor import Structure, Trajectory, thread_safe_reader
+from .utils.mmtf import write_mmtf
+from .utils.py_utils import FileManager
+from .utils.structure_cache import cache as structure_cache
+from .utils.structure_cache import hash_array, hash_strings
+from .utils.structure_io import (PDB_MAX_ATOMS, read_pdb, write_cif,
+                                 write_pdb)
+from .utils.trajectory_io import open_trajectory
 
 __all__ = [
     'FileStructure',
@@ -29,6 +35,11 @@ __all__ = [
     'RosettaStructure',
     'ProdyStructure',
     'SimpletrajTrajectory',
+    'FileTrajectory',
+    'StreamingTrajectory',
+    'SlicedTrajectory',
+    'AtomSubsetTrajectory',
+    'ConcatTrajectory',
     'ProdyTrajectory',
     'MDTrajTrajectory',
     'PyTrajTrajectory',
@@ -42,23 +53,104 @@ __all__ = [
 ]
 
 
-@contextmanager
-def mkstemp_wrapper(*args, **kwargs):
-    # NamedTemporaryFile cannot be used here because it makes it impossible
-    # on Windows to the file for writing. mkstemp is a bit less restrictive
-    # in this regard.
-    fd, fname = mkstemp(*args, **kwargs)
-    yield fname
-    # On windows, the file must be closed before it can be removed.
-    os.close(fd)
-    os.remove(fname)
+def _get_structure_string(write_method):
+    """Call `write_method` with an in-memory text stream and return its content.
+    """
+    fh = StringIO()
+    write_method(fh)
+    return fh.getvalue()
 
 
-def _get_structure_string(write_method, suffix='.pdb'):
-    with mkstemp_wrapper(suffix=suffix) as fname:
-        write_method(fname)
-        with open(fname) as fh:
-            return fh.read()
+def _cached_structure(method):
+    """Serve `method` from the kernel level structure cache.
+
+    The key is the adaptor's `_get_fingerprint()` plus the method arguments;
+    `ext` is cached along with the output since writing may change it.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (type(self).__name__, method.__name__, args,
+               tuple(sorted(kwargs.items())), self._get_fingerprint())
+
+        def build():
+            return method(self, *args, **kwargs), self.ext
+
+        output, self.ext = structure_cache.get(key, build)
+        return output
+
+    return wrapper
+
+
+def _write_structure(adaptor, bonds=None, bond_orders=None, **arrays):
+    """Format topology arrays as PDB, or as mmCIF if there are too many atoms
+    for PDB or the coordinates do not fit its columns (unwrapped
+    trajectories of large boxes). `adaptor.ext` is updated accordingly.
+    Bonds of HETATM atoms (ligands, non-standard residues) are written as
+    CONECT records to PDB, mmCIF has no bonds.
+    """
+    if len(arrays['xyz']) <= PDB_MAX_ATOMS:
+        try:
+            text = write_pdb(bonds=bonds, **arrays)
+        except ValueError:
+            pass
+        else:
+            adaptor.ext = 'pdb'
+            return text
+    adaptor.ext = 'cif'
+    return write_cif(**arrays)
+
+
+def _get_ase_structure_string(atoms):
+    import ase.io
+    return _get_structure_string(
+        lambda fh: ase.io.write(fh, atoms, format='proteindatabank'))
+
+
+def _get_box(lengths, angles=None):
+    """Unit cell as (a, b, c, alpha, beta, gamma), or None if `lengths` is.
+    Angles default to a rectangular box."""
+    if lengths is None:
+        return None
+    if angles is None:
+        angles = (90, 90, 90)
+    return np.concatenate([np.ravel(lengths), np.ravel(angles)]).astype('f8')
+
+
+def _get_mdtraj_topology(traj):
+    top = traj.topology
+    atoms = list(top.atoms)
+    chains = [
+        getattr(chain, 'chain_id', None) or chr(ord('A') + chain.index % 26)
+        for chain in top.chains
+    ]
+    bonds = [(bond[0].index, bond[1].index) for bond in top.bonds]
+    return dict(names=[atom.name for atom in atoms],
+                resnames=[atom.residue.name for atom in atoms],
+                resids=[atom.residue.resSeq for atom in atoms],
+                chains=[chains[atom.residue.chain.index] for atom in atoms],
+                elements=[
+                    atom.element.symbol if atom.element is not None else ''
+                    for atom in atoms
+                ],
+                bonds=bonds or None,
+                box=None if traj.unitcell_lengths is None else _get_box(
+                    10 * traj.unitcell_lengths[0], traj.unitcell_angles[0]),
+                xyz=10 * traj.xyz[0])
+
+
+def _get_schrodinger_topology(ct):
+    atoms = list(ct.atom)
+    # schrodinger atom indices start at 1
+    bonds = [(bond.atom1.index - 1, bond.atom2.index - 1) for bond in ct.bond]
+    return dict(names=[atom.pdbname.strip() for atom in atoms],
+                resnames=[atom.pdbres.strip() for atom in atoms],
+                resids=[atom.resnum for atom in atoms],
+                chains=[atom.chain.strip() for atom in atoms],
+                elements=[atom.element for atom in atoms],
+                bonds=bonds or None,
+                bond_orders=[bond.order for bond in ct.bond] or None,
+                xyz=ct.getXYZ())
 
 
 class register_backend:
@@ -134,7 +226,7 @@ class ASEStructure(Structure):
         self._ase_atoms = ase_atoms
 
     def get_structure_string(self):
-        return _get_structure_string(self._ase_atoms.write)
+        return _get_ase_structure_string(self._ase_atoms)
 
 
 class IODataStructure(Structure):
@@ -145,10 +237,11 @@ class IODataStructure(Structure):
     def get_structure_string(self):
         """Require `ase` package
         """
-        import ase.io
-        with mkstemp_wrapper(suffix='.xyz') as fname:
-            self._obj.to_file(fname)
-            return ASEStructure(ase.io.read(fname)).get_structure_string()
+        import ase
+        from iodata.utils import angstrom
+        atoms = ase.Atoms(numbers=self._obj.atnums,
+                          positions=self._obj.atcoords / angstrom)
+        return ASEStructure(atoms).get_structure_string()
 
 
 class QCElementalStructure(Structure):
@@ -178,8 +271,7 @@ class OpenbabelStructure(Structure):
             import openbabel
         oc = openbabel.OBConversion()
         oc.SetOutFormat('pdb')
-        write = partial(oc.WriteFile, self._obj)
-        return _get_structure_string(write)
+        return oc.WriteString(self._obj)
 
 
 class BiopythonStructure(Structure):
@@ -192,7 +284,6 @@ class BiopythonStructure(Structure):
 
     def get_structure_string(self):
         from Bio.PDB import PDBIO
-        from io import StringIO
         io_pdb = PDBIO()
         io_pdb.set_structure(self._entity)
         io_str = StringIO()
@@ -225,7 +316,10 @@ class RosettaStructure(Structure):
         self._mol = pose
 
     def get_structure_string(self):
-        return _get_structure_string(self._mol.dump_pdb)
+        from pyrosetta.rosetta.std import ostringstream
+        buffer = ostringstream()
+        self._mol.dump_pdb(buffer)
+        return buffer.str()
 
 
 @register_backend('prody')
@@ -239,12 +333,12 @@ class ProdyStructure(Structure):
     def get_structure_string(self):
         import prody
 
-        def write(fname):
+        def write(fh):
             if isinstance(self._obj, prody.Ensemble):
                 st = self._obj[0]
             else:
                 st = self._obj
-            prody.writePDB(fname, st)
+            prody.writePDBStream(fh, st)
 
         return _get_structure_string(write)
 
@@ -261,6 +355,9 @@ class ProdyTrajectory(Trajectory, ProdyStructure):
     def get_coordinates(self, index):
         return self._obj.getConformation(index).getCoords()
 
+    def get_coordinates_batch(self, indices):
+        return self._obj.getCoordsets(list(indices)).astype('f4', copy=False)
+
 
 @register_backend('simpletraj')
 class SimpletrajTrajectory(Trajectory, Structure):
@@ -306,6 +403,494 @@ class SimpletrajTrajectory(Trajectory, Structure):
         return traj.numframes
 
 
+class FileTrajectory(Trajectory, Structure):
+    '''Trajectory file read by nglview itself (xtc, trr or dcd).
+
+    Frames are read from a memory mapped file by offset, see
+    `nglview.utils.trajectory_io`.
+
+    Examples
+    --------
+    >>> import nglview as nv
+    >>> t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    >>> w = nv.NGLWidget(t)
+    >>> w
+    '''
+    # frames are read by offset, there is no reader position
+    concurrency = 'thread-safe'
+
+    def __init__(self, path, structure_path):
+        self.path = path
+        self._reader = open_trajectory(path)
+        self._structure_path = structure_path
+        self.ext = os.path.splitext(structure_path)[1][1:]
+        self.params = {}
+        self.id = str(uuid.uuid4())
+
+    def __getstate__(self):
+        # the memory mapped file is opened again when unpickled
+        state = self.__dict__.copy()
+        del state['_reader']
+        state.pop('_thread_safe_reader', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reader = open_trajectory(self.path)
+
+    def get_coordinates(self, index):
+        return self._reader.read(index)
+
+    def close(self):
+        self._reader.close()
+
+    def get_structure_string(self):
+        with open(self._structure_path) as fh:
+            return fh.read()
+
+    @property
+    def n_frames(self):
+        return self._reader.n_frames
+
+
+class StreamingTrajectory(Trajectory, Structure):
+    '''Trajectory from an iterator, e.g. when the number of frames is
+    unknown or too expensive to compute up front.
+
+    A worker thread reads ahead of the displayed frame in chunks and keeps
+    the last `window` frames in memory. `n_frames` (and the widget's
+    `max_frame`) grows as frames are read. Frames that dropped out of the
+    window can not be shown anymore.
+
+    Parameters
+    ----------
+    frames : iterable
+        Yields coordinates in angstrom, either one frame (n_atoms, 3) or a
+        chunk of frames (n_frames, n_atoms, 3) at a time.
+    structure : nglview.Structure
+        Topology, e.g. `nglview.FileStructure`.
+    window : int, default 1000
+        Number of frames kept in memory.
+    chunk_size : int, default 100
+        Number of frames read before they are made available.
+
+    Examples
+    --------
+    >>> import nglview as nv
+    >>> import pytraj as pt
+    >>> traj = pt.iterload(nv.datafiles.TRR, nv.datafiles.PDB)
+    >>> t = nv.StreamingTrajectory((frame.xyz for frame in traj),
+    ...                            nv.FileStructure(nv.datafiles.PDB))
+    >>> w = nv.NGLWidget(t)
+    >>> w
+
+    >>> # MDAnalysis reuses its positions array, the frames are copied
+    >>> import MDAnalysis as mda
+    >>> u = mda.Universe(nv.datafiles.PDB, nv.datafiles.XTC)
+    >>> t = nv.StreamingTrajectory((ts.positions for ts in u.trajectory),
+    ...                            nv.FileStructure(nv.datafiles.PDB))
+    '''
+
+    concurrency = 'thread-safe'
+
+    def __init__(self, frames, structure, window=1000, chunk_size=100):
+        if window < chunk_size:
+            raise ValueError('window must be at least chunk_size')
+        self._source = iter(frames)
+        self._structure = structure
+        self.ext = structure.ext
+        self.params = structure.params
+        self.id = str(uuid.uuid4())
+        self.window = window
+        self.chunk_size = chunk_size
+        self._frames = deque(maxlen=window)
+        self._n_read = 0
+        self._requested = 0
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._callbacks = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._read_frames)
+        self._thread.daemon = True
+        self._thread.start()
+        # make the first chunk available before showing
+        with self._cond:
+            while not self._n_read and not self._done:
+                self._cond.wait()
+        if not self._n_read and self._error is not None:
+            raise self._error
+
+    def _read_frames(self):
+        chunk = []
+        try:
+            for item in self._source:
+                xyz = np.array(item, dtype='f4')
+                chunk.extend(xyz[None] if xyz.ndim == 2 else xyz)
+                if len(chunk) >= self.chunk_size:
+                    self._add_chunk(chunk)
+                    chunk = []
+                if self._closed:
+                    return
+            self._add_chunk(chunk)
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _add_chunk(self, chunk):
+        with self._cond:
+            # read at most half a window ahead of the displayed frame
+            while (not self._closed and
+                   self._n_read - self._requested > self.window // 2):
+                self._cond.wait()
+            self._frames.extend(chunk)
+            self._n_read += len(chunk)
+            self._cond.notify_all()
+            n_frames = self._n_read
+        if chunk:
+            for callback in self._callbacks:
+                callback(n_frames)
+
+    def on_frames(self, callback):
+        """Call `callback(n_frames)` (from the worker thread) when new frames
+        are available"""
+        self._callbacks.append(callback)
+
+    def close(self):
+        """Stop reading"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get_coordinates(self, index):
+        with self._cond:
+            self._requested = index
+            self._cond.notify_all()
+            while index >= self._n_read and not self._done:
+                self._cond.wait()
+            if self._error is not None and index >= self._n_read:
+                raise RuntimeError(
+                    f'reading frame {index} failed') from self._error
+            start = self._n_read - len(self._frames)
+            if not start <= index < self._n_read:
+                raise IndexError(
+                    f'frame {index} is not in memory, frames {start} to '
+                    f'{self._n_read - 1} are')
+            return self._frames[index - start]
+
+    def get_structure_string(self):
+        return self._structure.get_structure_string()
+
+    @property
+    def n_frames(self):
+        return self._n_read
+
+
+class SlicedTrajectory(Trajectory):
+    '''Strided and/or windowed view of another trajectory adaptor.
+
+    Frame indices are remapped, no coordinates are copied. Other attributes
+    (structure, ext, params...) are those of the wrapped trajectory.
+
+    Parameters
+    ----------
+    trajectory : nglview.Trajectory
+    start, stop, stride : int or None
+        As for `slice`. Resolved against the current `n_frames` of
+        `trajectory`, so the view grows with a `StreamingTrajectory`.
+
+    Examples
+    --------
+    >>> import nglview as nv
+    >>> t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    >>> w = nv.NGLWidget(nv.SlicedTrajectory(t, stride=10))
+    >>> w.max_frame
+    5
+    '''
+
+    # reads go through the wrapped trajectory's thread safe reader
+    concurrency = 'thread-safe'
+
+    def __init__(self, trajectory, start=None, stop=None, stride=None):
+        self.trajectory = trajectory
+        self.slice = slice(start, stop, stride)
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the view itself
+        if name == 'trajectory':
+            raise AttributeError(name)
+        return getattr(self.trajectory, name)
+
+    @property
+    def frame_indices(self):
+        """Indices of the frames in the wrapped trajectory"""
+        return range(*self.slice.indices(self.trajectory.n_frames))
+
+    @property
+    def n_frames(self):
+        return len(self.frame_indices)
+
+    def get_coordinates(self, index):
+        return thread_safe_reader(self.trajectory).get_coordinates(
+            self.frame_indices[index])
+
+    def get_coordinates_batch(self, indices):
+        frame_indices = self.frame_indices
+        indices = [frame_indices[index] for index in indices]
+        reader = thread_safe_reader(self.trajectory)
+        if hasattr(reader, 'get_coordinates_batch'):
+            return reader.get_coordinates_batch(indices)
+        return Trajectory.get_coordinates_batch(reader, indices)
+
+
+class AtomSubsetTrajectory(Trajectory, Structure):
+    '''View of some atoms of another trajectory adaptor.
+
+    The subset topology is built once, frames are sliced with a precomputed
+    index array, so only the selected atoms are sent to the frontend.
+
+    Parameters
+    ----------
+    trajectory : nglview.Trajectory
+        Must provide its topology as arrays (MDTraj, PyTraj, MDAnalysis,
+        HTMD, Schrodinger adaptors) or a PDB structure string.
+    atom_indices : array-like of int or str
+        Atom indices, or a selection string in the language of the
+        trajectory's library (MDTraj, PyTraj and MDAnalysis adaptors).
+        Atoms are kept in their original order.
+
+    Examples
+    --------
+    >>> import nglview as nv
+    >>> import mdtraj as md
+    >>> traj = nv.MDTrajTrajectory(md.load(nv.datafiles.XTC, top=nv.datafiles.GRO))
+    >>> t = nv.AtomSubsetTrajectory(traj, 'protein')
+    >>> w = nv.NGLWidget(t)
+    >>> w
+    '''
+
+    # reads go through the wrapped trajectory's thread safe reader
+    concurrency = 'thread-safe'
+
+    def __init__(self, trajectory, atom_indices):
+        if isinstance(atom_indices, str):
+            if not hasattr(trajectory, '_select_atoms'):
+                raise ValueError(
+                    f'{type(trajectory).__name__} does not support selection '
+                    'strings, use atom indices')
+            atom_indices = trajectory._select_atoms(atom_indices)
+        if not (hasattr(trajectory, '_get_topology') or
+                getattr(trajectory, 'ext', None) == 'pdb'):
+            raise ValueError(
+                f'can not build a subset topology for '
+                f'{type(trajectory).__name__}')
+        self.trajectory = trajectory
+        self.atom_indices = np.unique(np.asarray(atom_indices, dtype=np.intp))
+        self.ext = 'pdb'
+        self.params = getattr(trajectory, 'params', {})
+        self.id = str(uuid.uuid4())
+
+    def get_coordinates(self, index):
+        reader = thread_safe_reader(self.trajectory)
+        return np.asarray(reader.get_coordinates(index))[self.atom_indices]
+
+    def get_coordinates_batch(self, indices):
+        reader = thread_safe_reader(self.trajectory)
+        if hasattr(reader, 'get_coordinates_batch'):
+            xyz = reader.get_coordinates_batch(indices)
+        else:
+            xyz = Trajectory.get_coordinates_batch(reader, indices)
+        return xyz[:, self.atom_indices] if len(xyz) else xyz
+
+    @property
+    def n_frames(self):
+        return self.trajectory.n_frames
+
+    def _get_topology(self):
+        if hasattr(self.trajectory, '_get_topology'):
+            topology = self.trajectory._get_topology()
+        else:
+            topology = read_pdb(self.trajectory.get_structure_string())
+        indices = self.atom_indices
+        subset = {
+            key: None if value is None else np.asarray(value)[indices]
+            for key, value in topology.items()
+            if key not in ('bonds', 'bond_orders', 'box')
+        }
+        subset['box'] = topology.get('box')
+        bonds = topology.get('bonds')
+        if bonds is not None:
+            # keep bonds within the subset, renumbered
+            bonds = np.asarray(bonds, dtype=np.int64).reshape(-1, 2)
+            local = np.full(len(topology['xyz']), -1, dtype=np.int64)
+            local[indices] = np.arange(len(indices))
+            bonds = local[bonds]
+            keep = (bonds >= 0).all(axis=1)
+            subset['bonds'] = bonds[keep]
+            if topology.get('bond_orders') is not None:
+                subset['bond_orders'] = np.asarray(
+                    topology['bond_orders'])[keep]
+        return subset
+
+    def _get_fingerprint(self):
+        if hasattr(self.trajectory, '_get_fingerprint'):
+            parent = self.trajectory._get_fingerprint()
+        else:
+            parent = self.id
+        return (parent, hash_array(self.atom_indices))
+
+    @_cached_structure
+    def get_structure_string(self):
+        return _write_structure(self, **self._get_topology())
+
+    @_cached_structure
+    def get_structure_buffer(self):
+        return write_mmtf(**self._get_topology())
+
+
+class ConcatTrajectory(Trajectory):
+    '''Several trajectories (e.g. restarts or replicas with the same
+    topology) shown as one timeline.
+
+    Segments given as callables are opened on first use. At most `max_open`
+    of them are kept open, the least recently used one is closed (if it has
+    a `close` method) and dropped when another one is opened. The structure
+    and other attributes are those of the first segment. Segments must have
+    the same number of atoms, ValueError is raised when one that does not is
+    opened.
+
+    Parameters
+    ----------
+    segments : list of nglview.Trajectory or callables returning one
+    n_frames : list of int, optional
+        Number of frames per segment. If not given, each lazy segment is
+        opened once to count its frames.
+    max_open : int, default 16
+
+    Examples
+    --------
+    >>> import functools
+    >>> import nglview as nv
+    >>> files = ['run0.xtc', 'run1.xtc', 'run2.xtc'] # doctest: +SKIP
+    >>> t = nv.ConcatTrajectory([
+    ...     functools.partial(nv.FileTrajectory, fn, 'top.gro') for fn in files
+    ... ], max_open=2)
+    >>> w = nv.NGLWidget(t)
+    '''
+
+    def __init__(self, segments, n_frames=None, max_open=16):
+        if not segments:
+            raise ValueError('need at least one segment')
+        if max_open < 1:
+            raise ValueError('max_open must be at least 1')
+        self._segments = list(segments)
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        # atoms of the first segment opened, the other ones must match
+        self._n_atoms = None
+        self._checked = set()
+        self.id = str(uuid.uuid4())
+        if n_frames is None:
+            n_frames = [self._get_segment(i).n_frames
+                        for i in range(len(self._segments))]
+        if len(n_frames) != len(self._segments):
+            raise ValueError('need one n_frames per segment')
+        # offsets[i] is the first (global) frame of segment i
+        self.offsets = np.cumsum([0] + list(n_frames))
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the trajectory itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._get_segment(0), name)
+
+    def _check_atoms(self, index, segment):
+        if index in self._checked:
+            return
+        n_atoms = getattr(segment, 'n_atoms', None)
+        if n_atoms is None:
+            n_atoms = len(segment.get_coordinates(0))
+        if self._n_atoms is None:
+            self._n_atoms = n_atoms
+        elif n_atoms != self._n_atoms:
+            raise ValueError(f'segment {index} has {n_atoms} atoms, '
+                             f'expected {self._n_atoms}')
+        self._checked.add(index)
+
+    def _get_segment(self, index):
+        segment = self._segments[index]
+        if not callable(segment):
+            with self._lock:
+                self._check_atoms(index, segment)
+            return segment
+        with self._lock:
+            if index in self._open:
+                self._open.move_to_end(index)
+                return self._open[index]
+            opened = segment()
+            try:
+                self._check_atoms(index, opened)
+            except ValueError:
+                if hasattr(opened, 'close'):
+                    opened.close()
+                raise
+            self._open[index] = opened
+            while len(self._open) > self.max_open:
+                _, old = self._open.popitem(last=False)
+                if hasattr(old, 'close'):
+                    old.close()
+            return opened
+
+    def _locate(self, index):
+        # global frame -> (segment, frame in segment)
+        if index < 0:
+            index += self.n_frames
+        if not 0 <= index < self.n_frames:
+            raise IndexError(f'frame {index} out of range')
+        segment = bisect.bisect_right(self.offsets, index) - 1
+        return segment, index - int(self.offsets[segment])
+
+    @property
+    def n_frames(self):
+        return int(self.offsets[-1])
+
+    def get_coordinates(self, index):
+        segment, local = self._locate(index)
+        return self._get_segment(segment).get_coordinates(local)
+
+    def get_coordinates_batch(self, indices):
+        located = [self._locate(index) for index in indices]
+        if not located:
+            return np.empty((0, 0, 3), dtype='f4')
+        by_segment = OrderedDict()
+        for position, (segment, local) in enumerate(located):
+            by_segment.setdefault(segment, []).append((position, local))
+        out = None
+        for segment, items in by_segment.items():
+            traj = self._get_segment(segment)
+            local = [local for _, local in items]
+            if hasattr(traj, 'get_coordinates_batch'):
+                xyz = traj.get_coordinates_batch(local)
+            else:
+                xyz = Trajectory.get_coordinates_batch(traj, local)
+            if out is None:
+                out = np.empty((len(located), ) + xyz.shape[1:], dtype='f4')
+            out[[position for position, _ in items]] = xyz
+        return out
+
+    def close(self):
+        """Close all open lazy segments"""
+        with self._lock:
+            for segment in self._open.values():
+                if hasattr(segment, 'close'):
+                    segment.close()
+            self._open.clear()
+
+
 @register_backend('mdtraj')
 class MDTrajTrajectory(Trajectory, Structure):
     '''mdtraj adaptor.
@@ -319,6 +904,8 @@ class MDTrajTrajectory(Trajectory, Structure):
     >>> w = nv.NGLWidget(t)
     >>> w
     '''
+    # frames are read from the in-memory array, each into a new one
+    concurrency = 'thread-safe'
 
     def __init__(self, trajectory):
         self.trajectory = trajectory
@@ -327,14 +914,37 @@ class MDTrajTrajectory(Trajectory, Structure):
         self.id = str(uuid.uuid4())
 
     def get_coordinates(self, index):
-        return 10 * self.trajectory.xyz[index]
+        # nm -> angstrom
+        return self.trajectory.xyz[index] * 10
+
+    def get_coordinates_batch(self, indices):
+        xyz = self.trajectory.xyz[np.asarray(indices, dtype=int)]
+        xyz *= 10
+        return xyz
 
     @property
     def n_frames(self):
         return self.trajectory.n_frames
 
+    def _get_topology(self):
+        return _get_mdtraj_topology(self.trajectory)
+
+    def _select_atoms(self, selection):
+        return self.trajectory.topology.select(selection)
+
+    def _get_fingerprint(self):
+        top = self.trajectory.topology
+        return (top.n_atoms, top.n_bonds,
+                hash_strings([residue.name for residue in top.residues]),
+                hash_array(self.trajectory.xyz[0]))
+
+    @_cached_structure
     def get_structure_string(self):
-        return _get_structure_string(self.trajectory[0].save_pdb)
+        return _write_structure(self, **self._get_topology())
+
+    @_cached_structure
+    def get_structure_buffer(self):
+        return write_mmtf(**self._get_topology())
 
 
 @register_backend('pytraj')
@@ -360,12 +970,54 @@ class PyTrajTrajectory(Trajectory, Structure):
     def get_coordinates(self, index):
         return self.trajectory[index].xyz
 
+    def get_coordinates_batch(self, indices):
+        return self.trajectory[list(indices)].xyz.astype('f4', copy=False)
+
     @property
     def n_frames(self):
         return self.trajectory.n_frames
 
+    def _get_topology(self, index=0):
+        top = self.trajectory.top
+        residues = list(top.residues)
+        atoms = list(top.atoms)
+        bonds = top.bond_indices
+        frame = self.trajectory[index]
+        # chain IDs are only known with topologies from PDB/mmCIF files
+        # (and pytraj versions that expose them), leave them blank otherwise
+        chains = [
+            getattr(residues[atom.resid], 'chain', '').strip()
+            for atom in atoms
+        ]
+        # cpptraj names unknown elements '??'
+        elements = [
+            getattr(atom, 'element', '').strip().strip('?') for atom in atoms
+        ]
+        return dict(names=[atom.name for atom in atoms],
+                    resnames=[residues[atom.resid].name for atom in atoms],
+                    resids=[atom.resid + 1 for atom in atoms],
+                    chains=chains if any(chains) else None,
+                    elements=elements if any(elements) else None,
+                    bonds=bonds if len(bonds) else None,
+                    box=frame.box.values if top.has_box() else None,
+                    xyz=frame.xyz)
+
+    def _select_atoms(self, selection):
+        return self.trajectory.top.select(selection)
+
+    def _get_fingerprint(self):
+        top = self.trajectory.top
+        return (top.n_atoms, len(top.bond_indices),
+                hash_strings([residue.name for residue in top.residues]),
+                hash_array(self.trajectory[0].xyz))
+
+    @_cached_structure
     def get_structure_string(self, index=0):
-        return _get_structure_string(self.trajectory[index:index + 1].save)
+        return _write_structure(self, **self._get_topology(index))
+
+    @_cached_structure
+    def get_structure_buffer(self, index=0):
+        return write_mmtf(**self._get_topology(index))
 
 
 @register_backend('parmed')
@@ -373,39 +1025,67 @@ class ParmEdStructure(Structure):
     def __init__(self, structure):
         self._structure = structure
         self.only_save_1st_model = True
+        self.ext = 'pdb'
 
+    def _get_fingerprint(self):
+        structure = self._structure
+        return (len(structure.atoms), len(structure.bonds),
+                self.only_save_1st_model,
+                hash_strings([residue.name for residue in structure.residues]),
+                hash_array(structure.coordinates))
+
+    @_cached_structure
     def get_structure_string(self):
         # only write 1st model
-        with mkstemp_wrapper(suffix='.pdb') as fname:
-            if self.only_save_1st_model:
-                self._structure.write_pdb(
-                    fname, coordinates=self._structure.coordinates)
-            else:
-                self._structure.write_pdb(fname)
-            with open(fname) as fh:
-                return fh.read()
+        if self.only_save_1st_model:
+            return _get_structure_string(
+                lambda fh: self._structure.write_pdb(
+                    fh, coordinates=self._structure.coordinates))
+        return _get_structure_string(self._structure.write_pdb)
+
+
+# a module lock keeps ParmEdTrajectory picklable (worker processes)
+_parmed_load_lock = threading.Lock()
 
 
 @register_backend('parmed')
 class ParmEdTrajectory(Trajectory, ParmEdStructure):
     '''ParmEd adaptor.
     '''
+    # frames are read from the in-memory array, each into a new one
+    concurrency = 'thread-safe'
 
     def __init__(self, trajectory):
         ParmEdStructure.__init__(self, trajectory)
         self.trajectory = self._structure = trajectory
         self.ext = "pdb"
         self.params = {}
-        # only call get_coordinates once
-        self._xyz = trajectory.get_coordinates()
+        self._xyz = None
         self.id = str(uuid.uuid4())
 
+    def _get_xyz(self):
+        # ParmEd's get_coordinates loops over all atoms in Python, only call
+        # it once, and only when a frame is needed
+        with _parmed_load_lock:
+            if self._xyz is None:
+                self._xyz = self.trajectory.get_coordinates()
+        return self._xyz
+
     def get_coordinates(self, index):
-        return self._xyz[index]
+        # float64 -> float32
+        return self._get_xyz()[index].astype('f4')
+
+    def get_coordinates_batch(self, indices):
+        return self._get_xyz()[np.asarray(indices, dtype=int)].astype('f4')
 
     @property
     def n_frames(self):
-        return len(self._xyz)
+        if self._xyz is None:
+            # avoid loading the coordinates just to count frames
+            coordinates = getattr(self.trajectory, '_coordinates', None)
+            if coordinates is not None:
+                return len(coordinates)
+        return len(self._get_xyz())
 
 
 @register_backend('MDAnalysis')
@@ -430,34 +1110,121 @@ class MDAnalysisTrajectory(Trajectory, Structure):
         self.ext = "pdb"
         self.params = {}
         self.id = str(uuid.uuid4())
+        self._reader = None
+
+    def _get_reader(self):
+        # A private copy of the reader: playback does not move the user's
+        # Universe to another frame, and we know where our reader is.
+        if self._reader is None:
+            trajectory = self.atomgroup.universe.trajectory
+            if self._in_memory(trajectory):
+                # copying would copy all coordinates, frames are read from
+                # the user's array without moving the reader
+                self._reader = trajectory
+                return self._reader
+            try:
+                self._reader = trajectory.copy()
+            except (AttributeError, NotImplementedError, TypeError):
+                # e.g. streaming readers, share (and move) the user's one
+                self._reader = trajectory
+        return self._reader
+
+    @staticmethod
+    def _in_memory(reader):
+        # MemoryReader (Universe(..., in_memory=True))
+        return hasattr(reader, 'stored_order') and hasattr(reader, 'get_array')
+
+    @property
+    def concurrency(self):
+        # each thread can copy the reader, unless it can not be copied
+        reader = self._get_reader()
+        if self._in_memory(reader):
+            return 'thread-safe'
+        if reader is self.atomgroup.universe.trajectory:
+            return 'lock'
+        return 'clone'
+
+    def clone(self):
+        return MDAnalysisTrajectory(self.atomgroup)
 
     def get_coordinates(self, index):
-        self.atomgroup.universe.trajectory[index]
-        xyz = self.atomgroup.atoms.positions
-        return xyz
+        reader = self._get_reader()
+        if self._in_memory(reader):
+            order = reader.stored_order
+            xyz = np.take(reader.get_array(), index, axis=order.index('f'))
+            if order.replace('f', '') == 'ca':
+                xyz = xyz.T
+            return xyz[self.atomgroup.atoms.ix]
+        if index < 0:
+            index += reader.n_frames
+        if index == reader.ts.frame:
+            ts = reader.ts
+        elif index == reader.ts.frame + 1:
+            # sequential read, much cheaper than seeking (e.g. xtc)
+            ts = next(reader)
+        else:
+            ts = reader[index]
+        return ts.positions[self.atomgroup.atoms.ix]
 
     @property
     def n_frames(self):
         return self.atomgroup.universe.trajectory.n_frames
 
-    def get_structure_string(self):
-        try:
-            import MDAnalysis as mda
-        except ImportError:
-            raise ImportError(
-                "'MDAnalysisTrajectory' requires the 'MDAnalysis' package")
+    def _get_topology(self):
         u = self.atomgroup.universe
-        u.trajectory[0]
-        f = mda.lib.util.NamedStream(StringIO(), 'tmp.pdb')
         atoms = self.atomgroup.atoms
-        # add PDB output to the named stream
-        with mda.Writer(f, atoms.n_atoms, multiframe=False) as w:
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore')
-                w.write(atoms)
-        # extract from the stream
-        pdb_string = f.read()
-        return pdb_string
+        # optional topology attributes raise NoDataError (an AttributeError)
+        if hasattr(atoms, 'chainIDs'):
+            chains = atoms.chainIDs
+        elif hasattr(atoms, 'segids'):
+            chains = [segid[:1] for segid in atoms.segids]
+        else:
+            chains = None
+        bonds = None
+        if hasattr(atoms, 'intra_bonds') and len(atoms.intra_bonds):
+            # universe atom indices -> positions in the atom group
+            local = np.empty(len(u.atoms), dtype=np.int64)
+            local[atoms.ix] = np.arange(len(atoms))
+            bonds = local[atoms.intra_bonds.indices]
+        xyz = self.get_coordinates(0)
+        reader = self._get_reader()
+        if self._in_memory(reader):
+            dimensions = getattr(reader, 'dimensions_array', None)
+            box = None if dimensions is None else dimensions[0]
+        else:
+            # the reader is at frame 0 now
+            box = reader.ts.dimensions
+        return dict(names=atoms.names,
+                    resnames=atoms.resnames,
+                    resids=atoms.resids,
+                    chains=chains,
+                    elements=atoms.elements
+                    if hasattr(atoms, 'elements') else None,
+                    hetero=(atoms.record_types == 'HETATM')
+                    if hasattr(atoms, 'record_types') else None,
+                    bonds=bonds,
+                    box=box,
+                    xyz=xyz)
+
+    def _select_atoms(self, selection):
+        atoms = self.atomgroup.atoms
+        # universe atom indices -> positions in the atom group
+        local = np.empty(len(atoms.universe.atoms), dtype=np.int64)
+        local[atoms.ix] = np.arange(len(atoms))
+        return local[atoms.select_atoms(selection).ix]
+
+    def _get_fingerprint(self):
+        atoms = self.atomgroup.atoms
+        return (hash_array(atoms.ix), hash_strings(atoms.names),
+                hash_array(self.get_coordinates(0)))
+
+    @_cached_structure
+    def get_structure_string(self):
+        return _write_structure(self, **self._get_topology())
+
+    @_cached_structure
+    def get_structure_buffer(self):
+        return write_mmtf(**self._get_topology())
 
 
 @register_backend('htmd')
@@ -485,12 +1252,48 @@ class HTMDTrajectory(Trajectory):
     def get_coordinates(self, index):
         return np.squeeze(self.mol.coords[:, :, index])
 
+    def get_coordinates_batch(self, indices):
+        xyz = self.mol.coords[:, :, np.asarray(indices, dtype=int)]
+        return np.ascontiguousarray(xyz.transpose(2, 0, 1), dtype='f4')
+
     @property
     def n_frames(self):
         return self.mol.numFrames
 
+    def _get_topology(self):
+        mol = self.mol
+        return dict(names=mol.name,
+                    resnames=mol.resname,
+                    resids=mol.resid,
+                    chains=mol.chain,
+                    elements=mol.element,
+                    hetero=mol.record == 'HETATM',
+                    bonds=mol.bonds if len(mol.bonds) else None,
+                    box=self._get_box(),
+                    xyz=mol.coords[:, :, 0])
+
+    def _get_box(self):
+        mol = self.mol
+        if not mol.box.size:
+            return None
+        # boxangles is missing in older HTMD versions
+        angles = getattr(mol, 'boxangles', None)
+        return _get_box(mol.box[:, 0],
+                        None if angles is None else angles[:, 0])
+
+    def _get_fingerprint(self):
+        mol = self.mol
+        return (hash_array(mol.name), hash_array(mol.resname),
+                hash_array(mol.resid), hash_array(mol.bonds),
+                hash_array(mol.coords[:, :, 0]))
+
+    @_cached_structure
     def get_structure_string(self):
-        return _get_structure_string(self.mol.write)
+        return _write_structure(self, **self._get_topology())
+
+    @_cached_structure
+    def get_structure_buffer(self):
+        return write_mmtf(**self._get_topology())
 
 
 @register_backend('ase')
@@ -518,7 +1321,7 @@ class ASETrajectory(Trajectory, Structure):
         return self.trajectory[index].positions
 
     def get_structure_string(self):
-        return _get_structure_string(self.trajectory[0].write)
+        return _get_ase_structure_string(self.trajectory[0])
 
     @property
     def n_frames(self):
@@ -537,23 +1340,18 @@ class SchrodingerStructure(Structure):
         self.params = {}
         self._schrodinger_structure = structure
 
+    def _get_topology(self):
+        return _get_schrodinger_topology(self._schrodinger_structure)
+
     def get_structure_string(self):
-        # NOTE: For some reasons, _get_structure_string always return
-        # empty string in this case.
-        with tempfolder():
-            pdb_fn = 'tmp.pdb'
-            self._schrodinger_structure.write(pdb_fn)
-            with open(pdb_fn) as fh:
-                content = fh.read()
-        return content
+        return _write_structure(self, **self._get_topology())
 
-        return _get_structure_string(self._schrodinger_structure.write)
+    def get_structure_buffer(self):
+        return write_mmtf(**self._get_topology())
 
 
 @register_backend('schrodinger')
 class SchrodingerTrajectory(SchrodingerStructure, Trajectory):
-    """Require `parmed` package.
-    """
 
     def __init__(self, structure, traj):
         super().__init__(structure)
@@ -566,22 +1364,10 @@ class SchrodingerTrajectory(SchrodingerStructure, Trajectory):
     def get_coordinates(self, index):
         return self._traj[index].pos()
 
-    def get_structure_string(self):
-        """Require `parmed` package.
-        """
-        import parmed as pmd
+    def _get_topology(self):
         c = self._schrodinger_structure
-        s = pmd.Structure()
         fsys = c.fsys_ct if hasattr(c, 'fsys_ct') else c
-        for atom in fsys.atom:
-            parm_atom = pmd.Atom(name=atom.pdbname.strip(),
-                                 atomic_number=atom.atomic_number)
-            s.add_atom(parm_atom,
-                       atom.pdbres.strip(),
-                       atom.resnum,
-                       chain=atom.chain)
-        s.coordinates = fsys.getXYZ()
-        return ParmEdStructure(s).get_structure_string()
+        return _get_schrodinger_topology(fsys)
 
     @classmethod
     def from_files(cls, cms_fname, traj_fname):
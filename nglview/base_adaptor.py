@@ -1,8 +1,11 @@
+import threading
 import uuid
+
+import numpy as np
 """abstract base class.
 """
 
-__all__ = ['Structure', 'Trajectory']
+__all__ = ['Structure', 'Trajectory', 'thread_safe_reader']
 
 
 class Structure:
@@ -20,7 +23,15 @@ class Structure:
 
 class Trajectory:
     """abstract base class
+
+    `concurrency` tells how `get_coordinates` may be called from several
+    threads (prefetching, movie making...), see `thread_safe_reader`:
+
+    - 'thread-safe': no mutable reader state, calls may run in parallel
+    - 'lock': calls are serialized with a per-adaptor lock (default)
+    - 'clone': each thread reads from its own copy made by `clone()`
     """
+    concurrency = 'lock'
 
     def __init__(self):
         self.id = str(uuid.uuid4())
@@ -29,11 +40,118 @@ class Trajectory:
     def get_coordinates(self, index):
         raise NotImplementedError()
 
+    def clone(self):
+        """Independent adaptor for the same data, for `concurrency='clone'`"""
+        raise NotImplementedError()
+
+    def get_coordinates_batch(self, indices):
+        """Coordinates of several frames at once.
+
+        The default loops over `get_coordinates`; adaptors override it when
+        their backend can read many frames in one call.
+
+        Parameters
+        ----------
+        indices : array-like of int
+
+        Returns
+        -------
+        numpy.ndarray, shape=(len(indices), n_atoms, 3), dtype=float32
+        """
+        out = None
+        # copy each frame right away, `get_coordinates` may reuse its array
+        for i, index in enumerate(indices):
+            xyz = self.get_coordinates(index)
+            if out is None:
+                out = np.empty((len(indices), ) + np.shape(xyz), dtype='f4')
+            out[i] = xyz
+        if out is None:
+            return np.empty((0, 0, 3), dtype='f4')
+        return out
+
     @property
     def n_frames(self):
         raise NotImplementedError()
 
 
+class _LockedReader:
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+        self._lock = threading.RLock()
+
+    def __reduce__(self):
+        # a pickled adaptor (e.g. sent to a worker process) gets a new lock
+        return type(self), (self.trajectory, )
+
+    @property
+    def n_frames(self):
+        return self.trajectory.n_frames
+
+    def get_coordinates(self, index):
+        with self._lock:
+            # copy while holding the lock, the adaptor may reuse its array
+            return np.array(self.trajectory.get_coordinates(index))
+
+    def get_coordinates_batch(self, indices):
+        with self._lock:
+            if hasattr(self.trajectory, 'get_coordinates_batch'):
+                return np.array(self.trajectory.get_coordinates_batch(indices))
+            return Trajectory.get_coordinates_batch(self.trajectory, indices)
+
+
+class _CloningReader:
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+        self._local = threading.local()
+
+    def __reduce__(self):
+        return type(self), (self.trajectory, )
+
+    def _get_clone(self):
+        clone = getattr(self._local, 'trajectory', None)
+        if clone is None:
+            clone = self._local.trajectory = self.trajectory.clone()
+        return clone
+
+    @property
+    def n_frames(self):
+        return self.trajectory.n_frames
+
+    def get_coordinates(self, index):
+        return self._get_clone().get_coordinates(index)
+
+    def get_coordinates_batch(self, indices):
+        return self._get_clone().get_coordinates_batch(indices)
+
+
+_READERS = {'lock': _LockedReader, 'clone': _CloningReader}
+_readers_lock = threading.Lock()
+
+
+def thread_safe_reader(trajectory):
+    """Return an object with `get_coordinates`, `get_coordinates_batch` and
+    `n_frames` that can be used from any thread, honoring
+    `trajectory.concurrency`. The reader is created once per adaptor, so all
+    callers share its lock (or per-thread clones).
+
+    Parameters
+    ----------
+    trajectory : nglview.Trajectory or any object with `get_coordinates`
+    """
+    with _readers_lock:
+        reader = trajectory.__dict__.get('_thread_safe_reader')
+        if reader is None:
+            concurrency = getattr(trajectory, 'concurrency', 'lock')
+            if concurrency == 'thread-safe':
+                reader = trajectory
+            elif concurrency in _READERS:
+                reader = _READERS[concurrency](trajectory)
+            else:
+                raise ValueError(f'unknown concurrency {concurrency!r}')
+            trajectory.__dict__['_thread_safe_reader'] = reader
+    return reader
+
+
 __doc__ = """
 Extend NGLView classes
 
@@ -0,0 +1,95 @@
+"""Kernel wide registry of structure blobs.
+
+Each unique structure (text or binary) is held once, in its own `_Blob`
+widget, no matter how many NGLWidgets display it. Widgets only send a
+reference to the blob model, so the frontend receives the data once and
+can share the parsed structure between views. Blob widgets are referenced
+by `NGLWidget._ngl_blobs`, so they are part of the embedded widget state;
+`write_html(..., external_data_dir=...)` replaces their data by the `url` of
+a file in the embedded state.
+
+Each component loaded from a blob holds a reference to it. The blob widget
+is closed, and its data freed in the kernel and the frontend, once the
+components are removed and their views closed.
+"""
+import hashlib
+
+from ipywidgets import Widget
+from traitlets import Bool, Bytes, Unicode
+
+from ._frontend import __frontend_version__
+from .base import _singleton
+
+__all__ = ['BlobRegistry']
+
+
+class _Blob(Widget):
+    _model_name = Unicode("BlobModel").tag(sync=True)
+    _model_module = Unicode("nglview-js-widgets").tag(sync=True)
+    _model_module_version = Unicode(__frontend_version__).tag(sync=True)
+    # utf8 encoded for text, sent as a binary buffer
+    data = Bytes().tag(sync=True)
+    binary = Bool(False).tag(sync=True)
+
+    def __repr__(self):
+        kind = 'binary' if self.binary else 'text'
+        return f'<_Blob {kind}, {len(self.data)} bytes>'
+
+
+@_singleton
+class _BlobRegistry:
+    def __init__(self):
+        self._blobs = {}
+        self._counts = {}
+
+    def __len__(self):
+        return len(self._blobs)
+
+    @property
+    def nbytes(self):
+        return sum(len(blob.data) for blob in self._blobs.values())
+
+    def add(self, data, binary=False):
+        """Return the `_Blob` widget holding `data`, creating it if needed,
+        and take a reference to it (see `release`).
+
+        Parameters
+        ----------
+        data : str or bytes
+        binary : bool
+        """
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        key = (hashlib.sha1(data).hexdigest(), binary)
+        blob = self._blobs.get(key)
+        if blob is None:
+            blob = self._blobs[key] = _Blob(data=data, binary=binary)
+            blob._registry_key = key
+            self._counts[key] = 0
+        self._counts[key] += 1
+        return blob
+
+    def release(self, blob):
+        """Drop a reference taken by `add`, the blob widget is closed when
+        none is left.
+        """
+        key = blob._registry_key
+        if self._blobs.get(key) is not blob:
+            # cleared
+            return
+        self._counts[key] -= 1
+        if not self._counts[key]:
+            del self._blobs[key], self._counts[key]
+            blob.close()
+
+    def clear(self):
+        """Close all blob widgets. Views that are already displayed keep their
+        structures, but can not be embedded afterwards.
+        """
+        for blob in self._blobs.values():
+            blob.close()
+        self._blobs.clear()
+        self._counts.clear()
+
+
+BlobRegistry = _BlobRegistry()
@@ -6,12 +6,272 @@ except ImportError:
     print("pip install moviepy==0.2.2.11")
     print("pip install imageio==1.6")
 
+import functools
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from ipywidgets import Button, Output, IntProgress
 from itertools import tee
 
+from ..utils.py_utils import _image_from_msg
+
+# moviepy's `write_videofile` keywords that map to ffmpeg options
+_FFMPEG_OPTIONS = {
+    'codec': '-vcodec',
+    'bitrate': '-b:v',
+    'preset': '-preset',
+    'audio_codec': '-acodec',
+    'threads': '-threads',
+}
+
+
+def _ffmpeg_exe():
+    try:
+        # shipped with moviepy and imageio
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        exe = shutil.which('ffmpeg')
+        if exe is None:
+            raise RuntimeError(
+                'ffmpeg not found, install it or imageio-ffmpeg')
+        return exe
+
+
+def _to_rgb(image):
+    # PNG bytes or RGBA array (see `_image_from_msg`) -> (height, width, 3)
+    # uint8 RGB
+    import io
+    import numpy as np
+    from PIL import Image
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image[..., :3])
+    with Image.open(io.BytesIO(image)) as im:
+        return np.asarray(im.convert('RGB'))
+
+
+def _view_state_hash(view, render_params, perframe_hook=None):
+    """Hash of what a rendered frame depends on, but its coordinates (see
+    `_frame_digest`): components and representations, camera, stage
+    parameters, trajectories, `render_params` and the code of
+    `perframe_hook`. Structures are hashed by content, so the hash is the
+    same in a new kernel.
+    """
+    import hashlib
+    import json
+    from ipywidgets import Widget
+
+    def blob_digest(arg):
+        if isinstance(arg, dict) and arg.get('type') == 'blob_ref':
+            blob = Widget.widgets.get(arg['data'].replace('IPY_MODEL_', ''))
+            if blob is not None:
+                return dict(arg, data=hashlib.sha1(blob.data).hexdigest())
+        return arg
+
+    archive = [
+        dict(msg, args=[blob_digest(arg) for arg in msg.get('args', [])])
+        for msg in view._ngl_msg_archive
+    ]
+    trajectories = [(type(traj).__name__, getattr(traj, 'n_frames', None),
+                     traj.shown) for traj in view._trajlist]
+    code = getattr(perframe_hook, '__code__', None)
+    state = {
+        'msg_archive': archive,
+        'camera': view._camera_orientation,
+        'stage': view._ngl_full_stage_parameters,
+        'color_dict': view._ngl_color_dict,
+        'size': (view._view_width, view._view_height),
+        'trajectories': trajectories,
+        'interpolate': view.player.interpolate and view.player.iparams,
+        'render_params': render_params,
+        'perframe_hook': (code.co_code.hex() + repr(code.co_consts)
+                          if code is not None else repr(perframe_hook)),
+    }
+    text = json.dumps(state, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode('utf8')).hexdigest()[:16]
+
+
+def _frame_digest(view, frame):
+    """Hash of the coordinates of `frame` in the shown trajectories of
+    `view`: replicas or restarts sharing the view state (and the first
+    frame) do not share images.
+    """
+    import hashlib
+    import numpy as np
+    from ..base_adaptor import thread_safe_reader
+
+    digest = hashlib.sha1()
+    for traj in view._trajlist:
+        if not traj.shown:
+            continue
+        try:
+            xyz = thread_safe_reader(traj).get_coordinates(frame)
+        except (IndexError, ValueError):
+            continue
+        digest.update(np.ascontiguousarray(xyz, dtype='f4').tobytes())
+    return digest.hexdigest()[:16]
+
+
+class _FrameCache:
+    """Rendered frames on disk, one file per frame index and coordinates
+    (`frame_key(frame)`): PNG bytes as `000042-<key>.png`, RGBA arrays as
+    `000042-<key>.npy`. Files are written under a temporary name first, an
+    interrupted run never leaves a partial frame.
+    """
+    def __init__(self, folder, frame_key=None):
+        self.folder = folder
+        self.frame_key = frame_key
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, frame, ext):
+        name = f'{frame:06d}'
+        if self.frame_key is not None:
+            name += f'-{self.frame_key(frame)}'
+        return os.path.join(self.folder, f'{name}.{ext}')
+
+    def get(self, frame):
+        import numpy as np
+        path = self._path(frame, 'png')
+        if os.path.exists(path):
+            with open(path, 'rb') as fh:
+                return fh.read()
+        path = self._path(frame, 'npy')
+        if os.path.exists(path):
+            return np.load(path)
+        return None
+
+    def put(self, frame, image):
+        import numpy as np
+        if isinstance(image, np.ndarray):
+            path = self._path(frame, 'npy')
+            tmp = path + '.tmp.npy'
+            np.save(tmp, image)
+        else:
+            path = self._path(frame, 'png')
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(image)
+        os.replace(tmp, path)
+
+
+class _FFmpegWriter:
+    """Pipe RGB frames to an ffmpeg process, one at a time.
+
+    ffmpeg is started with the first frame, whose size is used for the
+    whole movie.
+    """
+
+    def __init__(self, output, fps, moviepy_params=None):
+        self.output = output
+        self.fps = fps
+        self.options = []
+        for key, value in (moviepy_params or {}).items():
+            if key == 'ffmpeg_params':
+                self.options.extend(value)
+            elif key in _FFMPEG_OPTIONS:
+                self.options.extend([_FFMPEG_OPTIONS[key], str(value)])
+            else:
+                raise ValueError(f"moviepy parameter '{key}' is not "
+                                 f"supported when streaming frames to ffmpeg")
+        self.size = None
+        self._process = None
+        self._log = None
+
+    def _start(self, height, width):
+        command = [
+            _ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r',
+            str(self.fps), '-i', '-'
+        ]
+        if not self.output.endswith('.gif'):
+            # most players need yuv420p, which needs an even size
+            command += [
+                '-pix_fmt', 'yuv420p', '-vf',
+                'pad=ceil(iw/2)*2:ceil(ih/2)*2'
+            ]
+        command += self.options + [self.output]
+        self._log = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=self._log)
+        self.size = (height, width)
+
+    def write(self, rgb):
+        if self._process is None:
+            self._start(*rgb.shape[:2])
+        if rgb.shape[:2] != self.size:
+            raise ValueError(f'frame of size {rgb.shape[:2]}, the movie has '
+                             f'{self.size}')
+        self._process.stdin.write(rgb.tobytes())
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        self._log.seek(0)
+        log = self._log.read().decode(errors='replace')
+        self._log.close()
+        self._process = None
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg failed: {log}')
+
+
+class _EncodingPipeline:
+    """Decode PNG frames in a thread pool and feed them, in order, to
+    `writer` from a background thread, while the next frames are rendered.
+
+    At most `max_pending` frames wait for the writer; `submit` blocks beyond
+    that, so memory stays bounded when encoding is slower than rendering.
+    """
+
+    def __init__(self, writer, n_workers=None, max_pending=8):
+        self.writer = writer
+        self.error = None
+        self._executor = ThreadPoolExecutor(
+            n_workers or min(4, os.cpu_count() or 1))
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            future = self._queue.get()
+            if future is None:
+                return
+            if self.error is not None:
+                # drain after an error
+                continue
+            try:
+                self.writer.write(future.result())
+            except Exception as error:
+                self.error = error
+
+    def submit(self, image):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(self._executor.submit(_to_rgb, image))
+
+    def close(self):
+        """Wait for the pending frames and close the writer"""
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown()
+        try:
+            self.writer.close()
+        except Exception as error:
+            if self.error is None:
+                self.error = error
+        if self.error is not None:
+            raise self.error
+
 
 class MovieMaker:
     """ Unstable API
@@ -37,9 +297,12 @@ class MovieMaker:
         if True, do not render any frame and uses existings images in `download_folder`
         for movie making.
         if False, perform rendering first.
-    timeout : a number (second), default 0.1
-        The waiting time between rendering two consecutive frames.
-        This option should be only used with `perframe_hook` option.
+    timeout : a number (second) or None, default 60
+        frames are rendered once the frontend acknowledges that the frame
+        and the changes of `perframe_hook` are drawn. `timeout` only guards
+        against waiting forever for that acknowledgement (e.g. the view is
+        not displayed, or the frontend is too old to send it): a warning is
+        logged and rendering goes on. None waits for it.
     render_params : dict or None, default None
         NGL rendering params. see NGLWidget.download_image.
         If None, use default values
@@ -51,6 +314,33 @@ class MovieMaker:
         if True, keep all image data in memory (good for small video)
     perframe_hook : callable with `view` as a single argument, default None
         if given, update the `view` by `perframe_hook`.
+    streaming : bool, default False
+        if True, `make` decodes each frame as it arrives and pipes it to
+        ffmpeg, memory does not grow with the number of frames. Only the
+        'codec', 'bitrate', 'preset', 'audio_codec', 'threads' and
+        'ffmpeg_params' items of `moviepy_params` are supported, and GIFs are
+        written by ffmpeg too.
+        if False, keep all frames and write the movie with moviepy at the end.
+    pipeline_depth : int, default 2
+        number of frames whose coordinates are sent to the frontend ahead of
+        the images coming back, so rendering, transfer and encoding overlap.
+        1 (one frame at a time) with `perframe_hook`, which must see the
+        frame being rendered.
+    n_workers : int or None, default None
+        number of threads decoding rendered frames (default: up to 4).
+    image_format : {'png', 'rgba'}, default 'png'
+        how the frontend sends rendered frames. 'rgba' sends raw pixels:
+        more data to transfer, no PNG decoding in the kernel.
+    cache_dir : str or None, default None
+        if given, `make` saves every rendered frame to
+        `cache_dir/<view state hash>/` as it arrives and takes the frames
+        found there instead of rendering them again: an interrupted run
+        resumes where it stopped, and changing only the output or the
+        encoding (fps, moviepy_params, ...) renders nothing. The hash covers
+        the components, representations, camera, trajectories,
+        `render_params` and the code of `perframe_hook`, but not what the
+        hook reads from elsewhere; a cached frame is only used for the same
+        coordinates.
 
     Examples
     --------
@@ -98,11 +388,16 @@ class MovieMaker:
                  stop=-1,
                  step=1,
                  skip_render=False,
-                 timeout=0.1,
+                 timeout=60,
                  in_memory=False,
                  perframe_hook=None,
                  render_params=None,
-                 moviepy_params=None):
+                 moviepy_params=None,
+                 streaming=False,
+                 pipeline_depth=2,
+                 n_workers=None,
+                 image_format='png',
+                 cache_dir=None):
         if download_folder is None:
             download_folder = os.getenv('HOME', '') + '/Downloads/'
         self.view = view
@@ -117,18 +412,31 @@ class MovieMaker:
         self.moviepy_params = moviepy_params or {}
         self.perframe_hook = perframe_hook
         self.output = output
+        self.streaming = streaming
+        self.pipeline_depth = pipeline_depth
+        self.n_workers = n_workers
+        self.image_format = image_format
+        self.cache_dir = cache_dir
         if stop < 0:
             stop = self.view.max_frame + 1
         self._time_range = range(start, stop, step)
         self._iframe = iter(self._time_range)
-        self._progress = IntProgress(max=len(self._time_range) - 1)
+        self._progress = IntProgress(max=len(self._time_range),
+                                     style={'description_width': 'initial'})
         self._woutput = Output()
         self._event = threading.Event()
         self._thread = None
         self._image_array = []
 
-    def sleep(self):
-        time.sleep(self.timeout)
+    def _wait_rendered(self, event):
+        # block until the frontend has drawn everything sent so far, at
+        # most `self.timeout`, or until interrupted; not on the kernel's
+        # main thread, which receives the ack
+        rendered = threading.Event()
+        self.view._on_rendered(rendered.set, timeout=self.timeout)
+        while not rendered.wait(0.1):
+            if event.is_set():
+                return
 
     def make_old_impl(self, in_memory=False):
         # TODO : make base class so we can reuse this with sandbox/base.py
@@ -144,17 +452,17 @@ class MovieMaker:
                     progress.value = i
                     if not event.is_set():
                         self.view.frame = i
-                        self.sleep()
                         if self.perframe_hook:
                             self.perframe_hook(self.view)
-                        self.sleep()
+                        self._wait_rendered(event)
                         if not self.in_memory:
                             self.view.download_image(
                                 self.prefix + '.' + str(i) + '.png',
                                 **self.render_params)
                         else:
                             iw = self.view.render_image(**self.render_params)
-                        self.sleep()
+                        # after the download, or the image is back
+                        self._wait_rendered(event)
                         if self.in_memory:
                             rgb = self._base64_to_ndarray(
                                 self.view._image_data)
@@ -209,56 +517,151 @@ class MovieMaker:
         self._woutput.clear_output()
         image_array = []
         iframe = iter(self._time_range)
-        frame = next(iframe)
-
-        def hook(frame):
-            self.view.frame = frame
-            time.sleep(self.timeout)
-            self.perframe_hook(self.view)
-            time.sleep(self.timeout)
-
-        # trigger movie making communication between backend and frontend
-        self.perframe_hook and hook(frame)
-        self.view._set_coordinates(
-            frame, movie_making=True, render_params=self.render_params)
-        self._progress.description = 'Rendering ...'
+        pipeline = None
+        if movie and self.streaming:
+            pipeline = _EncodingPipeline(
+                _FFmpegWriter(self.output, self.fps, self.moviepy_params),
+                n_workers=self.n_workers)
+        n_frames = len(self._time_range)
+        # frames sent to the frontend before their image came back; the
+        # frontend renders them one after the other
+        depth = 1 if self.perframe_hook else max(self.pipeline_depth, 1)
+        render_params = dict(self.render_params, format=self.image_format)
+        cache = None
+        if self.cache_dir is not None:
+            cache = _FrameCache(
+                os.path.join(
+                    self.cache_dir,
+                    _view_state_hash(self.view, render_params,
+                                     self.perframe_hook)),
+                # looked up, then written once rendered
+                functools.lru_cache(maxsize=64)(
+                    functools.partial(_frame_digest, self.view)))
+        # [frame, image] in movie order, image is None while rendering
+        pending = deque()
+        start_time = time.time()
+        self._progress.value = 0
 
-        def on_msg(widget, msg, _):
-            if msg['type'] == 'movie_image_data':
-                image_array.append(msg.get('data'))
-                try:
-                    frame = next(iframe)
-                    self.perframe_hook and hook(frame)
-                    self.view._set_coordinates(
-                        frame,
-                        movie_making=True,
-                        render_params=self.render_params)
-                    self._progress.value = frame
-                except StopIteration:
-                    if movie:
-                        self._progress.description = 'Making movie...'
-                        with self._woutput:
-                            # suppress moviepy's log
-                            self._make_from_array(image_array)
-                        if not os.path.exists(self.output):
-                            self._progress.description = "ERROR: Check the maker's log"
+        def render(frame):
+            self.view._set_coordinates(frame,
+                                       movie_making=True,
+                                       render_params=render_params)
+
+        def request(frame):
+            # trigger movie making communication between backend and frontend
+            if self.perframe_hook:
+                self.view.frame = frame
+                self.perframe_hook(self.view)
+                # render once the hook's changes are drawn
+                self.view._on_rendered(lambda: render(frame),
+                                       timeout=self.timeout)
+            else:
+                render(frame)
+
+        def consume(image):
+            if keep_data or (movie and pipeline is None):
+                image_array.append(image)
+            if pipeline is not None:
+                pipeline.submit(image)
+            n_done = self._progress.value = self._progress.value + 1
+            eta = (time.time() - start_time) / n_done * (n_frames - n_done)
+            self._progress.description = (
+                f'Rendering {n_done}/{n_frames}, ETA '
+                f'{int(eta // 60):02d}:{int(eta % 60):02d}')
+
+        def advance():
+            # take the images at the head of `pending`, then the next frames:
+            # from the cache, or rendered, `depth` at a time
+            while True:
+                while pending and pending[0][1] is not None:
+                    consume(pending.popleft()[1])
+                n_rendering = sum(image is None for _, image in pending)
+                if n_rendering >= depth or len(pending) >= depth + 8:
+                    return
+                frame = next(iframe, None)
+                if frame is None:
+                    return
+                image = cache.get(frame) if cache is not None else None
+                pending.append([frame, image])
+                if image is None:
+                    request(frame)
+
+        def fail(error):
+            try:
+                self._progress.description = "ERROR: Check the maker's log"
+                with self._woutput:
+                    print(error)
+                    if pipeline is not None:
+                        try:
+                            pipeline.close()
+                        except Exception as close_error:
+                            # e.g. ffmpeg's log
+                            if close_error is not error:
+                                print(close_error)
+            finally:
+                self._remove_on_msg()
+
+        def finish():
+            try:
+                if movie:
+                    self._progress.description = 'Making movie...'
+                    try:
+                        if pipeline is not None:
+                            pipeline.close()
                         else:
-                            self._progress.description = 'Done'
-                    self._remove_on_msg()
-                    if keep_data:
-                        self._image_array = image_array
+                            with self._woutput:
+                                # suppress moviepy's log
+                                self._make_from_array(image_array)
+                    except Exception as error:
+                        fail(error)
+                        return
+                    if not os.path.exists(self.output):
+                        self._progress.description = (
+                            "ERROR: Check the maker's log")
+                    else:
+                        self._progress.description = 'Done'
+                if keep_data:
+                    self._image_array = image_array
+            finally:
+                self._remove_on_msg()
+
+        def step(frame=None, image=None):
+            try:
+                if frame is not None and cache is not None:
+                    cache.put(frame, image)
+                advance()
+            except Exception as error:
+                fail(error)
+                return
+            if self._progress.value == n_frames:
+                finish()
+
+        def on_msg(widget, msg, buffers):
+            if msg['type'] == 'movie_image_data':
+                # the frontend sends the frame back with its image; older
+                # ones send images in the order the frames were sent
+                frame = msg.get('frame')
+                entry = next((e for e in pending if e[1] is None and
+                              (frame is None or e[0] == frame)), None)
+                if entry is not None:
+                    try:
+                        entry[1] = _image_from_msg(msg, buffers)
+                    except Exception as error:
+                        fail(error)
+                        return
+                    step(*entry)
 
         self._on_msg = on_msg
-        # FIXME: if exception happens, the on_msg callback will be never removed
-        # from `self.view`
         self.view.on_msg(on_msg)
+        self._progress.description = 'Rendering ...'
+        step()
         return self._progress
 
     def _remove_on_msg(self):
         self.view.on_msg(self._on_msg, remove=True)
 
-    def _make_from_array(self, image_array: List[str]):
-        image_files = [self._base64_to_ndarray(a) for a in image_array]
+    def _make_from_array(self, image_array: List[bytes]):
+        image_files = [_to_rgb(a) for a in image_array]
         clip = mpy.ImageSequenceClip(image_files, fps=self.fps)
         with self._woutput:
             if self.output.endswith('.gif'):
@@ -0,0 +1,194 @@
+"""Read trajectory frames ahead of the displayed one.
+
+Frames are read (and optionally transformed, e.g. aligned) by a pool of
+worker threads, or worker processes for CPU bound decoders such as XTC
+decompression. Process workers write frames into
+`multiprocessing.shared_memory` slots, no pickling of coordinates; the
+kernel copies a frame out of its slot when it is requested.
+
+Examples
+--------
+>>> view.prefetch_frames(depth=16, processes=True) # doctest: +SKIP
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .base_adaptor import thread_safe_reader
+
+__all__ = ['FramePrefetcher']
+
+# state of a worker process
+_worker = {}
+
+
+def _init_worker(trajectory, transform, shm_name):
+    _worker['trajectory'] = trajectory
+    _worker['transform'] = transform
+    _worker['shm'] = shared_memory.SharedMemory(name=shm_name)
+
+
+def _read_into_slot(index, offset, shape):
+    xyz = _worker['trajectory'].get_coordinates(index)
+    if _worker['transform'] is not None:
+        xyz = _worker['transform'](xyz)
+    out = np.ndarray(shape, dtype='f4', buffer=_worker['shm'].buf,
+                     offset=offset)
+    out[...] = xyz
+
+
+def _read(reader, transform, index):
+    xyz = reader.get_coordinates(index)
+    if transform is not None:
+        xyz = transform(xyz)
+    return xyz
+
+
+class FramePrefetcher:
+    """Keep the next `depth` frames (in playback direction) being read in
+    the background.
+
+    Parameters
+    ----------
+    trajectory : nglview.Trajectory
+        With `processes=True` it must be picklable; each worker process
+        reads from its own copy.
+    depth : int, default 8
+        Number of frames read ahead.
+    n_workers : int, optional
+        Default: number of CPUs, at most `depth`.
+    processes : bool, default False
+        Use worker processes and shared memory instead of threads.
+    transform : callable, optional
+        `transform(xyz) -> xyz` applied in the worker, e.g. alignment. Must
+        keep the shape, and be picklable with `processes=True`.
+    mp_context : str, default 'spawn'
+        Start method of the worker processes.
+
+    Notes
+    -----
+    With `processes=True` a shared memory slot is only reused once the
+    worker writing into it is done (cancelled reads may still be running),
+    and the returned arrays are copies, they stay valid after the slot is
+    reused.
+    """
+
+    def __init__(self,
+                 trajectory,
+                 depth=8,
+                 n_workers=None,
+                 processes=False,
+                 transform=None,
+                 mp_context='spawn'):
+        self.trajectory = trajectory
+        self.depth = depth
+        self.processes = processes
+        self._transform = transform
+        self._reader = thread_safe_reader(trajectory)
+        self._futures = {}
+        self._lock = threading.Lock()
+        n_workers = n_workers or min(os.cpu_count() or 1, max(depth, 1))
+        self._shm = None
+        if processes:
+            first = np.asarray(_read(self._reader, transform, 0), dtype='f4')
+            self._shape = first.shape
+            self._n_slots = 2 * depth + 2
+            self._slot_nbytes = max(first.nbytes, 1)
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=self._n_slots * self._slot_nbytes)
+            self._free_slots = list(range(self._n_slots))
+            self._slots_changed = threading.Condition()
+            self._executor = ProcessPoolExecutor(
+                n_workers,
+                mp_context=multiprocessing.get_context(mp_context),
+                initializer=_init_worker,
+                initargs=(trajectory, transform, self._shm.name))
+        else:
+            self._executor = ThreadPoolExecutor(
+                n_workers, thread_name_prefix='nglview-prefetch')
+
+    def _submit(self, index):
+        if not self.processes:
+            return self._executor.submit(_read, self._reader, self._transform,
+                                         index)
+        with self._slots_changed:
+            # a slot is held by at most `depth + 1` wanted reads and the
+            # cancelled reads already queued in the worker processes, wait
+            # for one of those to finish if there are more workers
+            while not self._free_slots:
+                self._slots_changed.wait()
+            slot = self._free_slots.pop()
+        offset = slot * self._slot_nbytes
+        future = self._executor.submit(_read_into_slot, index, offset,
+                                       self._shape)
+        future.slot = slot
+        # the slot is freed once the read is done and the frame is copied
+        # out or not wanted anymore
+        future.holds = 2
+        future.frame = np.ndarray(self._shape,
+                                  dtype='f4',
+                                  buffer=self._shm.buf,
+                                  offset=offset)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._slots_changed:
+            future.holds -= 1
+            if future.holds == 0:
+                self._free_slots.append(future.slot)
+                self._slots_changed.notify()
+
+    def _discard(self, future):
+        future.cancel()
+        if self.processes:
+            self._release(future)
+
+    def get(self, index, step=1):
+        """Coordinates of frame `index`, then start reading the frames
+        `index + step`, `index + 2 * step`... (wrapping around)."""
+        n_frames = self._reader.n_frames
+        with self._lock:
+            future = self._futures.pop(index, None)
+            if future is None:
+                future = self._submit(index)
+            wanted = [(index + k * step) % n_frames
+                      for k in range(1, self.depth + 1)] if n_frames else []
+            for old in set(self._futures) - set(wanted):
+                self._discard(self._futures.pop(old))
+            for next_index in wanted:
+                if next_index != index and next_index not in self._futures:
+                    self._futures[next_index] = self._submit(next_index)
+        if not self.processes:
+            return future.result()
+        try:
+            future.result()
+            return future.frame.copy()
+        finally:
+            self._release(future)
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                self._discard(future)
+            self._futures.clear()
+        self._executor.shutdown(wait=True)
+        if self._shm is not None:
+            self._shm.unlink()
+            try:
+                self._shm.close()
+            except BufferError:
+                # views of discarded reads are still alive, the memory is
+                # released with them
+                pass
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,60 @@
+import nglview as nv
+from nglview.blob import BlobRegistry
+
+
+def test_blob_registry():
+    BlobRegistry.clear()
+    text = open(__file__).read()
+    blob = BlobRegistry.add(text)
+    assert not blob.binary
+    assert blob.data == text.encode('utf8')
+    assert BlobRegistry.add(text) is blob
+    assert BlobRegistry.add(text.encode('utf8')) is blob
+    binary_blob = BlobRegistry.add(b'\x00\x01', binary=True)
+    assert binary_blob is not blob
+    assert len(BlobRegistry) == 2
+    assert BlobRegistry.nbytes == len(blob.data) + 2
+    BlobRegistry.clear()
+    assert len(BlobRegistry) == 0
+    assert BlobRegistry.add(text) is not blob
+
+
+def test_blob_registry_release():
+    BlobRegistry.clear()
+    blob = BlobRegistry.add('abc')
+    assert BlobRegistry.add('abc') is blob
+    BlobRegistry.release(blob)
+    assert len(BlobRegistry) == 1
+    BlobRegistry.release(blob)
+    assert len(BlobRegistry) == 0
+    assert blob.comm is None
+    # released after clear
+    blob = BlobRegistry.add('abc')
+    BlobRegistry.clear()
+    BlobRegistry.release(blob)
+
+
+def test_view_releases_blobs():
+    BlobRegistry.clear()
+    text = open(nv.datafiles.PDB).read()
+    view = nv.NGLWidget()
+    c0 = view.add_component(text, ext='pdb')
+    view.add_component(text, ext='pdb')
+    c2 = view.add_component(text[:-10], ext='pdb')
+    other = nv.NGLWidget()
+    other.add_component(text, ext='pdb')
+    blob, blob2 = view._ngl_blobs
+    assert len(BlobRegistry) == 2
+    view.remove_component(c2)
+    # not embedded anymore, no reference left
+    assert view._ngl_blobs == [blob]
+    assert blob2.comm is None
+    view.remove_component(c0)
+    assert view._ngl_blobs == [blob]
+    view.close()
+    # still shown by `other`
+    assert len(BlobRegistry) == 1
+    assert blob.comm is not None
+    other._ngl_handle_msg(other, {'type': 'removeComponent', 'data': 0}, [])
+    assert other._ngl_blobs == []
+    assert len(BlobRegistry) == 0
@@ -0,0 +1,195 @@
+import base64
+import hashlib
+import json
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_equal
+
+import nglview as nv
+from nglview.utils.coordinate_bundle import (decode_coordinate_bundle,
+                                             encode_coordinate_bundle,
+                                             iter_bundle_data)
+
+
+@pytest.fixture
+def frames():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    yield t.get_coordinates_batch(range(20))
+    t.close()
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_float_bundle(frames, compress):
+    bundle = encode_coordinate_bundle(frames, compress=compress)
+    assert bundle['n_frames'] == 20
+    assert bundle['n_atoms'] == frames.shape[1]
+    assert bundle['dtype'] == 'f4'
+    assert bundle['compression'] == ('deflate' if compress else None)
+    assert_equal(decode_coordinate_bundle(bundle), frames)
+
+
+def test_quantized_bundle(frames):
+    bundle = encode_coordinate_bundle(frames, precision=1e-3)
+    assert bundle['dtype'] == 'i4'
+    assert_allclose(decode_coordinate_bundle(bundle), frames, atol=6e-4)
+    # differences between frames deflate well
+    assert len(bundle['data']) < len(encode_coordinate_bundle(frames)['data'])
+
+    with pytest.raises(ValueError):
+        encode_coordinate_bundle(frames, precision=1e-12)
+
+
+@pytest.mark.parametrize('precision', [None, 1e-3])
+def test_iter_bundle_data(frames, precision):
+    reads = []
+
+    def read(positions):
+        reads.append(positions)
+        return frames[positions.start:positions.stop]
+
+    # independent batches of 7 frames, same data for any number of workers
+    pieces = list(iter_bundle_data(read, 20, precision=precision,
+                                   key_interval=7, n_workers=4))
+    assert sorted(r.start for r in reads) == [0, 7, 14]
+    bundle = encode_coordinate_bundle(frames,
+                                      precision=precision,
+                                      key_interval=7)
+    assert ''.join(pieces) == bundle['data']
+    assert bundle['key_interval'] == 7
+    # checked by zlib (adler32 of the joined blocks)
+    assert_allclose(decode_coordinate_bundle(bundle), frames, atol=6e-4)
+
+
+def test_empty_bundle():
+    bundle = encode_coordinate_bundle([], precision=1e-3)
+    assert bundle['n_frames'] == 0
+    assert decode_coordinate_bundle(bundle).shape == (0, 0, 3)
+    with pytest.raises(ValueError):
+        encode_coordinate_bundle(np.zeros((2, 3)))
+
+
+def test_serialization_bundle():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    view._set_serialization(frame_range=(t.n_frames - 2, t.n_frames + 3),
+                            precision=1e-3)
+    resource = view._ngl_coordinate_resource
+    # frames past the end are not stored
+    assert resource['n_frames'] == 5
+    assert resource[0]['n_frames'] == 2
+    assert_allclose(decode_coordinate_bundle(resource[0]),
+                    t.get_coordinates_batch([t.n_frames - 2, t.n_frames - 1]),
+                    atol=6e-4)
+    view._unset_serialization()
+    assert view._ngl_coordinate_resource == {}
+    t.close()
+
+
+def test_write_html_external_data(tmp_path):
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    html = tmp_path / 'index.html'
+    nv.write_html(str(html), [view],
+                  frame_range=(0, 25),
+                  external_data_dir=str(tmp_path / 'data'),
+                  chunk_size=10)
+    text = html.read_text()
+    assert view._ngl_coordinate_resource == {}
+    # neither the structure nor the coordinates are embedded
+    assert view._ngl_blobs[0].data.decode()[:1000] not in text
+    names = sorted(p.name for p in (tmp_path / 'data').iterdir())
+    structure = view._ngl_blobs[0].data
+    name = f'structure_{hashlib.sha1(structure).hexdigest()[:16]}.bin'
+    assert f'data/{name}' in text
+    assert (tmp_path / 'data' / name).read_bytes() == structure
+    chunks = [n for n in names if n.startswith(f'coordinates_{view.model_id}')]
+    assert all(f'data/{n}' in text for n in chunks)
+    assert [n.rsplit('_', 1)[1] for n in chunks] == ['0.bin', '1.bin', '2.bin']
+
+    bundle = encode_coordinate_bundle(t.get_coordinates_batch(range(20, 25)))
+    bundle['data'] = base64.b64encode(
+        (tmp_path / 'data' / chunks[-1]).read_bytes())
+    assert_equal(decode_coordinate_bundle(bundle),
+                 t.get_coordinates_batch(range(20, 25)))
+    t.close()
+
+
+def test_write_html_streams_coordinates():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    fp = StringIO()
+    nv.write_html(fp, [view], frame_range=(0, 30), precision=1e-3)
+    text = fp.getvalue()
+    assert '@nglview-coordinates-' not in text
+    state = text.split('<script type="application/vnd.jupyter.widget-state+json">'
+                       )[1].split('</script>')[0]
+    model = json.loads(state)['state'][view.model_id]['state']
+    resource = model['_ngl_coordinate_resource']
+    assert resource['n_frames'] == 30
+    assert_allclose(decode_coordinate_bundle(resource['0']),
+                    t.get_coordinates_batch(range(30)),
+                    atol=6e-4)
+    t.close()
+
+
+def test_write_html_size_budget():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    fp = StringIO()
+    report = nv.write_html(fp, [view], frame_range=(0, 51))
+    assert report['total'] == len(fp.getvalue())
+    assert report['frame_range'] == (0, 51)
+    assert report['precision'] is None
+    coordinates = report['coordinates'][f'{view.model_id}/0']
+    assert coordinates > 2 * 10**6
+    # all widgets of the kernel are embedded
+    blob = report['blobs'][
+        f'nglview.adaptor.FileTrajectory ({view._ngl_blobs[0].model_id[:8]})']
+    assert blob > len(view._ngl_blobs[0].data)
+    assert report['widget_state'] > 0
+    assert report['total'] == (report['msg_archive'] + report['color_dict'] +
+                               sum(report['blobs'].values()) +
+                               sum(report['coordinates'].values()) +
+                               report['widget_state'])
+
+    # quantized first, then strided
+    budget = report['total'] - coordinates + coordinates // 2
+    fp = StringIO()
+    report = nv.write_html(fp, [view], frame_range=(0, 51),
+                           size_budget=budget)
+    assert report['precision'] == 1e-3
+    assert len(fp.getvalue()) == report['total'] <= budget
+
+    budget = report['total'] - report['coordinates'][f'{view.model_id}/0']
+    budget += 10**5
+    report = nv.write_html(StringIO(), [view], frame_range=(0, 51),
+                           size_budget=budget)
+    assert report['frame_range'][2] > 1
+    assert report['total'] <= budget
+
+    with pytest.raises(ValueError, match='atom_indices'):
+        nv.write_html(StringIO(), [view], frame_range=(0, 51),
+                      size_budget=blob)
+    assert view._ngl_coordinate_resource == {}
+    t.close()
+
+
+def test_fit_size_budget_reads_sample_once():
+    from nglview import widget
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    with patch.object(widget, '_get_coordinates_batch',
+                      wraps=widget._get_coordinates_batch) as read, \
+            patch.object(widget, 'encode_coordinate_bundle',
+                         wraps=widget.encode_coordinate_bundle) as encode:
+        # many candidate strides and precisions
+        frame_range, precision = widget._fit_size_budget(
+            [view], '', [], 10**5, (0, 51), None, True)
+    assert frame_range[2] > 1
+    # one sample, encoded once per precision
+    assert read.call_count == 1
+    assert encode.call_count == 3
+    t.close()
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from nglview.utils.mmtf import _recursive_index, write_mmtf
+
+
+def _fake_topology():
+    return dict(names=['N', 'CA', 'C', 'O', 'OW'],
+                resnames=['ALA', 'ALA', 'ALA', 'ALA', 'HOH'],
+                resids=[1, 1, 1, 1, 2],
+                chains=['A', 'A', 'A', 'A', 'B'],
+                elements=['N', 'C', 'C', 'O', 'O'],
+                bonds=[[0, 1], [1, 2], [2, 3], [3, 4]],
+                xyz=np.arange(15, dtype='f4').reshape(5, 3) * 1.5)
+
+
+def test_recursive_index():
+    values = np.array([0, 5, -5, 32767, -32768, 40000, -70000, 98301])
+    encoded = _recursive_index(values)
+    assert encoded.min() >= -32768 and encoded.max() <= 32767
+    # decode as in the MMTF spec
+    decoded, total = [], 0
+    for value in encoded:
+        total += value
+        if value not in (32767, -32768):
+            decoded.append(total)
+            total = 0
+    assert decoded == values.tolist()
+
+
+def test_write_mmtf_header():
+    data = write_mmtf(**_fake_topology())
+    assert isinstance(data, bytes)
+    assert b'mmtfVersion' in data
+    # one per residue template, plus the global list for bonds between groups
+    assert data.count(b'bondAtomList') == 3
+    top = _fake_topology()
+    top.pop('bonds')
+    assert write_mmtf(**top).count(b'bondAtomList') == 2
+
+
+def test_write_mmtf_decode():
+    msgpack = pytest.importorskip('msgpack')
+    mmtf = pytest.importorskip('mmtf')
+    top = _fake_topology()
+    decoder = mmtf.MMTFDecoder()
+    decoder.decode_data(msgpack.unpackb(write_mmtf(**top), raw=False))
+    assert decoder.num_atoms == 5
+    assert decoder.num_groups == 2
+    assert list(decoder.chain_id_list) == ['A', 'B']
+    assert list(decoder.group_id_list) == [1, 2]
+    np.testing.assert_allclose(
+        np.column_stack([
+            decoder.x_coord_list, decoder.y_coord_list, decoder.z_coord_list
+        ]), top['xyz'])
+    ala, hoh = [decoder.group_list[i] for i in decoder.group_type_list]
+    assert ala['atomNameList'] == ['N', 'CA', 'C', 'O']
+    assert ala['bondAtomList'] == [0, 1, 1, 2, 2, 3]
+    assert hoh['chemCompType'] == 'NON-POLYMER'
+    # the bond between residues is stored globally
+    assert list(decoder.bond_atom_list) == [3, 4]
+    assert decoder.num_bonds == 4
+
+
+def test_write_mmtf_secondary_structure():
+    msgpack = pytest.importorskip('msgpack')
+    mmtf = pytest.importorskip('mmtf')
+    n = 12
+    angle = np.radians(100) * np.arange(n)
+    # ideal alpha helix and beta strand CA traces
+    helix = np.column_stack([2.3 * np.cos(angle), 2.3 * np.sin(angle),
+                             1.5 * np.arange(n)])
+    strand = np.column_stack([3.3 * np.arange(n), 0.9 * (-1)**np.arange(n),
+                              np.zeros(n)]) + 30
+    xyz = np.concatenate([helix, strand, [[60, 60, 60]]])
+    top = dict(names=['CA'] * (2 * n) + ['OW'],
+               resnames=['ALA'] * (2 * n) + ['HOH'],
+               resids=list(range(2 * n)) + [100],
+               chains=['A'] * n + ['B'] * n + ['C'],
+               xyz=xyz)
+    decoder = mmtf.MMTFDecoder()
+    decoder.decode_data(msgpack.unpackb(write_mmtf(**top), raw=False))
+    codes = list(decoder.sec_struct_list)
+    assert codes[:n] == [2] * n
+    assert codes[n + 1:2 * n - 1] == [3] * (n - 2)
+    assert codes[-1] == -1
+    # not part of a protein segment of 4 residues
+    top['chains'] = ['A', 'B'] * n + ['C']
+    decoder.decode_data(msgpack.unpackb(write_mmtf(**top), raw=False))
+    assert set(decoder.sec_struct_list) == {-1}
+
+
+def test_mdtraj_structure_buffer_keeps_helices():
+    md = pytest.importorskip('mdtraj')
+    msgpack = pytest.importorskip('msgpack')
+    mmtf = pytest.importorskip('mmtf')
+    import nglview as nv
+    traj = md.load(nv.datafiles.PDB)
+    buffer = nv.MDTrajTrajectory(traj).get_structure_buffer()
+    decoder = mmtf.MMTFDecoder()
+    decoder.decode_data(msgpack.unpackb(buffer, raw=False))
+    codes = np.array(decoder.sec_struct_list)
+    # one group per residue; rhodopsin, mostly helices
+    helix = md.compute_dssp(traj)[0] == 'H'
+    assert helix.mean() > 0.5
+    assert np.mean(codes[helix] == 2) > 0.8
+
+
+def test_write_mmtf_unit_cell():
+    msgpack = pytest.importorskip('msgpack')
+    mmtf = pytest.importorskip('mmtf')
+    top = _fake_topology()
+    decoder = mmtf.MMTFDecoder()
+    decoder.decode_data(
+        msgpack.unpackb(write_mmtf(box=[10, 20, 30, 90, 90, 120], **top),
+                        raw=False))
+    assert list(decoder.unit_cell) == [10, 20, 30, 90, 90, 120]
+    assert decoder.space_group == 'P 1'
+    assert b'unitCell' not in write_mmtf(**top)
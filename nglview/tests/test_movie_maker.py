@@ -1,5 +1,7 @@
 import os
+import time
 
+import pytest
 from mock import MagicMock, patch
 
 import nglview
@@ -25,3 +27,322 @@ def test_movie_maker(mock_image, ImageSequenceClip):
                        stop=2)
     movie.make()
     # movie.make_old_impl()
+
+
+def _png(width, height, color=(255, 0, 0)):
+    import io
+    fh = io.BytesIO()
+    PIL.Image.new('RGB', (width, height), color).save(fh, 'PNG')
+    return fh.getvalue()
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_ffmpeg_writer(Popen, _):
+    import numpy as np
+    from nglview.contrib.movie import _to_rgb, _FFmpegWriter
+    Popen.return_value.wait.return_value = 0
+    writer = _FFmpegWriter('my.mp4', 8, {'codec': 'libx264'})
+    rgb = _to_rgb(_png(5, 3))
+    assert rgb.shape == (3, 5, 3)
+    rgba = np.zeros((3, 5, 4), dtype='u1')
+    assert _to_rgb(rgba).shape == (3, 5, 3)
+    writer.write(rgb)
+    writer.write(rgb)
+    command = Popen.call_args[0][0]
+    assert command[command.index('-s') + 1] == '5x3'
+    assert command[-3:] == ['-vcodec', 'libx264', 'my.mp4']
+    assert Popen.return_value.stdin.write.call_count == 2
+    with pytest.raises(ValueError):
+        writer.write(rgb[:2])
+    writer.close()
+
+    Popen.return_value.wait.return_value = 1
+    writer.write(rgb)
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+    with pytest.raises(ValueError):
+        _FFmpegWriter('my.gif', 8, {'program': 'ImageMagick'})
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_movie_maker_streaming(Popen, _, tmp_path):
+    from nglview.contrib.movie import MovieMaker
+    Popen.return_value.wait.return_value = 0
+    output = tmp_path / 'my.mp4'
+    output.touch()
+    t = nglview.FileTrajectory(nglview.datafiles.XTC, nglview.datafiles.GRO)
+    view = nglview.NGLWidget(t)
+    movie = MovieMaker(view,
+                       output=str(output),
+                       stop=3,
+                       timeout=0,
+                       streaming=True)
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        progress = movie.make()
+        # the next frame is rendered while the first one comes back
+        assert [c[0][0] for c in set_coordinates.call_args_list] == [0, 1]
+        image = _png(4, 2)
+        for _ in range(3):
+            # the frame is piped to ffmpeg, not kept; without 'frame' (older
+            # frontends) images are taken in the order frames were sent
+            movie._on_msg(view, {
+                'type': 'movie_image_data',
+                'format': 'png'
+            }, [memoryview(image)])
+        assert [c[0][0] for c in set_coordinates.call_args_list] == [0, 1, 2]
+    assert Popen.return_value.stdin.write.call_count == 3
+    assert Popen.return_value.stdin.close.called
+    assert movie._image_array == []
+    assert progress.value == 3
+    assert progress.description == 'Done'
+    assert movie._on_msg not in view._msg_callbacks.callbacks
+    t.close()
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_movie_maker_perframe_hook(Popen, _, tmp_path):
+    from nglview.contrib.movie import MovieMaker
+    Popen.return_value.wait.return_value = 0
+    output = tmp_path / 'my.mp4'
+    output.touch()
+    t = nglview.FileTrajectory(nglview.datafiles.XTC, nglview.datafiles.GRO)
+    view = nglview.NGLWidget(t)
+    hooked = []
+    movie = MovieMaker(view,
+                       output=str(output),
+                       stop=2,
+                       streaming=True,
+                       timeout=None,
+                       perframe_hook=lambda v: hooked.append(v.frame))
+
+    def rendered():
+        return [
+            c[0][0] for c in set_coordinates.call_args_list
+            if c[1].get('movie_making')
+        ]
+
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        movie.make()
+        # no frame is rendered before the frontend drew the hook's changes
+        assert hooked == [0]
+        assert rendered() == []
+        token, = view._render_acks
+        view._ngl_handle_msg(view, {'type': 'render_ack', 'data': token}, [])
+        assert rendered() == [0]
+        movie._on_msg(view, {'type': 'movie_image_data', 'frame': 0},
+                      [memoryview(_png(4, 2))])
+        assert hooked == [0, 1]
+        assert rendered() == [0]
+        token, = view._render_acks
+        view._ngl_handle_msg(view, {'type': 'render_ack', 'data': token}, [])
+        assert rendered() == [0, 1]
+        movie._on_msg(view, {'type': 'movie_image_data', 'frame': 1},
+                      [memoryview(_png(4, 2))])
+    assert Popen.return_value.stdin.write.call_count == 2
+    t.close()
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_movie_maker_perframe_hook_timeout(Popen, _, tmp_path):
+    from nglview.contrib.movie import MovieMaker
+    t = nglview.FileTrajectory(nglview.datafiles.XTC, nglview.datafiles.GRO)
+    # not displayed: the frontend never acknowledges the hook's changes
+    view = nglview.NGLWidget(t)
+    movie = MovieMaker(view,
+                       output=str(tmp_path / 'my.mp4'),
+                       stop=2,
+                       streaming=True,
+                       timeout=0.01,
+                       perframe_hook=lambda v: None)
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        movie.make()
+        for _ in range(100):
+            if set_coordinates.called:
+                break
+            time.sleep(0.01)
+        assert set_coordinates.call_count == 1
+        assert set_coordinates.call_args[0] == (0, )
+        assert set_coordinates.call_args[1]['movie_making']
+    assert view._render_acks == {}
+    movie._remove_on_msg()
+    t.close()
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_movie_maker_cache(Popen, _, tmp_path):
+    from nglview.contrib.movie import (MovieMaker, _frame_digest,
+                                       _view_state_hash)
+    Popen.return_value.wait.return_value = 0
+    output = tmp_path / 'my.mp4'
+    output.touch()
+    cache_dir = tmp_path / 'cache'
+
+    def make_view():
+        t = nglview.FileTrajectory(nglview.datafiles.XTC,
+                                   nglview.datafiles.GRO)
+        view = nglview.NGLWidget(t)
+        view.add_cartoon()
+        return view
+
+    view = make_view()
+    # by content, the same for another view of the same files
+    params = {'factor': 1}
+    assert _view_state_hash(view, params) == _view_state_hash(
+        make_view(), params)
+    assert _view_state_hash(view, params) != _view_state_hash(
+        view, {'factor': 2})
+
+    def rendered(set_coordinates):
+        return [
+            c[0][0] for c in set_coordinates.call_args_list
+            if c[1].get('movie_making')
+        ]
+
+    image = _png(4, 2)
+    other_image = _png(4, 2, color=(0, 0, 255))
+    movie = MovieMaker(view,
+                       output=str(output),
+                       stop=4,
+                       streaming=True,
+                       cache_dir=str(cache_dir))
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        movie.make()
+        # images are matched to their frame, whatever the order they
+        # come back in
+        movie._on_msg(view, {'type': 'movie_image_data', 'frame': 1},
+                      [memoryview(other_image)])
+        movie._on_msg(view, {'type': 'movie_image_data', 'frame': 0},
+                      [memoryview(image)])
+        # interrupted
+        movie._remove_on_msg()
+    # the frames already received are still piped to ffmpeg
+    for _ in range(100):
+        if Popen.return_value.stdin.write.call_count == 2:
+            break
+        time.sleep(0.01)
+    folder, = cache_dir.iterdir()
+    names = [f'{frame:06d}-{_frame_digest(view, frame)}.png'
+             for frame in range(2)]
+    assert sorted(p.name for p in folder.iterdir()) == names
+    assert (folder / names[0]).read_bytes() == image
+    assert (folder / names[1]).read_bytes() == other_image
+
+    # other encoding settings, resumed at the third frame
+    movie = MovieMaker(view,
+                       output=str(output),
+                       stop=4,
+                       fps=24,
+                       streaming=True,
+                       cache_dir=str(cache_dir))
+    Popen.reset_mock()
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        progress = movie.make()
+        assert rendered(set_coordinates) == [2, 3]
+        assert progress.value == 2
+        for frame in [2, 3]:
+            movie._on_msg(view, {
+                'type': 'movie_image_data',
+                'frame': frame
+            }, [memoryview(image)])
+    assert Popen.return_value.stdin.write.call_count == 4
+    assert progress.description == 'Done'
+
+    # nothing to render
+    movie = MovieMaker(view,
+                       output=str(output),
+                       stop=4,
+                       streaming=True,
+                       cache_dir=str(cache_dir))
+    with patch.object(view, '_set_coordinates') as set_coordinates:
+        progress = movie.make()
+        assert rendered(set_coordinates) == []
+    assert progress.description == 'Done'
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+class Replica(nglview.FileTrajectory):
+    # same first frame, other coordinates later
+    def __init__(self, shift):
+        super().__init__(nglview.datafiles.XTC, nglview.datafiles.GRO)
+        self.shift = shift
+
+    def get_coordinates(self, index):
+        xyz = super().get_coordinates(index)
+        return xyz + self.shift if index else xyz
+
+    def __repr__(self):
+        # the component name
+        return 'Replica'
+
+
+@patch('nglview.contrib.movie._ffmpeg_exe', return_value='ffmpeg')
+@patch('subprocess.Popen')
+def test_movie_maker_cache_replicas(Popen, _, tmp_path):
+    from nglview.contrib.movie import MovieMaker, _view_state_hash
+    Popen.return_value.wait.return_value = 0
+    output = tmp_path / 'my.mp4'
+    output.touch()
+    cache_dir = tmp_path / 'cache'
+    views = [nglview.NGLWidget(Replica(shift)) for shift in [0, 1]]
+    params = {'factor': 1}
+    assert _view_state_hash(views[0], params) == _view_state_hash(
+        views[1], params)
+    rendered = []
+    for view in views:
+        movie = MovieMaker(view,
+                           output=str(output),
+                           stop=3,
+                           streaming=True,
+                           cache_dir=str(cache_dir))
+        with patch.object(view, '_set_coordinates') as set_coordinates:
+            movie.make()
+            for frame in range(3):
+                movie._on_msg(view, {
+                    'type': 'movie_image_data',
+                    'frame': frame
+                }, [memoryview(_png(4, 2))])
+        rendered.append([
+            c[0][0] for c in set_coordinates.call_args_list
+            if c[1].get('movie_making')
+        ])
+    # only the first frame is taken from the other replica's images
+    assert rendered == [[0, 1, 2], [1, 2]]
+
+
+def test_encoding_pipeline():
+    from nglview.contrib.movie import _EncodingPipeline
+
+    class Writer:
+        def __init__(self):
+            self.frames = []
+            self.closed = False
+
+        def write(self, rgb):
+            self.frames.append(tuple(rgb[0, 0]))
+
+        def close(self):
+            self.closed = True
+
+    writer = Writer()
+    pipeline = _EncodingPipeline(writer, n_workers=4, max_pending=2)
+    colors = [(i, 0, 0) for i in range(20)]
+    for color in colors:
+        pipeline.submit(_png(64, 64, color))
+    pipeline.close()
+    # decoded in parallel, written in order
+    assert writer.frames == colors
+    assert writer.closed
+
+    writer = Writer()
+    writer.write = MagicMock(side_effect=OSError('broken pipe'))
+    pipeline = _EncodingPipeline(writer)
+    pipeline.submit(_png(4, 2))
+    with pytest.raises(OSError):
+        pipeline.close()
+    assert writer.closed
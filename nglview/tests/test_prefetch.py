@@ -0,0 +1,61 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+import nglview as nv
+from nglview.prefetch import FramePrefetcher
+
+
+def _shift(xyz):
+    return xyz + 1
+
+
+def test_prefetch_threads():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    with FramePrefetcher(t, depth=4) as prefetcher:
+        assert_allclose(prefetcher.get(10), t.get_coordinates(10))
+        assert sorted(prefetcher._futures) == [11, 12, 13, 14]
+        # backwards, wrapping around
+        assert_allclose(prefetcher.get(1, step=-1), t.get_coordinates(1))
+        assert sorted(prefetcher._futures) == [0, 48, 49, 50]
+        assert_allclose(prefetcher.get(0), t.get_coordinates(0))
+
+
+def test_prefetch_processes():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    with FramePrefetcher(t, depth=2, n_workers=2, processes=True,
+                         transform=_shift) as prefetcher:
+        for index in [0, 1, 2, 3, 20]:
+            xyz = prefetcher.get(index)
+            assert xyz.dtype == np.float32
+            assert_allclose(xyz, t.get_coordinates(index) + 1, rtol=1e-6)
+
+
+def test_prefetch_processes_seek():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    prefetcher = FramePrefetcher(t, depth=2, n_workers=2, processes=True)
+    frames = {}
+    # seeking cancels reads that may still be running, their slots must
+    # not be handed out again before they are done
+    for index in [0, 30, 10, 45, 5, 20, 40, 1, 2, 3]:
+        frames[index] = prefetcher.get(index)
+    for index, xyz in frames.items():
+        assert_allclose(xyz, t.get_coordinates(index))
+    prefetcher.close()
+    assert sorted(prefetcher._free_slots) == list(
+        range(prefetcher._n_slots))
+    for index, xyz in frames.items():
+        assert_allclose(xyz, t.get_coordinates(index))
+
+
+def test_widget_prefetch():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    view = nv.NGLWidget(t)
+    view.prefetch_frames(depth=3)
+    view.frame = 5
+    _, prefetcher = view._prefetchers[t.id]
+    assert sorted(prefetcher._futures) == [6, 7, 8]
+    assert_allclose(view._coordinates_dict[0], t.get_coordinates(5))
+    view.prefetch_frames(0)
+    assert not view._prefetchers
+    view.frame = 6
+    assert_allclose(view._coordinates_dict[0], t.get_coordinates(6))
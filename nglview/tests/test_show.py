@@ -1,5 +1,4 @@
 import sys
-import subprocess
 
 import unittest
 import numpy as np
@@ -8,11 +7,6 @@ from mock import MagicMock, patch
 import nglview
 
 
-def _write(*args, **kargs):
-    # fake write method
-    subprocess.check_call(['cp', nglview.datafiles.PDB, 'tmp.pdb'])
-
-
 class MockStructure:
     def as_pdb_string(self):
         with open(nglview.datafiles.PDB) as fh:
@@ -20,24 +14,29 @@ class MockStructure:
 
 
 class MockRosettaPose:
-    def dump_pdb(self, _):
-        _write()
+    def dump_pdb(self, buffer):
+        buffer.write(MockStructure().as_pdb_string())
+
+
+class MockAtom:
+    pdbname = 'C'
+    atomic_number = 6
+    element = 'C'
+    pdbres = 'GLU'
+    resnum = 1
+    chain = 'A'
 
 
 def test_show_schrodinger():
     # Show a schrodinger.structure.Structure
     s = MagicMock()
-    s.write = _write
+    s.getXYZ.return_value = np.zeros((3, 3))
+    s.atom = [MockAtom()] * 3
     v0 = nglview.show_schrodinger(s)
+    assert nglview.SchrodingerStructure(s).get_structure_string().count(
+        'GLU') == 3
 
     # Show a trajectory with a Structure as topology
-    class MockAtom:
-        pdbname = 'C'
-        atomic_number = 6
-        pdbres = 'GLU'
-        resnum = 1
-        chain = 'A'
-
     s = MagicMock()
     s.fsys_ct.getXYZ.return_value = np.zeros((3, 3))
     s.fsys_ct.atom = [MockAtom()] * 3
@@ -50,17 +49,38 @@ def test_show_schrodinger():
 
 def test_show_htmd():
     mol = MagicMock()
-    mol.write = _write
     n_frames = 10
-    mol.coordinates = np.zeros((n_frames, 1000, 3))
+    n_atoms = 1000
+    mol.coords = np.zeros((n_atoms, 3, n_frames))
+    mol.name = np.array(['CA'] * n_atoms)
+    mol.resname = np.array(['ALA'] * n_atoms)
+    mol.resid = np.arange(n_atoms)
+    mol.chain = np.array(['A'] * n_atoms)
+    mol.element = np.array(['C'] * n_atoms)
+    mol.record = np.array(['ATOM'] * n_atoms)
     mol.numFrames = n_frames
     view = nglview.show_htmd(mol)
     view
+    assert nglview.HTMDTrajectory(mol).get_structure_string().count(
+        'ATOM  ') == n_atoms
 
 
 def test_show_rosetta():
-    pose = MockRosettaPose()
-    view = nglview.show_rosetta(pose)
+    import types
+    from io import StringIO
+    modules = {}
+    for name in ['pyrosetta', 'pyrosetta.rosetta', 'pyrosetta.rosetta.std']:
+        modules[name] = types.ModuleType(name)
+
+    class ostringstream(StringIO):
+        str = StringIO.getvalue
+
+    modules['pyrosetta.rosetta.std'].ostringstream = ostringstream
+    with patch.dict(sys.modules, modules):
+        pose = MockRosettaPose()
+        view = nglview.show_rosetta(pose)
+        assert (nglview.RosettaStructure(pose).get_structure_string() ==
+                MockStructure().as_pdb_string())
 
 
 def test_show_iotbx():
@@ -69,17 +89,24 @@ def test_show_iotbx():
 
 
 def test_show_iodata():
+    import types
+    iodata = types.ModuleType('iodata')
+    iodata.utils = types.ModuleType('iodata.utils')
+    iodata.utils.angstrom = 1.0 / 0.52917721
+
     class MockIO:
-        def to_file(self, fname):
-            with open(fname, 'w') as fh:
-                fh.write("""3
-water
-H    0.7838370000   -0.4922360000   -0.0000000000
-O   -0.0000000000    0.0620200000   -0.0000000000
-H   -0.7838370000   -0.4922360000   -0.0000000000""")
-
-    v = nglview.show_iodata(MockIO())
-    v
+        atnums = np.array([1, 8, 1])
+        atcoords = np.array([[0.78, -0.49, 0.], [0., 0.06, 0.],
+                             [-0.78, -0.49, 0.]]) * iodata.utils.angstrom
+
+    with patch.dict(sys.modules, {
+            'iodata': iodata,
+            'iodata.utils': iodata.utils
+    }):
+        v = nglview.show_iodata(MockIO())
+        v
+        assert 'O' in nglview.IODataStructure(
+            MockIO()).get_structure_string()
 
 
 def test_show_qcelemental_show_psi4():
@@ -100,12 +127,12 @@ def test_show_openbabel():
     openbabel = types.ModuleType('openbabel')
     sys.modules['openbabel'] = openbabel
     b = MagicMock()
+    b.WriteString.return_value = MockStructure().as_pdb_string()
     mol = MagicMock()
     openbabel.OBConversion = MagicMock(return_value=b)
     nglview.show_openbabel(mol)
     b.SetOutFormat.assert_called_with('pdb')
-    assert b.WriteFile.called
-    assert len(b.WriteFile.call_args_list[0]) == 2
+    b.WriteString.assert_called_with(mol)
 
 
 def test_show_prody():
@@ -126,16 +153,16 @@ def test_show_prody():
                     return
 
     prody.Ensemble = MockEnsemble
-    prody.writePDB = MagicMock()
+    prody.writePDBStream = MagicMock()
     ens = MockEnsemble()
     nglview.show_prody(ens)
-    assert prody.writePDB.called
-    prody.writePDB.reset_mock()
-    assert not prody.writePDB.called
+    assert prody.writePDBStream.called
+    prody.writePDBStream.reset_mock()
+    assert not prody.writePDBStream.called
 
     st = MagicMock()
     nglview.show_prody(st)
-    assert prody.writePDB.called
+    assert prody.writePDBStream.called
 
 
 
@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+from mock import patch
+
+import nglview as nv
+from nglview.utils.structure_cache import (StructureCache, cache, hash_array,
+                                           hash_strings)
+
+try:
+    import mdtraj as md
+    has_mdtraj = True
+except ImportError:
+    has_mdtraj = False
+
+
+def test_hash():
+    xyz = np.arange(6, dtype='f4').reshape(2, 3)
+    assert hash_array(xyz) == hash_array(xyz.copy())
+    assert hash_array(xyz) != hash_array(xyz + 1)
+    assert hash_array(xyz) != hash_array(xyz.astype('f8'))
+    assert hash_strings(['CA', 'CB']) != hash_strings(['CAC', 'B'])
+
+
+def test_lru_eviction():
+    c = StructureCache(max_bytes=10)
+    assert c.get('a', lambda: 'xxxx') == 'xxxx'
+    assert c.get('b', lambda: 'yyyy') == 'yyyy'
+    # hit, 'a' becomes most recently used
+    assert c.get('a', lambda: 'new') == 'xxxx'
+    assert (c.hits, c.misses) == (1, 2)
+    c.get('c', lambda: 'zzzz')
+    assert 'b' not in c
+    assert 'a' in c and 'c' in c
+    assert c.nbytes == 8
+    # too large to cache
+    c.get('d', lambda: 'x' * 11)
+    assert 'd' not in c
+    c.clear()
+    assert len(c) == 0 and c.nbytes == 0
+
+
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_mdtraj_structure_cache():
+    cache.clear()
+    traj = md.load(nv.datafiles.PDB)
+    t0 = nv.MDTrajTrajectory(traj)
+    t1 = nv.MDTrajTrajectory(md.load(nv.datafiles.PDB))
+    text = t0.get_structure_string()
+    with patch('nglview.adaptor._get_mdtraj_topology') as mock_topology:
+        assert t1.get_structure_string() == text
+        mock_topology.assert_not_called()
+    assert t1.ext == 'pdb'
+    # different first frame
+    traj.xyz[0, 0] += 1
+    t2 = nv.MDTrajTrajectory(traj)
+    assert t2.get_structure_string() != text
@@ -0,0 +1,198 @@
+import numpy as np
+import pytest
+
+from nglview.utils.structure_io import (PDB_MAX_ATOMS, encode_hybrid36,
+                                        read_pdb, write_cif, write_pdb)
+
+
+def _fake_topology():
+    return dict(names=['N', 'CA', 'C', 'O', 'OW'],
+                resnames=['ALA', 'ALA', 'ALA', 'ALA', 'HOH'],
+                resids=[1, 1, 1, 1, 2],
+                chains=['A', 'A', 'A', 'A', 'B'],
+                elements=['N', 'C', 'C', 'O', 'O'],
+                xyz=np.arange(15, dtype='f4').reshape(5, 3) * 1.5)
+
+
+def test_write_pdb():
+    top = _fake_topology()
+    lines = write_pdb(**top).splitlines()
+    assert lines[-1] == 'END'
+    atoms = lines[:-1]
+    assert len(atoms) == 5
+    assert atoms[1] == ('ATOM      2  CA  ALA A   1       '
+                        '4.500   6.000   7.500  1.00  0.00           C  ')
+    # water is not a standard residue
+    assert atoms[4].startswith('HETATM    5  OW  HOH B   2')
+    for line, xyz in zip(atoms, top['xyz']):
+        np.testing.assert_allclose(
+            [float(line[30:38]), float(line[38:46]), float(line[46:54])], xyz)
+
+
+def test_write_pdb_conect():
+    top = _fake_topology()
+    top['resnames'][:3] = ['LIG'] * 3
+    bonds = [(0, 1), (0, 2), (1, 2), (2, 3), (3, 4)]
+    lines = write_pdb(bonds=bonds, **top).splitlines()
+    conect = [line.rstrip() for line in lines if line.startswith('CONECT')]
+    # only bonds of HETATM atoms, both ways
+    assert conect == [
+        'CONECT    1    2    3', 'CONECT    2    1    3',
+        'CONECT    3    1    2    4', 'CONECT    4    3    5',
+        'CONECT    5    4'
+    ]
+    assert lines[-1] == 'END'
+    # more than 4 bonded atoms continue on the next line
+    n_atoms = 6
+    lines = write_pdb(names=['C'] * n_atoms,
+                      resnames=['LIG'] * n_atoms,
+                      resids=[1] * n_atoms,
+                      xyz=np.zeros((n_atoms, 3)),
+                      bonds=[(0, i) for i in range(1, n_atoms)]).splitlines()
+    conect = [line.rstrip() for line in lines if line.startswith('CONECT')]
+    assert conect[:2] == ['CONECT    1    2    3    4    5', 'CONECT    1    6']
+    assert read_pdb('\n'.join(lines))['names'].tolist() == ['C'] * n_atoms
+
+
+def test_write_pdb_without_optional_columns():
+    top = _fake_topology()
+    top.pop('chains')
+    top.pop('elements')
+    atoms = write_pdb(hetero=[False] * 5, **top).splitlines()[:-1]
+    assert all(line.startswith('ATOM  ') for line in atoms)
+    assert atoms[0][21] == ' '
+    assert atoms[0][76:78] == '  '
+
+
+def test_read_pdb():
+    top = _fake_topology()
+    text = 'MODEL 1\n' + write_pdb(**top) + 'ENDMDL\n' + write_pdb(**top)
+    parsed = read_pdb(text)
+    for key in ['names', 'resnames', 'resids', 'chains', 'elements']:
+        assert parsed[key].tolist() == top[key]
+    assert parsed['hetero'].tolist() == [False] * 4 + [True]
+    np.testing.assert_allclose(parsed['xyz'], top['xyz'])
+    assert read_pdb('')['xyz'].shape == (0, 3)
+
+
+def test_write_cif():
+    top = _fake_topology()
+    lines = write_cif(**top).splitlines()
+    assert lines[0] == 'data_nglview'
+    assert lines[-1] == '#'
+    header = [line for line in lines if line.startswith('_atom_site.')]
+    start = lines.index('loop_') + 1 + len(header)
+    rows = lines[start:-1]
+    assert len(rows) == 5
+    fields = rows[4].split()
+    assert len(fields) == len(header)
+    record = dict(zip(header, fields))
+    assert record['_atom_site.group_PDB'] == 'HETATM'
+    assert record['_atom_site.label_atom_id'] == 'OW'
+    assert record['_atom_site.auth_asym_id'] == 'B'
+    np.testing.assert_allclose([
+        float(record['_atom_site.Cartn_' + axis]) for axis in 'xyz'
+    ], top['xyz'][4])
+
+
+def test_encode_hybrid36():
+    block = 26 * 36**4
+    values = [1, 99999, 100000, 100001, 99999 + block, 100000 + block]
+    assert list(encode_hybrid36(values, 5)) == [
+        b'    1', b'99999', b'A0000', b'A0001', b'ZZZZZ', b'a0000'
+    ]
+    with pytest.raises(ValueError):
+        encode_hybrid36([100000 + 2 * block], 5)
+
+
+def test_write_pdb_hybrid36():
+    n_atoms = PDB_MAX_ATOMS + 2
+    top = dict(names=['CA'] * n_atoms,
+               resnames=['ALA'] * n_atoms,
+               resids=np.arange(n_atoms),
+               xyz=np.zeros((n_atoms, 3)))
+    atoms = write_pdb(**top).splitlines()[:-1]
+    # serials wrap around by default
+    assert atoms[-1][6:11] == '    1'
+    atoms = write_pdb(hybrid36=True, **top).splitlines()[:-1]
+    assert atoms[-2][6:11] == 'A0000'
+    assert atoms[-1][6:11] == 'A0001'
+    assert atoms[-1][22:26] == encode_hybrid36([n_atoms - 1], 4)[0].decode()
+
+
+def test_write_pdb_overflow():
+    # negative residue numbers keep their sign
+    atom, = write_pdb(['CA'], ['ALA'], [-1], [[0, 0, 0]]).splitlines()[:-1]
+    assert atom[22:26] == '  -1'
+    for xyz, resid in [([-1000.5, 0, 0], 1), ([9999.9996, 0, 0], 1),
+                       ([0, 0, 0], -1000)]:
+        with pytest.raises(ValueError):
+            write_pdb(['CA'], ['ALA'], [resid], [xyz])
+
+
+def test_write_structure_falls_back_to_cif():
+    from types import SimpleNamespace
+    from nglview.adaptor import _write_structure
+    top = _fake_topology()
+    adaptor = SimpleNamespace(ext=None)
+    assert _write_structure(adaptor, **top).startswith('ATOM')
+    assert adaptor.ext == 'pdb'
+    # unwrapped coordinates in a large box
+    top['xyz'][0] = [-1000.5, 0, 12000]
+    text = _write_structure(adaptor, **top)
+    assert adaptor.ext == 'cif'
+    assert '-1000.500' in text and '12000.000' in text
+
+
+def test_write_unit_cell():
+    top = _fake_topology()
+    box = [10, 20, 30, 90, 90, 120]
+    lines = write_pdb(box=box, **top).splitlines()
+    assert lines[0] == ('CRYST1   10.000   20.000   30.000  90.00  90.00 '
+                        '120.00 P 1           1')
+    np.testing.assert_allclose(read_pdb('\n'.join(lines))['box'], box)
+    lines = write_cif(box=box, **top).splitlines()
+    cell = dict(line.split(None, 1) for line in lines
+                if line.startswith(('_cell.', '_symmetry.')))
+    assert [float(cell['_cell.' + key]) for key in [
+        'length_a', 'length_b', 'length_c', 'angle_alpha', 'angle_beta',
+        'angle_gamma'
+    ]] == box
+    assert cell['_symmetry.space_group_name_H-M'] == "'P 1'"
+    # no periodic box
+    for box in [None, [0, 0, 0, 90, 90, 90]]:
+        assert write_pdb(box=box, **top).startswith('ATOM')
+        assert '_cell.' not in write_cif(box=box, **top)
+    assert read_pdb(write_pdb(**top))['box'] is None
+
+
+def test_mdtraj_unit_cell():
+    md = pytest.importorskip('mdtraj')
+    import nglview as nv
+    traj = md.load(nv.datafiles.XTC, top=nv.datafiles.PDB)
+    t = nv.MDTrajTrajectory(traj)
+    box = read_pdb(t.get_structure_string())['box']
+    np.testing.assert_allclose(box[:3], 10 * traj.unitcell_lengths[0],
+                               atol=1e-3)
+    np.testing.assert_allclose(box[3:], traj.unitcell_angles[0], atol=1e-2)
+    # kept for atom subsets
+    subset = nv.AtomSubsetTrajectory(t, [0, 1, 2])
+    np.testing.assert_allclose(
+        read_pdb(subset.get_structure_string())['box'], box)
+
+
+def test_write_cif_missing_values():
+    top = _fake_topology()
+    top['chains'] = [' ', ' ', ' ', ' ', 'B']
+    top['elements'][1] = ''
+    lines = write_cif(**top).splitlines()
+    header = [line for line in lines if line.startswith('_atom_site.')]
+    rows = [dict(zip(header, line.split())) for line in lines
+            if line.startswith(('ATOM', 'HETATM'))]
+    # unknown values are '?', not quoted blanks
+    assert [row['_atom_site.auth_asym_id'] for row in rows] == ['?'] * 4 + ['B']
+    assert rows[0]['_atom_site.label_asym_id'] == '?'
+    assert rows[1]['_atom_site.type_symbol'] == '?'
+    assert '" "' not in '\n'.join(lines)
+    # chains are blank in PDB, as before
+    assert write_pdb(**top).splitlines()[0][21] == ' '
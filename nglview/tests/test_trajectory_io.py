@@ -0,0 +1,101 @@
+import shutil
+
+import numpy as np
+import pytest
+from mock import patch
+from numpy.testing import assert_allclose
+
+import nglview as nv
+from nglview.utils import trajectory_io
+from nglview.utils.trajectory_io import open_trajectory
+
+
+@pytest.fixture
+def reference():
+    md = pytest.importorskip('mdtraj')
+    return md.load(nv.datafiles.XTC, top=nv.datafiles.GRO)
+
+
+@pytest.mark.parametrize('fn', [nv.datafiles.XTC, nv.datafiles.TRR])
+def test_read_xdr(fn, reference, tmp_path):
+    path = str(tmp_path / fn.rsplit('/', 1)[-1])
+    shutil.copy(fn, path)
+    with open_trajectory(path) as reader:
+        assert reader.n_frames == reference.n_frames
+        assert reader.n_atoms == reference.n_atoms
+        for index in [0, 30, 1, -1]:
+            xyz = reader.read(index)
+            assert xyz.dtype == np.float32
+            assert_allclose(xyz, 10 * reference.xyz[index], atol=1e-4)
+        with pytest.raises(IndexError):
+            reader.read(reference.n_frames)
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_read_xtc_decoders(compiled, reference):
+    # the Python decoder is the fallback without MDAnalysis and MDTraj
+    with patch.object(trajectory_io.XTCReader, 'compiled', compiled), \
+            open_trajectory(nv.datafiles.XTC) as reader:
+        for index in [7, 0, 50]:
+            assert_allclose(reader.read(index),
+                            10 * reference.xyz[index],
+                            atol=1e-4)
+        assert bool(reader._compiled) == compiled
+
+
+def test_read_xtc_without_compiled_decoder(reference):
+    with patch.object(trajectory_io, '_compiled_xtc_reader',
+                      return_value=None), \
+            open_trajectory(nv.datafiles.XTC) as reader:
+        assert_allclose(reader.read(3), 10 * reference.xyz[3], atol=1e-4)
+        assert reader._compiled is False
+
+
+def test_read_dcd(reference, tmp_path):
+    path = str(tmp_path / 'test.dcd')
+    reference[:5].save_dcd(path)
+    with open_trajectory(path) as reader:
+        assert (reader.n_frames, reader.n_atoms) == (5, reference.n_atoms)
+        assert_allclose(reader.read(3), 10 * reference.xyz[3], atol=1e-4)
+    # the number of fixed atoms (NAMFIX) is the 9th control word
+    with open(path, 'r+b') as fh:
+        fh.seek(8 + 4 * 8)
+        fh.write(np.int32(10).tobytes())
+    with pytest.raises(ValueError, match='fixed atoms.*MDAnalysis'):
+        open_trajectory(path)
+
+
+def test_read_small_xtc(reference, tmp_path):
+    # up to 9 atoms are stored uncompressed
+    path = str(tmp_path / 'small.xtc')
+    small = reference[:3].atom_slice(range(5))
+    small.save_xtc(path)
+    with open_trajectory(path) as reader:
+        assert_allclose(reader.read(2), 10 * small.xyz[2], atol=1e-4)
+
+
+def test_offsets_are_persisted(tmp_path):
+    path = str(tmp_path / 'md.xtc')
+    shutil.copy(nv.datafiles.XTC, path)
+    offsets = open_trajectory(path)._offsets
+    assert (tmp_path / '.md.xtc_nglview_offsets.npz').exists()
+    with patch.object(trajectory_io.XTCReader, '_scan') as scan:
+        np.testing.assert_equal(open_trajectory(path)._offsets, offsets)
+        scan.assert_not_called()
+    # a changed file is scanned again
+    with open(path, 'ab') as fh:
+        fh.write(open(nv.datafiles.XTC, 'rb').read())
+    assert open_trajectory(path).n_frames == 2 * len(offsets)
+
+
+def test_unknown_extension():
+    with pytest.raises(ValueError):
+        open_trajectory(nv.datafiles.PDB)
+
+
+def test_file_trajectory():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    assert t.n_frames == 51
+    assert t.get_coordinates(3).shape == (5547, 3)
+    view = nv.NGLWidget(t)
+    assert view._ngl_msg_archive[0]['kwargs']['ext'] == 'gro'
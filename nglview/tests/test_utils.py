@@ -181,6 +181,20 @@ def test_get_repr_names_from_dict():
                  ['cartoon', 'base', 'ball+stick'])
 
 
+def test_imap_ordered():
+    import time
+
+    def slow_square(x):
+        # later items finish first
+        time.sleep(0.01 * (10 - x))
+        return x * x
+
+    for n_workers in [1, 4]:
+        assert_equal(list(py_utils.imap_ordered(slow_square, range(10),
+                                                n_workers)),
+                     [x * x for x in range(10)])
+
+
 def test_js_utils():
     js_utils.launch_qtconsole()
     js_utils.clean_empty_output_area()
@@ -1,6 +1,7 @@
 import gzip
 import os
 import sys
+import threading
 import time
 import unittest
 from functools import partial
@@ -268,6 +269,77 @@ def test_API_promise_to_have():
         assert isinstance(c, nv.widget.ComponentViewer)
 
 
+def test_image_data_binary():
+    view = nv.demo()
+    r = view.render_image(image_format='png')
+    # older frontends send base64
+    msg = {'type': 'image_data', 'ID': r.model_id, 'data': 'YmxhIGJsYQ=='}
+    view._ngl_handle_msg(view, msg, [])
+    assert r.value == view.get_image() == b'bla bla'
+    msg = {'type': 'image_data', 'ID': r.model_id, 'format': 'png'}
+    view._ngl_handle_msg(view, msg, [memoryview(b'\x89PNG')])
+    assert r.value == view.get_image() == b'\x89PNG'
+    assert view._widget_image.value == b'\x89PNG'
+    assert view._image_data == 'iVBORw=='
+    msg = {
+        'type': 'image_data',
+        'ID': r.model_id,
+        'format': 'rgba',
+        'width': 3,
+        'height': 2
+    }
+    view._ngl_handle_msg(view, msg, [memoryview(bytes(range(24)))])
+    assert view.get_image().shape == (2, 3, 4)
+    assert list(view.get_image()[1, 2]) == [20, 21, 22, 23]
+    assert r.value == view._widget_image.value == b'\x89PNG'
+
+
+def test_on_rendered():
+    view = nv.demo()
+    rendered = []
+    view._on_rendered(lambda: rendered.append(1))
+    msg = view._ngl_displayed_callbacks_before_loaded[-1]._ngl_msg
+    assert msg['methodName'] == 'renderBarrier'
+    assert msg not in view._ngl_msg_archive
+    token = msg['args'][0]
+    view._ngl_handle_msg(view, {'type': 'render_ack', 'data': 'other'}, [])
+    assert rendered == []
+    view._ngl_handle_msg(view, {'type': 'render_ack', 'data': token}, [])
+    # from other views of the same widget
+    view._ngl_handle_msg(view, {'type': 'render_ack', 'data': token}, [])
+    assert rendered == [1]
+    assert view._render_acks == {}
+
+
+def test_on_rendered_timeout(caplog):
+    view = nv.demo()
+    rendered = threading.Event()
+    # never displayed, no ack
+    view._on_rendered(rendered.set, timeout=0.01)
+    assert rendered.wait(5)
+    assert view._render_acks == {}
+    assert 'no render acknowledgement' in caplog.text
+    caplog.clear()
+    # acknowledged in time
+    view._on_rendered(lambda: None, timeout=0.05)
+    token, = view._render_acks
+    view._ngl_handle_msg(view, {'type': 'render_ack', 'data': token}, [])
+    time.sleep(0.1)
+    assert 'no render acknowledgement' not in caplog.text
+
+
+@unittest.skipUnless(has_pytraj, 'skip if not having pytraj')
+def test_pytraj_topology_columns():
+    from nglview.utils.structure_io import read_pdb
+    traj = pt.load(nv.datafiles.PDB)
+    top = nv.PyTrajTrajectory(traj)._get_topology()
+    assert top['elements'][:3] == ['C', 'H', 'H']
+    parsed = read_pdb(nv.PyTrajTrajectory(traj).get_structure_string())
+    assert parsed['elements'].tolist() == top['elements']
+    if top['chains'] is not None:
+        assert parsed['chains'].tolist() == top['chains']
+
+
 @unittest.skipUnless(has_pytraj, 'skip if not having pytraj')
 @unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
 def test_add_trajectory():
@@ -550,6 +622,162 @@ def test_show_mdtraj():
     view = nv.show_mdtraj(traj)
 
 
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_mdtraj_structure_string_switches_to_cif():
+    import mdtraj as md
+    from nglview.utils.structure_cache import cache as structure_cache
+    structure_cache.clear()
+    t = nv.MDTrajTrajectory(md.load(nv.datafiles.PDB))
+    assert t.get_structure_string().startswith('CRYST1')
+    assert t.ext == 'pdb'
+    with patch('nglview.adaptor.PDB_MAX_ATOMS', 10):
+        structure_cache.clear()
+        assert t.get_structure_string().startswith('data_nglview')
+    assert t.ext == 'cif'
+
+
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_load_binary_topology():
+    import mdtraj as md
+    t = nv.MDTrajTrajectory(md.load(nv.datafiles.PDB))
+    view = nv.NGLWidget(t)
+    msg, = view._ngl_msg_archive
+    assert msg['kwargs']['ext'] == 'mmtf'
+    blob, = view._ngl_blobs
+    assert msg['args'][0] == {
+        'type': 'blob_ref',
+        'data': 'IPY_MODEL_' + blob.model_id,
+        'binary': True
+    }
+    assert blob.binary
+    assert blob.data == t.get_structure_buffer()
+    # a second view shares the blob
+    view2 = nv.NGLWidget(nv.MDTrajTrajectory(md.load(nv.datafiles.PDB)))
+    assert view2._ngl_blobs == [blob]
+
+
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_get_coordinates_batch():
+    import mdtraj as md
+    t = nv.MDTrajTrajectory(md.load(nv.datafiles.XTC, top=nv.datafiles.GRO))
+    xyz = t.get_coordinates_batch([0, 2, 1])
+    assert xyz.shape == (3, t.trajectory.n_atoms, 3)
+    assert xyz.dtype == np.float32
+    for frame, index in zip(xyz, [0, 2, 1]):
+        aa_eq(frame, t.get_coordinates(index), decimal=4)
+    # frames read one after the other do not alias
+    frames = [t.get_coordinates(index) for index in range(2)]
+    aa_eq(frames[0], 10 * t.trajectory.xyz[0])
+    aa_eq(frames[1], 10 * t.trajectory.xyz[1])
+
+    # default implementation loops over get_coordinates
+    class MyTrajectory(nv.Trajectory):
+        n_frames = 3
+        _buffer = np.empty((2, 3))
+
+        def get_coordinates(self, index):
+            # reused array
+            self._buffer[:] = index
+            return self._buffer
+
+    xyz = MyTrajectory().get_coordinates_batch([2, 0])
+    assert xyz.shape == (2, 2, 3)
+    assert xyz.dtype == np.float32
+    aa_eq(xyz[:, 0, 0], [2, 0])
+    assert MyTrajectory().get_coordinates_batch([]).shape == (0, 0, 3)
+
+
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_atom_subset_trajectory():
+    import mdtraj as md
+    traj = md.load(nv.datafiles.XTC, top=nv.datafiles.GRO)
+    t = nv.MDTrajTrajectory(traj)
+    protein = traj.topology.select('protein')
+    subset = nv.AtomSubsetTrajectory(t, 'protein')
+    aa_eq(subset.atom_indices, protein)
+    assert subset.n_frames == t.n_frames
+    aa_eq(subset.get_coordinates(3), t.get_coordinates(3)[protein])
+    aa_eq(subset.get_coordinates_batch([3, 1]),
+          t.get_coordinates_batch([3, 1])[:, protein])
+    top = subset._get_topology()
+    assert len(top['names']) == len(protein)
+    n_bonds = traj.atom_slice(protein).topology.n_bonds
+    assert len(top['bonds']) == n_bonds
+    assert top['bonds'].max() < len(protein)
+    pdb = subset.get_structure_string()
+    assert pdb.count('\nATOM') + pdb.startswith('ATOM') == len(protein)
+
+    view = nv.NGLWidget()
+    view.add_trajectory(t, atom_indices=[0, 1, 2], stride=10)
+    assert view.max_frame == 5
+    assert view._trajlist[0].get_coordinates(1).shape == (3, 3)
+
+
+def test_atom_subset_trajectory_from_pdb():
+    # a trajectory only giving a PDB string
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.PDB)
+    subset = nv.AtomSubsetTrajectory(t, [5, 2, 3])
+    aa_eq(subset.atom_indices, [2, 3, 5])
+    assert subset._get_topology()['names'].tolist() == ['2HH3', '3HH3', 'O']
+    with pytest.raises(ValueError):
+        nv.AtomSubsetTrajectory(t, 'protein')
+    with pytest.raises(ValueError):
+        nv.AtomSubsetTrajectory(
+            nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO), [0])
+
+
+@unittest.skipUnless(has_mdtraj, 'skip if not having mdtraj')
+def test_thread_safe_reader_lock():
+    from concurrent.futures import ThreadPoolExecutor
+    import mdtraj as md
+    from nglview.base_adaptor import thread_safe_reader
+    traj = md.load(nv.datafiles.XTC, top=nv.datafiles.GRO)
+
+    class Reused(nv.Trajectory):
+        # a user adaptor reusing its output array
+        n_frames = traj.n_frames
+        _buffer = np.empty(traj.xyz.shape[1:], dtype='f4')
+
+        def get_coordinates(self, index):
+            np.multiply(traj.xyz[index], 10, out=self._buffer)
+            return self._buffer
+
+    t = Reused()
+    assert t.concurrency == 'lock'
+    reader = thread_safe_reader(t)
+    assert thread_safe_reader(t) is reader
+    # the reader copies the reused array
+    with ThreadPoolExecutor(8) as pool:
+        frames = list(pool.map(reader.get_coordinates, range(t.n_frames)))
+    for index, xyz in enumerate(frames):
+        aa_eq(xyz, 10 * traj.xyz[index], decimal=4)
+
+    m = nv.MDTrajTrajectory(traj)
+    assert thread_safe_reader(m) is m
+
+    f = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    assert thread_safe_reader(f) is f
+
+
+@unittest.skipUnless(has_MDAnalysis, 'skip if not having MDAnalysis')
+def test_thread_safe_reader_clone():
+    from concurrent.futures import ThreadPoolExecutor
+    from MDAnalysis import Universe
+    from nglview.base_adaptor import thread_safe_reader
+    u = Universe(nv.datafiles.GRO, nv.datafiles.XTC)
+    expected = [u.atoms.positions.copy() for _ in u.trajectory]
+    t = nv.MDAnalysisTrajectory(u)
+    assert t.concurrency == 'clone'
+    reader = thread_safe_reader(t)
+    with ThreadPoolExecutor(4) as pool:
+        frames = list(pool.map(reader.get_coordinates, range(t.n_frames)))
+    for index, xyz in enumerate(frames):
+        aa_eq(xyz, expected[index])
+    # subset/sliced views read through the wrapped trajectory's reader
+    sliced = nv.SlicedTrajectory(t, stride=10)
+    aa_eq(thread_safe_reader(sliced).get_coordinates(2), expected[20])
+
+
 @unittest.skipUnless(has_HTMD, 'skip if not having HTMD')
 def test_show_htmd():
     from htmd import Molecule
@@ -572,6 +800,52 @@ def test_show_MDAnalysis():
     view = nv.show_mdanalysis(u)
 
 
+@unittest.skipUnless(has_MDAnalysis, 'skip if not having MDAnalysis')
+def test_MDAnalysis_own_reader():
+    from MDAnalysis import Universe
+    u = Universe(nv.datafiles.GRO, nv.datafiles.XTC)
+    protein = u.select_atoms('protein')
+    expected = [protein.positions.copy() for _ in u.trajectory]
+    u.trajectory[5]
+    t = nv.MDAnalysisTrajectory(protein)
+    for index in [0, 1, 2, 10, 3, -1]:
+        aa_eq(t.get_coordinates(index), expected[index])
+    # the user's universe stays where it was
+    assert u.trajectory.ts.frame == 5
+    # sequential access does not seek
+    t.get_coordinates(0)
+    with patch.object(type(t._reader), '__getitem__') as seek:
+        for index in range(1, 5):
+            t.get_coordinates(index)
+        seek.assert_not_called()
+
+
+@unittest.skipUnless(has_MDAnalysis, 'skip if not having MDAnalysis')
+def test_MDAnalysis_in_memory():
+    from MDAnalysis import Universe
+    from nglview.base_adaptor import thread_safe_reader
+    u = Universe(nv.datafiles.GRO, nv.datafiles.XTC, in_memory=True)
+    protein = u.select_atoms('protein')
+    expected = [protein.positions.copy() for _ in u.trajectory]
+    u.trajectory[5]
+    t = nv.MDAnalysisTrajectory(protein)
+    for index in [0, 1, 2, 10, 3, -1]:
+        aa_eq(t.get_coordinates(index), expected[index])
+    # no copy of the coordinates, and the user's reader does not move
+    assert t._reader is u.trajectory
+    assert u.trajectory.ts.frame == 5
+    assert t.concurrency == 'thread-safe'
+    assert thread_safe_reader(t) is t
+    # unit cell of frame 0
+    aa_eq(t._get_topology()['box'], u.trajectory.dimensions_array[0])
+    # other storage order
+    u = Universe(nv.datafiles.GRO,
+                 u.trajectory.timeseries(order='acf'),
+                 order='acf')
+    t = nv.MDAnalysisTrajectory(u.select_atoms('protein'))
+    aa_eq(t.get_coordinates(3), expected[3])
+
+
 @unittest.skipUnless(has_parmed, 'skip if not having ParmEd')
 def test_show_parmed():
     import parmed as pmd
@@ -584,6 +858,140 @@ def test_show_parmed():
     ngl_traj.get_structure_string()
 
 
+@unittest.skipUnless(has_parmed, 'skip if not having ParmEd')
+def test_parmed_lazy_coordinates():
+    import parmed as pmd
+    parm = pmd.load_file(nv.datafiles.PDB)
+    xyz = np.stack([parm.coordinates, parm.coordinates + 1])
+    parm.coordinates = xyz
+    t = nv.ParmEdTrajectory(parm)
+    assert t._xyz is None
+    assert t.n_frames == 2
+    assert t._xyz is None
+    frame = t.get_coordinates(1)
+    assert frame.dtype == np.float32
+    aa_eq(frame, xyz[1], decimal=4)
+    # frames read one after the other do not alias
+    aa_eq(t.get_coordinates(0), xyz[0], decimal=4)
+    aa_eq(frame, xyz[1], decimal=4)
+    aa_eq(t.get_coordinates_batch([1, 0]), xyz[::-1], decimal=4)
+
+
+def test_streaming_trajectory():
+    def frames():
+        for i in range(250):
+            yield np.full((3, 3), i)
+
+    structure = nv.TextStructure(open(get_fn('tz2.pdb')).read())
+    t = nv.StreamingTrajectory(frames(), structure, window=100, chunk_size=50)
+    assert t.get_structure_string() == structure.get_structure_string()
+    # reads ahead half a window
+    t._thread.join(0.5)
+    assert t.n_frames == 100
+    view = nv.NGLWidget(t)
+    assert view.max_frame == 99
+    aa_eq(t.get_coordinates(3), np.full((3, 3), 3))
+    aa_eq(t.get_coordinates(249), np.full((3, 3), 249))
+    t._thread.join()
+    assert t.n_frames == 250
+    assert view.max_frame == 249
+    with pytest.raises(IndexError):
+        t.get_coordinates(3)
+    with pytest.raises(IndexError):
+        t.get_coordinates(250)
+
+    # chunks of frames
+    t = nv.StreamingTrajectory([np.zeros((4, 3, 3))] * 3, structure)
+    assert t.get_coordinates(11).shape == (3, 3)
+
+
+def test_streaming_trajectory_error():
+    def frames():
+        yield np.zeros((3, 3))
+        raise OSError('truncated file')
+
+    structure = nv.TextStructure(open(get_fn('tz2.pdb')).read())
+    t = nv.StreamingTrajectory(frames(), structure, chunk_size=1)
+    t.get_coordinates(0)
+    with pytest.raises(RuntimeError):
+        t.get_coordinates(1)
+    with pytest.raises(OSError):
+        nv.StreamingTrajectory(frames(), structure)
+
+
+def test_sliced_trajectory():
+    t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    sliced = nv.SlicedTrajectory(t, 10, None, 20)
+    assert sliced.n_frames == 3
+    assert sliced.ext == 'gro'
+    aa_eq(sliced.get_coordinates(1), t.get_coordinates(30))
+    aa_eq(sliced.get_coordinates(-1), t.get_coordinates(50))
+    aa_eq(sliced.get_coordinates_batch([2, 0]),
+          t.get_coordinates_batch([50, 10]))
+    with pytest.raises(IndexError):
+        sliced.get_coordinates(3)
+
+    view = nv.NGLWidget()
+    view.add_trajectory(t, stride=10)
+    assert view.max_frame == 5
+    view.frame = 5
+    view.set_frame_range(stop=20)
+    assert view.max_frame == 19
+    assert view.frame == 5
+    view.set_frame_range(stride=25)
+    assert view.max_frame == 2
+    assert view.frame == 2
+    view.set_frame_range()
+    assert view.max_frame == 50
+    assert view._trajlist == [t]
+
+
+def test_concat_trajectory():
+    opened = []
+
+    def open_segment():
+        t = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+        t.close = MagicMock()
+        opened.append(t)
+        return t
+
+    full = nv.FileTrajectory(nv.datafiles.XTC, nv.datafiles.GRO)
+    t = nv.ConcatTrajectory([open_segment] * 3, max_open=2)
+    assert t.n_frames == 3 * 51
+    # counting frames opened every segment once, only 2 are kept open
+    assert len(opened) == 3
+    opened[0].close.assert_called_once_with()
+    assert t.ext == 'gro'
+    aa_eq(t.get_coordinates(51 + 7), full.get_coordinates(7))
+    aa_eq(t.get_coordinates(-1), full.get_coordinates(50))
+    aa_eq(t.get_coordinates_batch([102, 0, 51]),
+          full.get_coordinates_batch([0, 0, 0]))
+    with pytest.raises(IndexError):
+        t.get_coordinates(153)
+
+    # known frame counts, nothing is opened up front
+    opened.clear()
+    t = nv.ConcatTrajectory([open_segment, full], n_frames=[51, 51])
+    assert not opened
+    view = nv.NGLWidget(t)
+    assert view.max_frame == 101
+
+    # segments of another system
+    class Small(nv.Trajectory):
+        n_frames = 51
+
+        def get_coordinates(self, index):
+            return np.zeros((10, 3), dtype='f4')
+
+    subset = Small()
+    with pytest.raises(ValueError, match='segment 1 has 10 atoms'):
+        nv.ConcatTrajectory([full, subset])
+    t = nv.ConcatTrajectory([open_segment, lambda: subset], n_frames=[51, 51])
+    t.get_coordinates(0)
+    with pytest.raises(ValueError, match='segment 1 has 10 atoms'):
+        t.get_coordinates(51)
+
+
 def test_encode_and_decode():
     xyz = np.arange(100).astype('f4')
     shape = xyz.shape
@@ -1047,8 +1455,9 @@ def test_write_html(mock_unset):
         nv.write_html(fp, [view], frame_range=(0, 3))
         mock_embed.assert_called_with([tm, cm, view])
     mock_unset.assert_called_with()
-    assert len(view._ngl_coordinate_resource[0]) == 3
-    assert len(view._ngl_coordinate_resource[1]) == 3
+    assert view._ngl_coordinate_resource['n_frames'] == 3
+    assert view._ngl_coordinate_resource[0]['n_frames'] == 3
+    assert view._ngl_coordinate_resource[1]['n_frames'] == 3
 
     # box
     with patch.object(embed, 'embed_snippet') as mock_embed:
@@ -0,0 +1,200 @@
+"""Pack the frames of a trajectory into one binary bundle for embedding.
+
+`write_html` stores one bundle per trajectory instead of one base64 string
+per frame. The standalone page decodes a bundle once into a Float32Array and
+takes frame `i` as the slice ``[i * n_atoms * 3, (i + 1) * n_atoms * 3)``.
+
+Layout of the decoded `data` (little endian, frames are contiguous):
+
+- ``'f4'``: the float32 coordinates.
+- ``'i4'``: with `precision`, coordinates are rounded to multiples of
+  `precision` angstrom and every frame is stored as the difference to the
+  previous one, which deflates much better than floats. Every
+  `key_interval`-th frame (0, key_interval, ...) is the difference to zero.
+
+Frames are encoded in batches of `key_interval` frames which do not depend
+on each other, so they are read and compressed in parallel. With
+`compress`, each batch is a raw deflate block ending on a byte boundary,
+the blocks are joined into one zlib stream (as pigz does).
+
+Examples
+--------
+>>> bundle = encode_coordinate_bundle(frames, precision=1e-3) # doctest: +SKIP
+>>> decode_coordinate_bundle(bundle).shape # doctest: +SKIP
+(n_frames, n_atoms, 3)
+"""
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+from .py_utils import imap_ordered
+
+__all__ = [
+    'encode_coordinate_bundle', 'decode_coordinate_bundle',
+    'bundle_header', 'iter_bundle_data'
+]
+
+_ADLER_BASE = 65521
+
+
+def bundle_header(n_frames,
+                  n_atoms,
+                  precision=None,
+                  compress=True,
+                  key_interval=100):
+    """Everything of a bundle but its `data`"""
+    return {
+        'n_frames': n_frames,
+        'n_atoms': n_atoms,
+        'dtype': 'f4' if precision is None else 'i4',
+        'precision': precision,
+        'compression': 'deflate' if compress else None,
+        'key_interval': key_interval,
+    }
+
+
+def _check_shape(xyz):
+    if not xyz.size:
+        xyz = xyz.reshape(0, 0, 3)
+    if xyz.ndim != 3 or xyz.shape[2] != 3:
+        raise ValueError(f'frames must have shape (n_frames, n_atoms, 3), '
+                         f'got {xyz.shape}')
+    return xyz
+
+
+def _adler32_combine(adler1, adler2, len2):
+    # port of zlib's adler32_combine: checksum of data1 + data2
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xffff) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + \
+        _ADLER_BASE - rem
+    return (sum1 % _ADLER_BASE) | ((sum2 % _ADLER_BASE) << 16)
+
+
+def _encode_batch(xyz, precision, compress, last):
+    xyz = _check_shape(np.asarray(xyz, dtype='f4'))
+    if precision is None:
+        data = xyz.astype('<f4').tobytes()
+    else:
+        ints = np.rint(xyz / precision).astype(np.int64)
+        # so that the differences fit in int32 as well
+        if ints.size and np.abs(ints).max() >= 2**30:
+            raise ValueError(f'precision {precision} is too small for '
+                             f'the range of the coordinates')
+        data = np.diff(ints, axis=0, prepend=0).astype('<i4').tobytes()
+    if not compress:
+        return data, None, len(data)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    block = compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return block, zlib.adler32(data), len(data)
+
+
+def iter_bundle_data(read,
+                     n_frames,
+                     precision=None,
+                     compress=True,
+                     key_interval=100,
+                     n_workers=None):
+    """Yield the base64 `data` of a bundle piece by piece.
+
+    Batches of `key_interval` frames are read and encoded by `n_workers`
+    threads, at most a few batches are held at a time, so pages with any
+    number of frames are written with bounded memory. The output does not
+    depend on `n_workers`.
+
+    Parameters
+    ----------
+    read : callable
+        `read(positions) -> array, shape=(len(positions), n_atoms, 3)`, the
+        frames at `positions` (a range within `range(n_frames)`) in
+        angstrom. Called from worker threads.
+    n_frames : int
+    precision, compress : see `encode_coordinate_bundle`
+    key_interval : int, default 100
+    n_workers : int, optional
+        Default: number of CPUs.
+    """
+    starts = range(0, n_frames, key_interval)
+
+    def encode(start):
+        positions = range(start, min(start + key_interval, n_frames))
+        return _encode_batch(read(positions), precision, compress,
+                             start == starts[-1])
+
+    checksum = 1
+    pending = b'\x78\x9c' if compress else b''
+    if compress and not n_frames:
+        pending += zlib.compressobj(6, zlib.DEFLATED,
+                                    -zlib.MAX_WBITS).flush()
+    for data, adler, size in imap_ordered(encode, starts, n_workers):
+        if compress:
+            checksum = _adler32_combine(checksum, adler, size)
+        # base64 encodes groups of 3 bytes, keep the rest for the next piece
+        pending += data
+        n_bytes = len(pending) // 3 * 3
+        if n_bytes:
+            yield base64.b64encode(pending[:n_bytes]).decode('ascii')
+            pending = pending[n_bytes:]
+    if compress:
+        pending += struct.pack('>I', checksum)
+    yield base64.b64encode(pending).decode('ascii')
+
+
+def encode_coordinate_bundle(frames,
+                             precision=None,
+                             compress=True,
+                             key_interval=100,
+                             n_workers=1):
+    """
+    Parameters
+    ----------
+    frames : array like, shape=(n_frames, n_atoms, 3)
+        Coordinates in angstrom.
+    precision : float, optional
+        Quantize the coordinates to this many angstrom, e.g. 1e-3 (the
+        precision of an XTC file). Default: keep float32.
+    compress : bool, default True
+        Deflate (zlib) the data.
+    key_interval : int, default 100
+        Frames per independently encoded batch.
+    n_workers : int, default 1
+        Threads encoding the batches.
+
+    Returns
+    -------
+    dict, JSON serializable
+    """
+    xyz = _check_shape(np.asarray(frames, dtype='f4'))
+    bundle = bundle_header(xyz.shape[0], xyz.shape[1], precision, compress,
+                           key_interval)
+    bundle['data'] = ''.join(
+        iter_bundle_data(lambda positions: xyz[positions.start:positions.stop],
+                         len(xyz),
+                         precision,
+                         compress,
+                         key_interval,
+                         n_workers=n_workers))
+    return bundle
+
+
+def decode_coordinate_bundle(bundle):
+    """Inverse of `encode_coordinate_bundle`, shape=(n_frames, n_atoms, 3)"""
+    data = base64.b64decode(bundle['data'])
+    if bundle['compression'] == 'deflate':
+        data = zlib.decompress(data)
+    shape = (bundle['n_frames'], bundle['n_atoms'], 3)
+    if bundle['dtype'] == 'f4':
+        return np.frombuffer(data, dtype='<f4').reshape(shape)
+    ints = np.frombuffer(data, dtype='<i4').reshape(shape)
+    xyz = np.empty(shape, dtype='f4')
+    step = bundle['key_interval']
+    for start in range(0, shape[0], step):
+        xyz[start:start + step] = np.cumsum(
+            ints[start:start + step], axis=0,
+            dtype=np.int64) * bundle['precision']
+    return xyz
@@ -0,0 +1,377 @@
+"""Encode per-atom arrays as binary MMTF.
+
+https://github.com/rcsb/mmtf/blob/master/spec.md
+
+NGL reads MMTF natively, so a trajectory adaptor can ship its topology as a
+compact binary blob (with explicit bonds) instead of PDB text that has to be
+formatted here and parsed again in the browser. Only the msgpack subset and
+the codecs used below are implemented.
+"""
+import itertools
+import struct
+
+import numpy as np
+
+from .structure_io import _prepare, _unit_cell
+
+__all__ = ['write_mmtf']
+
+_NUCLEIC_RESIDUES = {
+    b'A': 'RNA LINKING',
+    b'C': 'RNA LINKING',
+    b'G': 'RNA LINKING',
+    b'U': 'RNA LINKING',
+    b'I': 'RNA LINKING',
+    b'DA': 'DNA LINKING',
+    b'DC': 'DNA LINKING',
+    b'DG': 'DNA LINKING',
+    b'DT': 'DNA LINKING',
+    b'DI': 'DNA LINKING',
+}
+
+
+def _pack(obj, out):
+    # minimal msgpack encoder: dict, list, str, bytes, int, float, bool, None
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True or obj is False:
+        out.append(b'\xc3' if obj else b'\xc2')
+    elif isinstance(obj, (int, np.integer)):
+        obj = int(obj)
+        if 0 <= obj < 128:
+            out.append(struct.pack('>B', obj))
+        elif -32 <= obj < 0:
+            out.append(struct.pack('>b', obj))
+        elif -2**31 <= obj < 2**31:
+            out.append(b'\xd2' + struct.pack('>i', obj))
+        else:
+            out.append(b'\xd3' + struct.pack('>q', obj))
+    elif isinstance(obj, (float, np.floating)):
+        out.append(b'\xcb' + struct.pack('>d', obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf8')
+        n = len(data)
+        if n < 32:
+            out.append(struct.pack('>B', 0xa0 | n))
+        else:
+            out.append(b'\xdb' + struct.pack('>I', n))
+        out.append(data)
+    elif isinstance(obj, bytes):
+        out.append(b'\xc6' + struct.pack('>I', len(obj)))
+        out.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('>B', 0x90 | n))
+        else:
+            out.append(b'\xdd' + struct.pack('>I', n))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('>B', 0x80 | n))
+        else:
+            out.append(b'\xdf' + struct.pack('>I', n))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f'can not pack {type(obj)}')
+
+
+def _encode(codec, length, param, data):
+    return struct.pack('>iii', codec, length, param) + data
+
+
+def _run_length(values):
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return np.empty(0, dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(np.diff(values)) + 1]
+    counts = np.diff(np.r_[starts, len(values)])
+    return np.column_stack([values[starts], counts]).ravel()
+
+
+def _recursive_index(values):
+    # split values outside int16 into runs of int16 max/min plus a remainder
+    values = np.asarray(values, dtype=np.int64)
+    limit = np.where(values < 0, -32768, 32767)
+    n_extra = values // limit
+    out = np.repeat(limit, n_extra + 1)
+    ends = np.cumsum(n_extra + 1) - 1
+    out[ends] = values - n_extra * limit
+    return out
+
+
+def _int32(values):
+    return np.asarray(values, dtype='>i4').tobytes()
+
+
+def _encode_int8(values):
+    return _encode(2, len(values), 0, np.asarray(values, dtype='i1').tobytes())
+
+
+def _encode_int32(values):
+    return _encode(4, len(values), 0, _int32(values))
+
+
+def _encode_strings(values, width=4):
+    values = np.asarray(values, dtype=f'S{width}')
+    return _encode(5, len(values), width, values.tobytes())
+
+
+def _encode_run_length_chars(values):
+    codes = np.asarray(values, dtype='S1').view(np.uint8)
+    return _encode(6, len(codes), 0, _int32(_run_length(codes)))
+
+
+def _encode_delta_run_length(values):
+    values = np.asarray(values, dtype=np.int64)
+    return _encode(8, len(values), 0,
+                   _int32(_run_length(np.diff(values, prepend=0))))
+
+
+def _encode_run_length_floats(values, divisor):
+    ints = np.rint(np.asarray(values) * divisor)
+    return _encode(9, len(ints), divisor, _int32(_run_length(ints)))
+
+
+def _encode_delta_floats(values, divisor):
+    ints = np.rint(np.asarray(values, dtype='f8') * divisor).astype(np.int64)
+    deltas = np.diff(ints, prepend=0)
+    return _encode(10, len(ints), divisor,
+                   _recursive_index(deltas).astype('>i2').tobytes())
+
+
+def _guess_elements(names, elements):
+    missing = np.char.str_len(elements) == 0
+    if not missing.any():
+        return elements
+    guessed = np.char.lstrip(names, b'0123456789').astype('S1')
+    return np.where(missing, guessed, elements)
+
+
+def _chem_comp_type(resname, hetero):
+    if hetero:
+        return 'NON-POLYMER'
+    return _NUCLEIC_RESIDUES.get(resname, 'L-PEPTIDE LINKING')
+
+
+# MMTF secStructList codes: alpha helix, extended (sheet), coil
+_SSTRUC_CODES = {'h': 2, 'e': 3, 'c': 7}
+# reference CA(i)-CA(i+2..4) distances and tolerance of NGL's
+# calculateSecondaryStructure
+_HELIX_DISTANCES = (np.array([5.45, 5.18, 6.37]), 2.1)
+_SHEET_DISTANCES = (np.array([6.1, 10.4, 13.0]), 1.42)
+
+
+def _matches(trace, distances):
+    # residues i for which every CA(h)-CA(h+2..4) distance, h in
+    # [i-2, i], is close to the reference (pairs past the end are ignored)
+    reference, tolerance = distances
+    n = len(trace)
+    good = np.ones(n, dtype=bool)
+    for k, d in enumerate(reference):
+        step = k + 2
+        if step < n:
+            actual = np.linalg.norm(trace[step:] - trace[:-step], axis=1)
+            good[:-step] &= np.abs(actual - d) <= tolerance
+    match = good.copy()
+    match[1:] &= good[:-1]
+    match[2:] &= good[:-2]
+    return match
+
+
+def _secondary_structure(names, hetero, xyz, group_starts, new_chain):
+    """Per-group secStructList codes, computed as NGL does for PDB files
+    without HELIX/SHEET records (calculateSecondaryStructure): from the CA
+    trace of each protein segment of at least 4 residues. NGL takes the
+    codes of MMTF files as they are, -1 would leave the cartoon without
+    helices and sheets.
+    """
+    n_groups = len(group_starts)
+    codes = np.full(n_groups, -1)
+    ca = np.flatnonzero((names == b'CA') & ~hetero)
+    atom_group = np.searchsorted(group_starts, ca, side='right') - 1
+    # first CA of each group
+    atom_group, first = np.unique(atom_group, return_index=True)
+    ca = ca[first]
+    trace = xyz[ca]
+    # segments break at chain ends, groups without CA and chain breaks
+    breaks = np.ones(len(ca), dtype=bool)
+    breaks[1:] = ((np.diff(atom_group) != 1) |
+                  new_chain[group_starts[atom_group[1:]]] |
+                  (np.linalg.norm(np.diff(trace, axis=0), axis=1) > 4.2))
+    bounds = np.r_[np.flatnonzero(breaks), len(ca)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end - start < 4:
+            continue
+        segment = trace[start:end]
+        sstruc = np.where(
+            _matches(segment, _HELIX_DISTANCES), 'h',
+            np.where(_matches(segment, _SHEET_DISTANCES), 'e', 'c')).tolist()
+        # single residue runs become coil, as in NGL
+        previous, run = None, 0
+        for i, value in enumerate(sstruc):
+            if value == previous:
+                run += 1
+                continue
+            if run == 1:
+                sstruc[i - 1] = 'c'
+                previous = 'c'
+            else:
+                previous = value
+            run = 1
+        codes[atom_group[start:end]] = [_SSTRUC_CODES[v] for v in sstruc]
+    return codes
+
+
+def write_mmtf(names,
+               resnames,
+               resids,
+               xyz,
+               chains=None,
+               elements=None,
+               hetero=None,
+               bonds=None,
+               bond_orders=None,
+               box=None):
+    """Encode a single model structure as MMTF.
+
+    Parameters
+    ----------
+    names, resnames, resids, xyz, chains, elements, hetero
+        Same as for `nglview.utils.structure_io.write_pdb`. Residues are
+        consecutive atoms sharing chain, residue number and name.
+    bonds : array-like of int, shape=(n_bonds, 2), optional
+        Atom index pairs. If None, NGL computes bonds itself.
+    bond_orders : array-like of int, shape=(n_bonds,), optional
+        Defaults to single bonds.
+    box : array-like, shape=(6,), optional
+        Unit cell, as for `write_pdb`; stored as `unitCell` with space
+        group P 1.
+
+    Returns
+    -------
+    bytes
+    """
+    names, resnames, resids, xyz, chains, elements, hetero = _prepare(
+        names, resnames, resids, xyz, chains, elements, hetero)
+    n_atoms = len(xyz)
+    elements = _guess_elements(names, elements)
+    if n_atoms and not np.char.str_len(chains).any():
+        chains = np.full(n_atoms, b'A', dtype='S1')
+
+    # residue ("group") and chain boundaries
+    new_chain = np.ones(n_atoms, dtype=bool)
+    new_chain[1:] = chains[1:] != chains[:-1]
+    new_group = new_chain.copy()
+    new_group[1:] |= (resids[1:] != resids[:-1]) | (resnames[1:] !=
+                                                    resnames[:-1])
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.r_[group_starts[1:], n_atoms]
+    atom_group = np.cumsum(new_group) - 1
+    chain_starts = np.flatnonzero(new_chain)
+    groups_per_chain = np.diff(np.r_[atom_group[chain_starts],
+                                     len(group_starts)])
+
+    if bonds is not None:
+        bonds = np.asarray(bonds, dtype=np.int64).reshape(-1, 2)
+        if bond_orders is None:
+            bond_orders = np.ones(len(bonds), dtype=np.int64)
+        bond_orders = np.asarray(bond_orders, dtype=np.int64)
+        bonds = np.sort(bonds, axis=1)
+        intra = atom_group[bonds[:, 0]] == atom_group[bonds[:, 1]]
+        inter_bonds, inter_orders = bonds[~intra], bond_orders[~intra]
+        intra_bonds, intra_orders = bonds[intra], bond_orders[intra]
+        order = np.argsort(atom_group[intra_bonds[:, 0]], kind='stable')
+        intra_bonds, intra_orders = intra_bonds[order], intra_orders[order]
+        intra_group = atom_group[intra_bonds[:, 0]]
+        bond_starts = np.searchsorted(intra_group, np.arange(len(group_starts)))
+        bond_ends = np.r_[bond_starts[1:], len(intra_bonds)]
+        n_bonds = len(bonds)
+    else:
+        n_bonds = 0
+
+    # deduplicate residue templates ("group types"); plain lists are much
+    # faster to slice and hash than numpy arrays in this per-group loop
+    _, atom_codes = np.unique(np.char.add(np.char.add(names, b' '), elements),
+                              return_inverse=True)
+    atom_codes = atom_codes.ravel().tolist()
+    if bonds is not None:
+        local = intra_bonds - group_starts[intra_group][:, None]
+        intra_list = list(
+            zip(local[:, 0].tolist(), local[:, 1].tolist(),
+                intra_orders.tolist()))
+        bond_ranges = zip(bond_starts.tolist(), bond_ends.tolist())
+    else:
+        intra_list = []
+        bond_ranges = itertools.repeat((0, 0))
+    group_types = {}
+    group_list = []
+    group_type_list = []
+    for start, end, (bond_start, bond_end) in zip(group_starts.tolist(),
+                                                  group_ends.tolist(),
+                                                  bond_ranges):
+        group_bonds = intra_list[bond_start:bond_end]
+        key = (resnames[start], bool(hetero[start]),
+               tuple(atom_codes[start:end]), tuple(group_bonds))
+        type_index = group_types.get(key)
+        if type_index is None:
+            type_index = group_types[key] = len(group_list)
+            resname = resnames[start]
+            group_list.append({
+                'groupName': resname.decode(),
+                'atomNameList': [name.decode() for name in names[start:end]],
+                'elementList':
+                [element.decode() for element in elements[start:end]],
+                'formalChargeList': [0] * (end - start),
+                'bondAtomList': [i for a, b, _ in group_bonds for i in (a, b)],
+                'bondOrderList': [order for _, _, order in group_bonds],
+                'singleLetterCode': '?',
+                'chemCompType': _chem_comp_type(resname, hetero[start]),
+            })
+        group_type_list.append(type_index)
+
+    n_groups = len(group_starts)
+    chain_names = chains[chain_starts]
+    data = {
+        'mmtfVersion': '1.0.0',
+        'mmtfProducer': 'nglview',
+        'numBonds': n_bonds,
+        'numAtoms': n_atoms,
+        'numGroups': n_groups,
+        'numChains': len(chain_starts),
+        'numModels': 1,
+        'groupList': group_list,
+        'xCoordList': _encode_delta_floats(xyz[:, 0], 1000),
+        'yCoordList': _encode_delta_floats(xyz[:, 1], 1000),
+        'zCoordList': _encode_delta_floats(xyz[:, 2], 1000),
+        'bFactorList': _encode_delta_floats(np.zeros(n_atoms), 100),
+        'occupancyList': _encode_run_length_floats(np.ones(n_atoms), 100),
+        'atomIdList': _encode_delta_run_length(np.arange(1, n_atoms + 1)),
+        'altLocList': _encode_run_length_chars(np.zeros(n_atoms, dtype='S1')),
+        'groupIdList': _encode_delta_run_length(resids[group_starts]),
+        'groupTypeList': _encode_int32(group_type_list),
+        'secStructList': _encode_int8(
+            _secondary_structure(names, hetero, xyz, group_starts,
+                                 new_chain)),
+        'insCodeList': _encode_run_length_chars(np.zeros(n_groups,
+                                                         dtype='S1')),
+        'sequenceIndexList': _encode_delta_run_length(np.full(n_groups, -1)),
+        'chainIdList': _encode_strings(chain_names),
+        'chainNameList': _encode_strings(chain_names),
+        'groupsPerChain': groups_per_chain.tolist(),
+        'chainsPerModel': [len(chain_starts)],
+    }
+    box = _unit_cell(box)
+    if box is not None:
+        data['unitCell'] = box
+        data['spaceGroup'] = 'P 1'
+    if bonds is not None:
+        data['bondAtomList'] = _encode_int32(inter_bonds.ravel())
+        data['bondOrderList'] = _encode_int8(inter_orders)
+    out = []
+    _pack(data, out)
+    return b''.join(out)
@@ -51,6 +51,42 @@ def decode_base64(data, shape, dtype='f4'):
     return np.frombuffer(decoded_str, dtype=dtype).reshape(shape)
 
 
+def _image_from_msg(msg, buffers):
+    """Image sent by the frontend: PNG bytes, or a (height, width, 4) uint8
+    RGBA array for `format='rgba'` (a view on the message buffer).
+    """
+    if not buffers:
+        # older frontends send a base64 PNG
+        return base64.b64decode(msg['data'])
+    if msg.get('format') == 'rgba':
+        import numpy as np
+        return np.frombuffer(buffers[0], dtype=np.uint8).reshape(
+            msg['height'], msg['width'], 4)
+    return bytes(buffers[0])
+
+
+def imap_ordered(func, iterable, n_workers=None):
+    """Like `map`, with `func` running in a pool of `n_workers` threads
+    (default: number of CPUs). Results are yielded in order, and at most
+    `2 * n_workers` of them are pending at any time.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1:
+        yield from map(func, iterable)
+        return
+    with ThreadPoolExecutor(n_workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def get_name(obj, **kwargs):
     name = kwargs.pop('name', str(obj))
     if name.startswith('<nglview.'):
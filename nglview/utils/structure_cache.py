@@ -0,0 +1,106 @@
+"""Kernel level cache for adaptor structure output.
+
+Showing the same system in several widgets (or re-running a cell) would
+otherwise rebuild the PDB text / MMTF buffer every time. Adaptors opt in by
+implementing `_get_fingerprint`, see `nglview.adaptor`.
+
+Examples
+--------
+>>> from nglview.utils.structure_cache import cache # doctest: +SKIP
+... cache.max_bytes = 2**30  # allow 1 GB
+... cache.clear()
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['StructureCache', 'cache', 'hash_array', 'hash_strings']
+
+
+def hash_array(arr):
+    """Hash an array's content (e.g. coordinates of the first frame)"""
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((arr.dtype, arr.shape)).encode())
+    h.update(arr.data)
+    return h.hexdigest()
+
+
+def hash_strings(values):
+    """Hash a sequence of str, e.g. atom or residue names"""
+    return hashlib.blake2b('\0'.join(values).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 0
+
+
+class StructureCache:
+    """Least recently used cache, bounded by the total size of its values.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Entries are evicted (oldest use first) once the cached str/bytes
+        exceed this size. A single value larger than `max_bytes` is not
+        cached.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key, build):
+        """Return the value for `key`, calling `build()` on a miss"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = build()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        with self._lock:
+            if key in self._data:
+                self._nbytes -= _nbytes(self._data.pop(key))
+            if size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, old = self._data.popitem(last=False)
+                self._nbytes -= _nbytes(old)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+            self.hits = self.misses = 0
+
+
+cache = StructureCache()
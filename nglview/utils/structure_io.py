@@ -0,0 +1,427 @@
+"""Build structure text directly from per-atom arrays.
+
+Used by the adaptors to produce `get_structure_string` output in memory
+instead of round-tripping through a temporary file and the backend's writer.
+
+Records are formatted column-wise into a (n_atoms, line_width) byte buffer,
+so the cost is a handful of numpy operations per column instead of a Python
+string format per atom.
+"""
+import numpy as np
+
+__all__ = [
+    'write_pdb', 'write_cif', 'read_pdb', 'encode_hybrid36', 'PDB_MAX_ATOMS'
+]
+
+# largest atom count that fits the fixed-width PDB serial column
+PDB_MAX_ATOMS = 99999
+
+_STANDARD_RESIDUES = {
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+    'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL',
+    'ACE', 'NME', 'NMA', 'HID', 'HIE', 'HIP', 'HSD', 'HSE', 'HSP', 'CYX',
+    'CYM', 'ASH', 'GLH', 'LYN', 'A', 'C', 'G', 'U', 'I', 'DA', 'DC', 'DG',
+    'DT', 'DI'
+}
+
+_SPACE = ord(' ')
+_CIF_COLUMNS = [
+    'group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id',
+    'label_comp_id', 'label_asym_id', 'label_seq_id', 'pdbx_PDB_ins_code',
+    'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv',
+    'auth_seq_id', 'auth_asym_id', 'pdbx_PDB_model_num'
+]
+
+
+def _as_bytes_array(values, n_atoms, default=b''):
+    if values is None:
+        return np.full(n_atoms, default, dtype='S1')
+    values = np.asarray(values)
+    if values.dtype.kind == 'S':
+        return values
+    if values.dtype.kind != 'U':
+        values = values.astype(str)
+    # numpy stores str as UCS4, so ASCII text is every 4th byte
+    width = max(values.dtype.itemsize // 4, 1)
+    codes = values.astype(f'U{width}').view(np.uint32).reshape(-1, width)
+    if codes.size and codes.max() > 127:
+        raise ValueError('only ASCII text can be written')
+    return codes.astype(np.uint8).view(f'S{width}').ravel()
+
+
+def _put_text(buf, col, width, values, right=False):
+    values = np.asarray(values).astype(f'S{width}')
+    if right:
+        values = np.char.rjust(values, width)
+    chunk = values.view(np.uint8).reshape(len(values), width).copy()
+    chunk[chunk == 0] = _SPACE
+    buf[:, col:col + width] = chunk
+
+
+def _n_digits(values, width):
+    powers = 10**np.arange(1, width + 1, dtype=np.int64)
+    return np.searchsorted(powers, values, side='right') + 1
+
+
+def _put_digits(buf, col, width, values, negative):
+    # right aligned, like '%{width}d'
+    n_digits = _n_digits(values, width)
+    if np.any(n_digits + negative > width):
+        raise ValueError(f'value does not fit in {width} columns')
+    powers = 10**np.arange(width - 1, -1, -1, dtype=np.int64)
+    chunk = (48 + (values[:, None] // powers) % 10).astype(np.uint8)
+    chunk[np.arange(width) < (width - n_digits)[:, None]] = _SPACE
+    rows = np.flatnonzero(negative)
+    chunk[rows, width - 1 - n_digits[rows]] = ord('-')
+    buf[:, col:col + width] = chunk
+
+
+def _put_int(buf, col, width, values):
+    values = np.asarray(values, dtype=np.int64)
+    _put_digits(buf, col, width, np.abs(values), values < 0)
+
+
+def _put_float(buf, col, width, values, decimals=3):
+    # like '%{width}.{decimals}f'
+    scale = 10**decimals
+    scaled = np.rint(np.asarray(values, dtype='f8') * scale).astype(np.int64)
+    absolute = np.abs(scaled)
+    _put_digits(buf, col, width - decimals - 1, absolute // scale,
+                scaled < 0)
+    buf[:, col + width - decimals - 1] = ord('.')
+    _put_digits(buf, col + width - decimals, decimals, absolute % scale,
+                np.zeros(len(scaled), dtype=bool))
+    fraction = buf[:, col + width - decimals:col + width]
+    fraction[fraction == _SPACE] = ord('0')
+
+
+def encode_hybrid36(values, width):
+    """Encode integers as fixed-width hybrid-36 strings.
+
+    Numbers below 10**width are written as decimals, larger ones continue
+    with base 36 digits ('A0000', ..., 'zzzzz'), as understood by most PDB
+    readers for serials above 99999 and residue numbers above 9999.
+
+    Examples
+    --------
+    >>> encode_hybrid36([99999, 100000, 100001], 5)
+    array([b'99999', b'A0000', b'A0001'], dtype='|S5')
+    """
+    values = np.asarray(values, dtype=np.int64)
+    buf = np.full((len(values), width), _SPACE, dtype=np.uint8)
+    small = values < 10**width
+    sub = buf[small]
+    _put_int(sub, 0, width, values[small])
+    buf[small] = sub
+    sub = buf[~small]
+    _put_hybrid36_large(sub, width, values[~small])
+    buf[~small] = sub
+    return buf.view(f'S{width}').ravel()
+
+
+def _put_hybrid36_large(buf, width, values):
+    block = 26 * 36**(width - 1)
+    offset = values - 10**width
+    if np.any(offset >= 2 * block):
+        raise ValueError(f'value does not fit in {width} hybrid-36 columns')
+    upper = offset < block
+    code = np.where(upper, offset, offset - block) + 10 * 36**(width - 1)
+    for k in range(width):
+        digit = (code // 36**k) % 36
+        letter = np.where(upper, ord('A') - 10, ord('a') - 10) + digit
+        buf[:, width - 1 - k] = np.where(digit < 10, 48 + digit, letter)
+
+
+def _put_hybrid36(buf, col, width, values):
+    encoded = encode_hybrid36(values, width)
+    buf[:, col:col + width] = encoded.view(np.uint8).reshape(len(buf), width)
+
+
+def _put_serials(buf, col, width, values, hybrid36):
+    if hybrid36:
+        _put_hybrid36(buf, col, width, values)
+    else:
+        _put_int(buf, col, width, values % 10**width)
+
+
+def _conect_records(bonds, hetero, hybrid36):
+    # bonds of HETATM atoms, as MDTraj writes them; NGL knows the bonds of
+    # standard residues. Up to 4 bonded atoms per line.
+    bonds = np.asarray(bonds, dtype=np.int64).reshape(-1, 2)
+    bonds = bonds[hetero[bonds].any(axis=1)]
+    pairs = np.unique(np.concatenate([bonds, bonds[:, ::-1]]), axis=0)
+    if not len(pairs):
+        return b''
+    atoms = pairs[:, 0]
+    rank = np.arange(len(atoms)) - np.searchsorted(atoms, atoms)
+    new_line = rank % 4 == 0
+    line = np.cumsum(new_line) - 1
+    buf = np.full((line[-1] + 1, 32), _SPACE, dtype=np.uint8)
+    buf[:, 31] = ord('\n')
+    buf[:, :6] = np.frombuffer(b'CONECT', dtype=np.uint8)
+    _put_serials(buf, 6, 5, atoms[new_line] + 1, hybrid36)
+    for k in range(4):
+        selected = rank % 4 == k
+        rows = buf[line[selected]]
+        _put_serials(rows, 11 + 5 * k, 5, pairs[selected, 1] + 1, hybrid36)
+        buf[line[selected]] = rows
+    return buf.tobytes()
+
+
+def _pad_atom_names(names, elements):
+    """PDB convention: names of one-letter elements start at column 14"""
+    lengths = np.char.str_len(names)
+    first_is_alpha = np.char.isalpha(names.astype('S1'))
+    pad = (lengths < 4) & first_is_alpha & (np.char.str_len(elements) < 2)
+    return np.where(pad, np.char.add(b' ', names), names)
+
+
+def _get_hetero(resnames, hetero):
+    if hetero is None:
+        standard = np.array(sorted(_STANDARD_RESIDUES), dtype='S4')
+        return ~np.isin(resnames, standard)
+    return np.asarray(hetero, dtype=bool)
+
+
+def _unit_cell(box):
+    """(a, b, c, alpha, beta, gamma) as floats, or None if there is no
+    periodic box (missing, or zero lengths as written by most MD packages
+    for vacuum systems)"""
+    if box is None:
+        return None
+    box = np.asarray(box, dtype='f8').ravel()
+    if len(box) != 6 or not np.all(box[:3] > 0):
+        return None
+    return box.tolist()
+
+
+def _cryst1_record(box):
+    a, b, c, alpha, beta, gamma = box
+    return (f'CRYST1{a:9.3f}{b:9.3f}{c:9.3f}'
+            f'{alpha:7.2f}{beta:7.2f}{gamma:7.2f} P 1           1\n')
+
+
+def _prepare(names, resnames, resids, xyz, chains, elements, hetero):
+    xyz = np.asarray(xyz, dtype='f8').reshape(-1, 3)
+    n_atoms = len(xyz)
+    names = _as_bytes_array(names, n_atoms)
+    resnames = _as_bytes_array(resnames, n_atoms)
+    resids = np.asarray(resids, dtype=np.int64)
+    # blank chain IDs (' ') count as missing
+    chains = np.char.strip(_as_bytes_array(chains, n_atoms))
+    elements = np.char.strip(_as_bytes_array(elements, n_atoms))
+    hetero = _get_hetero(resnames, hetero)
+    return names, resnames, resids, xyz, chains, elements, hetero
+
+
+def write_pdb(names,
+              resnames,
+              resids,
+              xyz,
+              chains=None,
+              elements=None,
+              hetero=None,
+              hybrid36=False,
+              bonds=None,
+              box=None):
+    """Format a single model PDB string.
+
+    Parameters
+    ----------
+    names, resnames : array-like of str, shape=(n_atoms,)
+    resids : array-like of int, shape=(n_atoms,)
+    xyz : array-like, shape=(n_atoms, 3), in angstrom
+    chains, elements : array-like of str or None
+    hetero : array-like of bool or None
+        Mark atoms as HETATM. If None, residues that are not standard
+        protein/nucleic residues are marked.
+    hybrid36 : bool, default False
+        If True, encode atom serials above 99999 and residue numbers above
+        9999 as hybrid-36. Otherwise they wrap around, as most MD packages do.
+        Coordinates must fit the '%8.3f' columns and residue numbers must
+        be above -1000, ValueError otherwise.
+    bonds : array-like of int, shape=(n_bonds, 2), or None
+        Pairs of atom indices (from 0). Bonds of HETATM atoms are written
+        as CONECT records.
+    box : array-like, shape=(6,), or None
+        Unit cell lengths (angstrom) and angles (degrees), as a, b, c,
+        alpha, beta, gamma; written as a CRYST1 record. Ignored if the
+        lengths are not positive.
+
+    Returns
+    -------
+    str
+    """
+    names, resnames, resids, xyz, chains, elements, hetero = _prepare(
+        names, resnames, resids, xyz, chains, elements, hetero)
+    n_atoms = len(xyz)
+    buf = np.full((n_atoms, 81), _SPACE, dtype=np.uint8)
+    buf[:, 80] = ord('\n')
+
+    serials = np.arange(1, n_atoms + 1)
+    _put_text(buf, 0, 6, np.where(hetero, b'HETATM', b'ATOM'))
+    _put_serials(buf, 6, 5, serials, hybrid36)
+    if hybrid36:
+        _put_hybrid36(buf, 22, 4, resids)
+    else:
+        # negative numbers keep their sign, like '%4d'
+        _put_int(buf, 22, 4, np.where(resids < 0, resids, resids % 10000))
+    _put_text(buf, 12, 4, _pad_atom_names(names, elements))
+    _put_text(buf, 17, 4, resnames)
+    _put_text(buf, 21, 1, chains)
+    for i in range(3):
+        _put_float(buf, 30 + 8 * i, 8, xyz[:, i])
+    buf[:, 54:66] = np.frombuffer(b'  1.00  0.00', dtype=np.uint8)
+    _put_text(buf, 76, 2, elements, right=True)
+    conect = b'' if bonds is None else _conect_records(bonds, hetero,
+                                                        hybrid36)
+    box = _unit_cell(box)
+    cryst1 = '' if box is None else _cryst1_record(box)
+    return cryst1 + (buf.tobytes() + conect).decode('ascii') + 'END\n'
+
+
+def read_pdb(text):
+    """Per-atom arrays of the first model in a PDB string, as taken by
+    `write_pdb`. CONECT records are not read.
+
+    Returns
+    -------
+    dict with names, resnames, resids, xyz, chains, elements, hetero and
+    box (None without a CRYST1 record)
+    """
+    records = []
+    box = None
+    for line in text.splitlines():
+        if line.startswith('CRYST1') and box is None:
+            box = np.array([
+                float(line[6:15]),
+                float(line[15:24]),
+                float(line[24:33]),
+                float(line[33:40]),
+                float(line[40:47]),
+                float(line[47:54])
+            ])
+        elif line.startswith(('ATOM  ', 'HETATM')):
+            records.append(line)
+        elif line.startswith('ENDMDL'):
+            break
+    buf = np.array(records, dtype='S80').view(np.uint8).reshape(-1, 80)
+    buf[buf == 0] = _SPACE
+
+    def column(start, end):
+        values = buf[:, start:end].copy().view(f'S{end - start}').ravel()
+        return np.char.strip(values)
+
+    xyz = np.column_stack(
+        [column(30 + 8 * i, 38 + 8 * i).astype('f4') for i in range(3)])
+    return dict(names=column(12, 16).astype(str),
+                resnames=column(17, 21).astype(str),
+                resids=column(22, 26).astype(int),
+                xyz=xyz.reshape(-1, 3),
+                chains=column(21, 22).astype(str),
+                elements=column(76, 78).astype(str),
+                hetero=column(0, 6) == b'HETATM',
+                box=box)
+
+
+def _cif_quote(values):
+    # blank values (e.g. ' ' chains of PDB files) are unknown, '?', rather
+    # than a quoted blank
+    values = np.char.strip(values)
+    values = np.where(np.char.str_len(values) == 0, b'?', values)
+    needs_quote = (np.char.find(values, b"'") >= 0) | (np.char.find(
+        values, b' ') >= 0)
+    if needs_quote.any():
+        quoted = np.char.add(np.char.add(b'"', values), b'"')
+        values = np.where(needs_quote, quoted, values)
+    return values
+
+
+def _max_len(values):
+    return int(np.char.str_len(values).max()) if len(values) else 1
+
+
+def write_cif(names,
+              resnames,
+              resids,
+              xyz,
+              chains=None,
+              elements=None,
+              hetero=None,
+              box=None):
+    """Format a single model mmCIF string with an `atom_site` loop, and the
+    unit cell as `_cell` and `_symmetry` items if `box` is given.
+
+    Unlike PDB, there is no limit on the number of atoms or residues.
+    Parameters are the same as for `write_pdb`.
+
+    Returns
+    -------
+    str
+    """
+    names, resnames, resids, xyz, chains, elements, hetero = _prepare(
+        names, resnames, resids, xyz, chains, elements, hetero)
+    n_atoms = len(xyz)
+    if n_atoms and not np.char.str_len(chains).any():
+        chains = np.full(n_atoms, b'A', dtype='S1')
+    serials = np.arange(1, n_atoms + 1)
+    names, resnames, chains, elements = (_cif_quote(v) for v in (names,
+                                                                 resnames,
+                                                                 chains,
+                                                                 elements))
+
+    if n_atoms:
+        int_width = max(len(str(v)) for v in (n_atoms, resids.min(),
+                                               resids.max()))
+        # sign, integer part, '.', 3 decimals; rounding may add a digit
+        coord_width = 5 + len(str(int(np.rint(np.abs(xyz).max() * 1000)) //
+                                  1000))
+    else:
+        int_width, coord_width = 1, 8
+    # (column, width) pairs; columns are separated by a single space
+    layout = [('record', 6), ('serial', int_width),
+              ('element', _max_len(elements)), ('name', _max_len(names)),
+              ('alt', 1), ('resname', _max_len(resnames)),
+              ('chain', _max_len(chains)), ('resid', int_width),
+              ('icode', 1), ('x', coord_width), ('y', coord_width),
+              ('z', coord_width), ('occupancy', 4), ('bfactor', 4),
+              ('auth_resid', int_width), ('auth_chain', _max_len(chains)),
+              ('model', 1)]
+    starts = {}
+    col = 0
+    for key, width in layout:
+        starts[key] = col
+        col += width + 1
+    buf = np.full((n_atoms, col), _SPACE, dtype=np.uint8)
+    buf[:, -1] = ord('\n')
+
+    _put_text(buf, starts['record'], 6, np.where(hetero, b'HETATM', b'ATOM'))
+    _put_int(buf, starts['serial'], int_width, serials)
+    _put_text(buf, starts['element'], _max_len(elements), elements)
+    _put_text(buf, starts['name'], _max_len(names), names)
+    buf[:, starts['alt']] = ord('.')
+    _put_text(buf, starts['resname'], _max_len(resnames), resnames)
+    _put_text(buf, starts['chain'], _max_len(chains), chains)
+    _put_int(buf, starts['resid'], int_width, resids)
+    buf[:, starts['icode']] = ord('?')
+    for i, key in enumerate('xyz'):
+        _put_float(buf, starts[key], coord_width, xyz[:, i])
+    buf[:, starts['occupancy']:starts['occupancy'] + 4] = np.frombuffer(
+        b'1.00', dtype=np.uint8)
+    buf[:, starts['bfactor']:starts['bfactor'] + 4] = np.frombuffer(
+        b'0.00', dtype=np.uint8)
+    _put_int(buf, starts['auth_resid'], int_width, resids)
+    _put_text(buf, starts['auth_chain'], _max_len(chains), chains)
+    buf[:, starts['model']] = ord('1')
+
+    header = ['data_nglview', '#']
+    box = _unit_cell(box)
+    if box is not None:
+        keys = ['length_a', 'length_b', 'length_c', 'angle_alpha',
+                'angle_beta', 'angle_gamma']
+        header += [f'_cell.{key:<12s} {value:.3f}'
+                   for key, value in zip(keys, box)]
+        header += ["_symmetry.space_group_name_H-M 'P 1'", '#']
+    header += ['loop_']
+    header += ['_atom_site.' + column for column in _CIF_COLUMNS]
+    return '\n'.join(header) + '\n' + buf.tobytes().decode('ascii') + '#\n'
@@ -0,0 +1,405 @@
+"""Read XTC, TRR and DCD trajectories without extra dependencies.
+
+Files are memory mapped and every frame is located by its byte offset, so
+reading frame `i` costs the same as reading frame 0, no matter how large the
+file is. DCD frames have a fixed size; TRR and XTC frames do not, their
+offsets are found by walking the frame headers once and then persisted next
+to the trajectory (``.<name>_nglview_offsets.npz``) for the next session.
+
+Coordinates are returned in angstrom as float32 arrays of shape
+(n_atoms, 3). Compressed XTC frames are decoded by the compiled decoder of
+MDAnalysis or MDTraj when one of them is installed, in Python (much slower
+for large systems) otherwise.
+
+Examples
+--------
+>>> from nglview.utils.trajectory_io import open_trajectory # doctest: +SKIP
+... reader = open_trajectory(nv.datafiles.XTC)
+... reader.n_frames, reader.n_atoms
+... xyz = reader.read(10)
+"""
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+__all__ = ['XTCReader', 'TRRReader', 'DCDReader', 'open_trajectory']
+
+# xdrfile's table of integer sizes for the "small" relative coordinates
+_MAGICINTS = [
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 8, 10, 12, 16, 20, 25, 32, 40, 50, 64, 80,
+    101, 128, 161, 203, 256, 322, 406, 512, 645, 812, 1024, 1290, 1625, 2048,
+    2580, 3250, 4096, 5060, 6501, 8192, 10321, 13003, 16384, 20642, 26007,
+    32768, 41285, 52015, 65536, 82570, 104031, 131072, 165140, 208063, 262144,
+    330280, 416127, 524287, 660561, 832255, 1048576, 1321122, 1664510,
+    2097152, 2642245, 3329021, 4194304, 5284491, 6658042, 8388607, 10568983,
+    13316085, 16777216
+]
+_FIRSTIDX = 9
+
+
+def _offsets_path(path):
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, f'.{name}_nglview_offsets.npz')
+
+
+def _load_offsets(path):
+    stat = os.stat(path)
+    try:
+        with np.load(_offsets_path(path), allow_pickle=False) as data:
+            if (data['size'] == stat.st_size
+                    and data['mtime'] == stat.st_mtime_ns):
+                return data['offsets']
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _save_offsets(path, offsets):
+    stat = os.stat(path)
+    try:
+        np.savez(_offsets_path(path),
+                 offsets=offsets,
+                 size=stat.st_size,
+                 mtime=stat.st_mtime_ns)
+    except OSError:
+        # read-only folder, the offsets are computed again next time
+        pass
+
+
+class _Reader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.close()
+            raise ValueError(f'{path} is empty')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def read(self, index):
+        """Coordinates of frame `index` in angstrom, shape=(n_atoms, 3)"""
+        if index < 0:
+            index += self.n_frames
+        if not 0 <= index < self.n_frames:
+            raise IndexError(f'frame {index} out of range')
+        return self._read(index)
+
+
+class _IndexedReader(_Reader):
+    # frames of variable size, located by a (persisted) offset index
+    def __init__(self, path):
+        super().__init__(path)
+        offsets = _load_offsets(path)
+        if offsets is None:
+            offsets = self._scan()
+            _save_offsets(path, offsets)
+        self._offsets = offsets
+        self.n_frames = len(offsets)
+        self.n_atoms = self._read_n_atoms()
+
+
+def _compiled_xtc_reader(path, offsets):
+    """`read(index) -> xyz in nm` with the XTC decoder of MDAnalysis or
+    MDTraj, and the open file, or None if neither is installed."""
+    try:
+        from MDAnalysis.lib.formats.libmdaxdr import XTCFile
+    except ImportError:
+        pass
+    else:
+        xtc = XTCFile(path)
+        xtc.set_offsets(offsets)
+
+        def read(index):
+            xtc.seek(index)
+            return xtc.read().x
+
+        return read, xtc
+    try:
+        from mdtraj.formats import XTCTrajectoryFile
+    except ImportError:
+        return None
+    xtc = XTCTrajectoryFile(path)
+    xtc.offsets = offsets
+
+    def read(index):
+        xtc.seek(index)
+        return xtc.read(n_frames=1)[0][0]
+
+    return read, xtc
+
+
+class XTCReader(_IndexedReader):
+    # use a compiled decoder when available, see `_compiled_xtc_reader`
+    compiled = True
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._compiled = None
+        self._compiled_lock = threading.Lock()
+
+    def close(self):
+        if self._compiled:
+            self._compiled[1].close()
+        super().close()
+
+    def _read_compiled(self, index):
+        # the compiled readers have a file position, reads are serialized
+        with self._compiled_lock:
+            if self._compiled is None:
+                # imported on the first compressed frame, False if missing
+                self._compiled = (_compiled_xtc_reader(
+                    self.path, self._offsets) or False)
+            if not self._compiled:
+                return None
+            return self._compiled[0](index) * 10
+
+    def _read_n_atoms(self):
+        return struct.unpack_from('>i', self._mmap, 4)[0]
+
+    def _scan(self):
+        mm, size = self._mmap, len(self._mmap)
+        offsets = []
+        offset = 0
+        while offset + 56 <= size:
+            magic, n_atoms = struct.unpack_from('>ii', mm, offset)
+            if magic != 1995:
+                raise ValueError(f'{self.path}: not an xtc frame at byte '
+                                 f'{offset}')
+            offsets.append(offset)
+            if n_atoms <= 9:
+                offset += 56 + 12 * n_atoms
+            else:
+                n_bytes, = struct.unpack_from('>i', mm, offset + 88)
+                offset += 92 + (n_bytes + 3) // 4 * 4
+        return np.array(offsets, dtype=np.int64)
+
+    def _read(self, index):
+        offset = int(self._offsets[index])
+        n_atoms, = struct.unpack_from('>i', self._mmap, offset + 52)
+        if n_atoms <= 9:
+            xyz = np.frombuffer(self._mmap,
+                                dtype='>f4',
+                                count=3 * n_atoms,
+                                offset=offset + 56)
+            return (xyz * 10).astype('f4').reshape(n_atoms, 3)
+        if self.compiled:
+            xyz = self._read_compiled(index)
+            if xyz is not None:
+                return xyz.astype('f4', copy=False)
+        values = struct.unpack_from('>f3i3iii', self._mmap, offset + 56)
+        precision, minint, maxint = values[0], values[1:4], values[4:7]
+        smallidx, n_bytes = values[7], values[8]
+        data = self._mmap[offset + 92:offset + 92 + n_bytes]
+        ints = _decompress_xtc(data, n_atoms, minint, maxint, smallidx)
+        return (ints * (10 / precision)).astype('f4')
+
+
+def _decompress_xtc(data, n_atoms, minint, maxint, smallidx):
+    # port of xdrfile_decompress_coord_float: the coordinates are a stream
+    # of big endian bit fields, integers are packed in mixed radix
+    pos = 0
+    from_bytes = int.from_bytes
+
+    def receivebits(n_bits):
+        nonlocal pos
+        first = pos >> 3
+        skip = pos & 7
+        n_bytes = (skip + n_bits + 7) >> 3
+        chunk = from_bytes(data[first:first + n_bytes], 'big')
+        pos += n_bits
+        return (chunk >> (8 * n_bytes - skip - n_bits)) & ((1 << n_bits) - 1)
+
+    def receiveints(n_bits, sizes):
+        # the bits are read as bytes, least significant byte first
+        n_full = (n_bits - 1) >> 3
+        last_bits = n_bits - 8 * n_full
+        value = receivebits(n_bits)
+        head = from_bytes((value >> last_bits).to_bytes(n_full, 'big'),
+                          'little')
+        num = head | ((value & ((1 << last_bits) - 1)) << (8 * n_full))
+        num, z = divmod(num, sizes[2])
+        x, y = divmod(num, sizes[1])
+        return x, y, z
+
+    sizeint = [hi - lo + 1 for lo, hi in zip(minint, maxint)]
+    if max(sizeint) > 0xffffff:
+        bitsizeint = [min(size.bit_length(), 32) for size in sizeint]
+        bitsize = 0
+    else:
+        bitsize = (sizeint[0] * sizeint[1] * sizeint[2]).bit_length()
+    minx, miny, minz = minint
+    smaller = _MAGICINTS[max(_FIRSTIDX, smallidx - 1)] // 2
+    smallnum = _MAGICINTS[smallidx] // 2
+    sizesmall = [_MAGICINTS[smallidx]] * 3
+
+    out = np.empty((n_atoms, 3), dtype=np.int64)
+    i = 0
+    run = 0
+    while i < n_atoms:
+        if bitsize == 0:
+            x, y, z = [receivebits(bits) for bits in bitsizeint]
+        else:
+            x, y, z = receiveints(bitsize, sizeint)
+        x += minx
+        y += miny
+        z += minz
+        is_smaller = 0
+        if receivebits(1):
+            run = receivebits(5)
+            is_smaller = run % 3
+            run -= is_smaller
+            is_smaller -= 1
+        if run > 0:
+            px, py, pz = x, y, z
+            for k in range(0, run, 3):
+                dx, dy, dz = receiveints(smallidx, sizesmall)
+                x = px + dx - smallnum
+                y = py + dy - smallnum
+                z = pz + dz - smallnum
+                if k == 0:
+                    # the first two atoms of a run (e.g. water O and H) are
+                    # stored swapped
+                    x, px = px, x
+                    y, py = py, y
+                    z, pz = pz, z
+                    out[i] = px, py, pz
+                    i += 1
+                else:
+                    px, py, pz = x, y, z
+                out[i] = x, y, z
+                i += 1
+        else:
+            out[i] = x, y, z
+            i += 1
+        smallidx += is_smaller
+        if is_smaller < 0:
+            smallnum = smaller
+            if smallidx > _FIRSTIDX:
+                smaller = _MAGICINTS[smallidx - 1] // 2
+            else:
+                smaller = 0
+        elif is_smaller > 0:
+            smaller = smallnum
+            smallnum = _MAGICINTS[smallidx] // 2
+        sizesmall = [_MAGICINTS[smallidx]] * 3
+    return out
+
+
+class TRRReader(_IndexedReader):
+    def _header(self, offset):
+        # magic, version string, then the sizes of the blocks that follow
+        sizes = struct.unpack_from('>13i', self._mmap, offset + 24)
+        (box, vir, pres, x, v, f, n_atoms) = (sizes[2], sizes[3], sizes[4],
+                                              sizes[7], sizes[8], sizes[9],
+                                              sizes[10])
+        if box:
+            prec = box // 9
+        elif x:
+            prec = x // (3 * n_atoms)
+        elif v:
+            prec = v // (3 * n_atoms)
+        else:
+            prec = f // (3 * n_atoms)
+        header = 76 + 2 * prec
+        x_offset = offset + header + box + vir + pres
+        end = x_offset + x + v + f
+        return n_atoms, prec, x, x_offset, end
+
+    def _read_n_atoms(self):
+        return self._header(0)[0]
+
+    def _scan(self):
+        mm, size = self._mmap, len(self._mmap)
+        offsets = []
+        offset = 0
+        while offset + 76 <= size:
+            magic, = struct.unpack_from('>i', mm, offset)
+            if magic != 1993:
+                raise ValueError(f'{self.path}: not a trr frame at byte '
+                                 f'{offset}')
+            offsets.append(offset)
+            offset = self._header(offset)[-1]
+        return np.array(offsets, dtype=np.int64)
+
+    def _read(self, index):
+        n_atoms, prec, x, x_offset, _ = self._header(int(
+            self._offsets[index]))
+        if not x:
+            raise ValueError(f'frame {index} has no coordinates')
+        xyz = np.frombuffer(self._mmap,
+                            dtype=f'>f{prec}',
+                            count=3 * n_atoms,
+                            offset=x_offset)
+        return (xyz * 10).astype('f4').reshape(n_atoms, 3)
+
+
+class DCDReader(_Reader):
+    """CHARMM/NAMD DCD. Frames have a fixed size, no index is needed."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        mm = self._mmap
+        for endian in '<>':
+            if struct.unpack_from(endian + 'i', mm, 0)[0] == 84:
+                break
+        else:
+            raise ValueError(f'{path}: not a dcd file')
+        if mm[4:8] != b'CORD':
+            raise ValueError(f'{path}: not a dcd file')
+        icntrl = struct.unpack_from(endian + '20i', mm, 8)
+        if icntrl[8]:
+            raise ValueError(
+                f'{path}: dcd files with fixed atoms are not supported, '
+                f'load it with MDTraj or MDAnalysis (e.g. '
+                f'nglview.show_mdanalysis)')
+        charmm = icntrl[19] != 0
+        title_size, = struct.unpack_from(endian + 'i', mm, 92)
+        offset = 92 + title_size + 8
+        self.n_atoms, = struct.unpack_from(endian + 'i', mm, offset + 4)
+        offset += 12
+        unitcell = 56 if charmm and icntrl[10] else 0
+        record = 4 * self.n_atoms + 8
+        n_dims = 4 if charmm and icntrl[11] else 3
+        self._endian = endian
+        self._first = offset
+        self._unitcell = unitcell
+        self._frame_size = unitcell + n_dims * record
+        self.n_frames = (len(mm) - offset) // self._frame_size
+
+    def _read(self, index):
+        offset = self._first + index * self._frame_size + self._unitcell
+        # three Fortran records (marker, n_atoms floats, marker)
+        xyz = np.frombuffer(self._mmap,
+                            dtype=self._endian + 'f4',
+                            count=3 * (self.n_atoms + 2),
+                            offset=offset)
+        return xyz.reshape(3, self.n_atoms + 2)[:, 1:-1].T.astype('f4')
+
+
+_READERS = {'xtc': XTCReader, 'trr': TRRReader, 'dcd': DCDReader}
+
+
+def open_trajectory(path):
+    """Return a reader for `path`, chosen by file extension"""
+    ext = os.path.splitext(path)[1][1:].lower()
+    try:
+        reader = _READERS[ext]
+    except KeyError:
+        raise ValueError(
+            f"can not read '{ext}' files, supported: {sorted(_READERS)}")
+    return reader(path)
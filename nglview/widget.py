@@ -1,6 +1,9 @@
 import base64
+import hashlib
 import json
 import logging
+import os
+import re
 import threading
 import time
 import uuid
@@ -17,21 +20,27 @@ from traitlets import (Bool, CaselessStrEnum, Dict, Instance, Int, Integer,
 import traitlets
 
 from . import color, interpolate
-from .adaptor import Structure, Trajectory
+from .adaptor import (AtomSubsetTrajectory, SlicedTrajectory, Structure,
+                      Trajectory)
+from .base_adaptor import thread_safe_reader
 from .component import ComponentViewer
 from .config import BACKENDS
 from .player import TrajectoryPlayer, _dry_run
+from .prefetch import FramePrefetcher
 from .remote_thread import RemoteCallThread
 from .representation import RepresentationControl
 from .shape import Shape
 from .stage import Stage
 from .utils import py_utils, widget_utils
-from .utils.py_utils import (FileManager, _camelize_dict, _update_url,
-                             encode_base64, get_repr_names_from_dict,
+from .utils.coordinate_bundle import (bundle_header, encode_coordinate_bundle,
+                                      iter_bundle_data)
+from .utils.py_utils import (FileManager, _camelize_dict, _image_from_msg,
+                             _update_url, get_repr_names_from_dict,
                              seq_to_string)
 from .viewer_control import ViewerControl
 from ._frontend import __frontend_version__
 from .base import BaseWidget
+from .blob import BlobRegistry
 
 widget_serialization = _widget.widget_serialization
 
@@ -44,9 +53,18 @@ _EXCLUDED_CALLBACK_AFTER_FIRING = {
     '_downloadImage',
     '_exportImage',
     'set_representation_from_backend',
+    'renderBarrier',
 }
 
 
+def _get_coordinates_batch(traj, indices):
+    reader = thread_safe_reader(traj)
+    # duck typed trajectories may only have `get_coordinates`
+    if hasattr(reader, 'get_coordinates_batch'):
+        return reader.get_coordinates_batch(indices)
+    return Trajectory.get_coordinates_batch(reader, indices)
+
+
 def _deprecated(msg):
     def wrap_1(func):
         def wrap_2(*args, **kwargs):
@@ -58,18 +76,211 @@ def _deprecated(msg):
     return wrap_1
 
 
-def write_html(fp, views, frame_range=None):
-    # type: (str, List[NGLWidget]) -> None
+def _external_store(data_dir, fp):
+    # write data to `data_dir`, return the url of the file relative to the page
+    os.makedirs(data_dir, exist_ok=True)
+    if isinstance(fp, str):
+        prefix = os.path.relpath(data_dir,
+                                 os.path.dirname(os.path.abspath(fp)))
+    else:
+        prefix = data_dir
+    prefix = prefix.replace(os.sep, '/')
+
+    def store(name, data):
+        with open(os.path.join(data_dir, name), 'wb') as fh:
+            fh.write(data)
+        store.nbytes += len(data)
+        return f'{prefix}/{name}'
+
+    store.nbytes = 0
+    return store
+
+
+def _externalize_blobs(state, store):
+    # move the structure data out of the widget state, the page fetches it
+    for model in state.values():
+        if model['model_name'] != 'BlobModel':
+            continue
+        buffers = model.get('buffers', [])
+        for buffer in [b for b in buffers if b['path'] == ['data']]:
+            data = base64.b64decode(buffer['data'])
+            name = f'structure_{hashlib.sha1(data).hexdigest()[:16]}.bin'
+            model['state']['url'] = store(name, data)
+            buffers.remove(buffer)
+
+
+def _write_streams(fh, html_code, streams):
+    # write `html_code`, with the pieces of `streams[token]` in place of each
+    # token, so that the coordinates are never held in memory at once.
+    # Return the number of bytes written for each token.
+    sizes = {}
+    if not streams:
+        fh.write(html_code)
+        return sizes
+    pos = 0
+    for match in re.finditer('|'.join(map(re.escape, streams)), html_code):
+        fh.write(html_code[pos:match.start()])
+        token = match.group()
+        sizes[token] = 0
+        for piece in streams[token]:
+            fh.write(piece)
+            sizes[token] += len(piece)
+        pos = match.end()
+    fh.write(html_code[pos:])
+    return sizes
+
+
+_STATE_SCRIPT = '<script type="application/vnd.jupyter.widget-state+json">'
+
+
+def _size_report(html_code, stream_sizes):
+    # bytes of the page by part, measured on the embedded widget state
+    def nbytes(value):
+        return len(json.dumps(value))
+
+    state = json.loads(
+        html_code.split(_STATE_SCRIPT, 1)[1].split('</script>', 1)[0])
+    report = {
+        'msg_archive': 0,
+        'blobs': {},
+        'coordinates': {},
+        'color_dict': 0,
+    }
+    blob_names = {}
+    for model_id, model in state['state'].items():
+        if model['model_name'] != 'NGLModel':
+            continue
+        model_state = model['state']
+        report['msg_archive'] += nbytes(model_state.get(
+            '_ngl_msg_archive', []))
+        report['color_dict'] += nbytes(model_state.get('_ngl_color_dict', {}))
+        resource = model_state.get('_ngl_coordinate_resource', {})
+        for t_index, bundle in resource.items():
+            if t_index == 'n_frames':
+                continue
+            size = nbytes(bundle)
+            token = bundle.get('data')
+            if token in stream_sizes:
+                # written in place of the token
+                size += stream_sizes[token] - len(token)
+            report['coordinates'][f'{model_id}/{t_index}'] = size
+        for msg in model_state.get('_ngl_msg_archive', []):
+            for arg in msg.get('args', []):
+                if isinstance(arg, dict) and arg.get('type') == 'blob_ref':
+                    blob_id = arg['data'].replace('IPY_MODEL_', '')
+                    blob_names[blob_id] = msg.get('kwargs', {}).get(
+                        'name', blob_id)
+    for model_id, model in state['state'].items():
+        if model['model_name'] == 'BlobModel':
+            name = blob_names.get(model_id, model_id)
+            report['blobs'][f'{name} ({model_id[:8]})'] = sum(
+                len(buffer['data']) for buffer in model.get('buffers', []))
+    total = len(html_code.encode('utf8')) + sum(
+        size - len(token) for token, size in stream_sizes.items())
+    report['widget_state'] = (total - report['msg_archive'] -
+                              report['color_dict'] -
+                              sum(report['blobs'].values()) -
+                              sum(report['coordinates'].values()))
+    report['total'] = total
+    return report
+
+
+def _fit_size_budget(views, html_code, streams, size_budget, frame_range,
+                     precision, compress):
+    # cheapest quantization, then the smallest stride, whose estimated page
+    # size fits `size_budget`. The frame sample is read once and encoded once
+    # per precision, its size per frame is extrapolated to each candidate.
+    fixed = len(html_code.encode('utf8')) - sum(map(len, streams))
+    frames = range(*frame_range)
+    samples = [
+        sample for view in views
+        for sample in view._sample_coordinates(frame_range)
+    ]
+    nbytes_per_frame = {}
+
+    def frame_nbytes(precision):
+        if precision not in nbytes_per_frame:
+            nbytes_per_frame[precision] = [
+                len(
+                    encode_coordinate_bundle(sample,
+                                             precision=precision,
+                                             compress=compress)['data']) /
+                len(sample) for _, sample in samples
+            ]
+        return nbytes_per_frame[precision]
+
+    def estimate(frame_range, precision):
+        start, stop, step = frame_range
+        return fixed + sum(
+            int(nbytes * len(range(start, min(stop, n_frames), step)))
+            for nbytes, (n_frames, _) in zip(frame_nbytes(precision), samples))
+
+    precisions = [None, 1e-3, 1e-2] if precision is None else [precision]
+    strides = sorted({round(1.25**k) for k in range(100)})
+    if fixed < size_budget:
+        for stride in [s for s in strides if s < len(frames)
+                       ] + [max(len(frames), 1)]:
+            candidate = (frames.start, frames.stop, frames.step * stride)
+            for p in precisions:
+                if estimate(candidate, p) <= size_budget:
+                    return candidate, p
+    report = _size_report(html_code, {})
+    raise ValueError(
+        f'write_html: the page does not fit in {size_budget} bytes even with '
+        f'a single frame, sizes: {report}. Show fewer atoms (e.g. '
+        f'add_trajectory(..., atom_indices=...)), or use external_data_dir.')
+
+
+def write_html(fp,
+               views,
+               frame_range=None,
+               precision=None,
+               compress=True,
+               external_data_dir=None,
+               chunk_size=100,
+               n_workers=None,
+               size_budget=None):
+    # type: (str, List[NGLWidget]) -> dict
     """EXPERIMENTAL. Likely will be changed.
 
     Make html file to display a list of views. For further options, please
-    check `ipywidgets.embed` module.
+    check `ipywidgets.embed` module. The coordinates of `frame_range` are
+    read and encoded while the file is written, memory use does not grow with
+    the number of frames.
 
     Parameters
     ----------
     fp : str or file handle
     views : a DOMWidget view or a list of views.
     frame_range : None or a tuple of int
+    precision : None or float
+        Store the coordinates of `frame_range` quantized to `precision`
+        angstrom (e.g. 1e-3) instead of float32, the page gets much smaller.
+    compress : bool, default True
+        Deflate the coordinates of `frame_range`.
+    external_data_dir : None or str
+        Write structures and coordinates as files to this folder instead of
+        embedding them. The page fetches coordinates in chunks of
+        `chunk_size` frames as the player advances, so it must be served
+        (e.g. `python -m http.server`) together with the folder.
+    chunk_size : int, default 100
+        Number of frames per coordinate file, with `external_data_dir`.
+    n_workers : None or int
+        Number of threads reading and encoding frames, default: number of
+        CPUs. The file does not depend on it.
+    size_budget : None or int
+        Maximum size of the page in bytes. If the frames of `frame_range` do
+        not fit, they are quantized (to 1e-3, then 1e-2 angstrom, unless
+        `precision` is given) and then strided, based on the encoded size of
+        a sample of frames. Raises ValueError if the page does not fit with
+        a single frame.
+
+    Returns
+    -------
+    dict : size of the page in bytes, by part ('msg_archive', 'blobs',
+        'coordinates', 'color_dict', 'widget_state' and 'total'), the files
+        in `external_data_dir` ('external'), and the `frame_range` and
+        `precision` that were used.
 
     Examples
     --------
@@ -78,6 +289,10 @@ def write_html(fp, views, frame_range=None):
     >>> view # doctest: +SKIP
     >>> nglview.write_html('index.html', [view]) # doctest: +SKIP
     >>> nglview.write_html('index.html', [view], frame_range=(0, 5)) # doctest: +SKIP
+    >>> nglview.write_html('index.html', [view], frame_range=(0, 10000),
+    ...                    external_data_dir='index_data') # doctest: +SKIP
+    >>> nglview.write_html('index.html', [view], frame_range=(0, 10000),
+    ...                    size_budget=20 * 2**20)['total'] # doctest: +SKIP
     """
     views = isinstance(views, DOMWidget) and [views] or views
     embed = ipywidgets.embed
@@ -92,38 +307,72 @@ def write_html(fp, views, frame_range=None):
     for v in [color, theme]:
         v and views.insert(0, v)
 
-    def _set_serialization(views):
+    def _ngl_views(views):
         for view in views:
             if hasattr(view, '_set_serialization'):
-                view._set_serialization(frame_range=frame_range)
-            elif isinstance(view, Box):
-                _set_serialization(view.children)
-
-    def _unset_serialization(views):
-        for view in views:
-            if hasattr(view, '_unset_serialization'):
-                view._unset_serialization()
+                yield view
             elif isinstance(view, Box):
-                _unset_serialization(view.children)
-
-    _set_serialization(views)
-    # FIXME: allow add jquery-ui link?
-    snippet = '<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/jqueryui/1.12.0/jquery-ui.css">\n'
-    snippet += embed.embed_snippet(views)
-    html_code = embed.html_template.format(title='nglview-demo',
-                                           snippet=snippet)
-
-    # from ipywidgets
-    # Check if fp is writable:
-    if hasattr(fp, 'write'):
-        fp.write(html_code)
-    else:
-        # Assume fp is a filename:
-        with open(fp, "w") as f:
-            f.write(html_code)
-
-    _unset_serialization(views)
-
+                yield from _ngl_views(view.children)
+
+    store = None
+    if external_data_dir is not None:
+        store = _external_store(external_data_dir, fp)
+
+    def _build(frame_range, precision):
+        # token -> pieces of coordinate data, written while the page is written
+        streams = {}
+        for view in _ngl_views(views):
+            view._set_serialization(frame_range=frame_range,
+                                    precision=precision,
+                                    compress=compress,
+                                    chunk_size=store and chunk_size,
+                                    store=store,
+                                    streams=streams,
+                                    n_workers=n_workers)
+        # FIXME: allow add jquery-ui link?
+        snippet = '<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/jqueryui/1.12.0/jquery-ui.css">\n'
+        if store is None:
+            snippet += embed.embed_snippet(views)
+        else:
+            state = Widget.get_manager_state(drop_defaults=True)['state']
+            _externalize_blobs(state, store)
+            snippet += embed.embed_snippet(views, state=state)
+        html_code = embed.html_template.format(title='nglview-demo',
+                                               snippet=snippet)
+        return html_code, streams
+
+    try:
+        html_code, streams = _build(frame_range, precision)
+        if (size_budget is not None and store is None
+                and frame_range is not None):
+            fitted = _fit_size_budget(list(_ngl_views(views)), html_code,
+                                      streams, size_budget, frame_range,
+                                      precision, compress)
+            if (range(*fitted[0]), fitted[1]) != (range(*frame_range),
+                                                  precision):
+                frame_range, precision = fitted
+                html_code, streams = _build(frame_range, precision)
+
+        # from ipywidgets
+        # Check if fp is writable:
+        if hasattr(fp, 'write'):
+            sizes = _write_streams(fp, html_code, streams)
+        else:
+            # Assume fp is a filename:
+            with open(fp, "w") as f:
+                sizes = _write_streams(f, html_code, streams)
+    finally:
+        for view in _ngl_views(views):
+            view._unset_serialization()
+
+    report = _size_report(html_code, sizes)
+    report['external'] = store.nbytes if store is not None else 0
+    report['frame_range'] = frame_range
+    report['precision'] = precision
+    if size_budget is not None and report['total'] > size_budget:
+        logging.warning(f'write_html: the page has {report["total"]} bytes, '
+                        f'over the budget of {size_budget}')
+    return report
 
 
 class NGLWidget(DOMWidget):
@@ -136,7 +385,6 @@ class NGLWidget(DOMWidget):
     _ngl_version = Unicode().tag(sync=True)
     # _model_name = Unicode("NGLView").tag(sync=True)
     # _model_module = Unicode("nglview-js-widgets").tag(sync=True)
-    _image_data = Unicode().tag(sync=False)
     # use Integer here, because mdtraj uses a long datatype here on Python-2.7
     frame = Integer().tag(sync=True)
     max_frame = Int(0).tag(sync=True)
@@ -174,6 +422,7 @@ class NGLWidget(DOMWidget):
     _ngl_coordinate_resource = Dict().tag(sync=True)
     _representations = List().tag(sync=False)
     _ngl_color_dict = Dict().tag(sync=True)
+    _ngl_blobs = List(Instance(Widget)).tag(sync=True, **widget_serialization)
     _player_dict = Dict().tag(sync=True)
 
     # instance
@@ -196,6 +445,10 @@ class NGLWidget(DOMWidget):
         self._theme = kwargs.pop('theme', 'default')
         self._widget_image = Image()
         self._widget_image.width = 900.
+        # last image sent by the frontend, see `get_image`
+        self._image = b''
+        # callbacks waiting for the frontend's render_ack, see `_on_rendered`
+        self._render_acks = {}
         self._image_array = []
         # do not use _displayed_callbacks since there is another Widget._display_callbacks
         self._event = threading.Event()
@@ -214,7 +467,11 @@ class NGLWidget(DOMWidget):
             registered_funcs=['loadFile', 'replaceStructure', '_exportImage'])
         self._remote_call_thread.start()
         self._trajlist = []
+        self._prefetchers = {}
+        self._prefetch_params = None
         self._ngl_component_ids = []
+        # component id -> _Blob its data was loaded from, see nglview.blob
+        self._ngl_component_blobs = {}
 
         if representations:
             # Must be set here before calling
@@ -279,24 +536,90 @@ class NGLWidget(DOMWidget):
 
         self.layout.observe(on_change_layout, ['width', 'height'])
 
-    def _set_serialization(self, frame_range=None):
+    def _set_serialization(self,
+                           frame_range=None,
+                           precision=None,
+                           compress=True,
+                           chunk_size=None,
+                           store=None,
+                           streams=None,
+                           n_workers=None):
         self._ngl_serialize = True
         resource = self._ngl_coordinate_resource
         if frame_range is not None:
+            indices = range(*frame_range)
             for t_index, traj in enumerate(self._trajlist):
-                resource[t_index] = []
-                for f_index in range(*frame_range):
-                    if f_index < traj.n_frames:
-                        resource[t_index].append(
-                            encode_base64(traj.get_coordinates(f_index)))
-                    else:
-                        resource[t_index].append(
-                            encode_base64(np.empty((0), dtype='f4')))
-            resource['n_frames'] = len(resource[0])
+                # frames past the end of a trajectory are not stored, the
+                # page leaves its coordinates untouched
+                stored = [i for i in indices if i < traj.n_frames]
+
+                def read(positions, traj=traj, stored=stored):
+                    return _get_coordinates_batch(
+                        traj, stored[positions.start:positions.stop])
+
+                if chunk_size is None and streams is not None:
+                    # the data is written by `write_html` in place of `token`,
+                    # while the frames are read
+                    token = f'@nglview-coordinates-{self.model_id}-{t_index}@'
+                    n_atoms = np.shape(
+                        thread_safe_reader(traj).get_coordinates(
+                            stored[0]))[0] if stored else 0
+                    resource[t_index] = bundle_header(len(stored), n_atoms,
+                                                      precision, compress)
+                    resource[t_index]['data'] = token
+                    streams[token] = iter_bundle_data(read,
+                                                      len(stored),
+                                                      precision,
+                                                      compress,
+                                                      n_workers=n_workers)
+                    continue
+                if chunk_size is None:
+                    resource[t_index] = encode_coordinate_bundle(
+                        read(range(len(stored))),
+                        precision=precision,
+                        compress=compress,
+                        n_workers=n_workers)
+                    continue
+
+                def encode_chunk(start, read=read, n_frames=len(stored)):
+                    return encode_coordinate_bundle(
+                        read(range(start, min(start + chunk_size, n_frames))),
+                        precision=precision,
+                        compress=compress)
+
+                chunks = []
+                for i, chunk in enumerate(
+                        py_utils.imap_ordered(encode_chunk,
+                                              range(0, len(stored),
+                                                    chunk_size), n_workers)):
+                    if store is not None:
+                        # `store(name, bytes) -> url`, fetched by the page
+                        name = f'coordinates_{self.model_id}_{t_index}_{i}.bin'
+                        chunk['url'] = store(
+                            name, base64.b64decode(chunk.pop('data')))
+                    chunks.append(chunk)
+                resource[t_index] = {
+                    'n_frames': len(stored),
+                    'chunk_size': chunk_size,
+                    'chunks': chunks
+                }
+            resource['n_frames'] = len(indices)
 
         self._ngl_coordinate_resource = resource
         self._ngl_color_dict = color._USER_COLOR_DICT.copy()
 
+    def _sample_coordinates(self, frame_range, n_samples=20):
+        # (n_frames, coordinates of the first `n_samples` frames of
+        # `frame_range`) for each trajectory, to estimate embedded sizes
+        samples = []
+        for traj in self._trajlist:
+            stored = range(*frame_range)[:n_samples]
+            stored = [i for i in stored if i < traj.n_frames]
+            if stored:
+                samples.append((traj.n_frames,
+                                _get_coordinates_batch(traj, stored)))
+        return samples
+
     def _create_player(self):
         player = Play(max=self.max_frame, interval=100)
         slider = IntSlider(max=self.max_frame)
@@ -305,9 +628,12 @@ class NGLWidget(DOMWidget):
         self.player.widget_player_slider = slider
 
         jslink((player, 'value'), (slider, 'value'))
-        jslink((player, 'value'), (self, 'frame'))
-        jslink((player, 'max'), (self, 'max_frame'))
-        jslink((slider, 'max'), (self, 'max_frame'))
+        # closed with the view, see `close`
+        self._player_links = [
+            jslink((player, 'value'), (self, 'frame')),
+            jslink((player, 'max'), (self, 'max_frame')),
+            jslink((slider, 'max'), (self, 'max_frame')),
+        ]
 
     def _unset_serialization(self):
         self._ngl_serialize = False
@@ -470,6 +796,49 @@ class NGLWidget(DOMWidget):
                 repr_slider.max = len(repr_names) - 1 if len(
                     repr_names) >= 1 else len(repr_names)
 
+    def prefetch_frames(self,
+                        depth=8,
+                        n_workers=None,
+                        processes=False,
+                        transform=None):
+        '''Read frames ahead of the current one in the background, so that
+        playback does not wait for the trajectory reader.
+
+        Parameters
+        ----------
+        depth : int, default 8
+            Number of frames to read ahead, 0 to turn prefetching off.
+        n_workers : int, optional
+        processes : bool, default False
+            Read in worker processes (trajectories must be picklable), for
+            CPU heavy decoders. Frames are handed back in shared memory
+            (no pickling) and copied once out of it, when they are used.
+        transform : callable, optional
+            `transform(xyz) -> xyz` run in the workers, e.g. alignment.
+
+        See Also
+        --------
+        nglview.prefetch.FramePrefetcher
+        '''
+        for _, prefetcher in self._prefetchers.values():
+            prefetcher.close()
+        self._prefetchers = {}
+        self._prefetch_params = dict(
+            depth=depth,
+            n_workers=n_workers,
+            processes=processes,
+            transform=transform) if depth else None
+
+    def _get_prefetcher(self, trajectory):
+        traj, prefetcher = self._prefetchers.get(trajectory.id, (None, None))
+        if traj is not trajectory:
+            # new trajectory, or replaced, e.g. by `set_frame_range`
+            if prefetcher is not None:
+                prefetcher.close()
+            prefetcher = FramePrefetcher(trajectory, **self._prefetch_params)
+            self._prefetchers[trajectory.id] = (trajectory, prefetcher)
+        return prefetcher
+
     def _update_max_frame(self):
         self.max_frame = max(
             int(traj.n_frames) for traj in self._trajlist
@@ -739,25 +1108,34 @@ class NGLWidget(DOMWidget):
             for trajectory in self._trajlist:
                 traj_index = self._ngl_component_ids.index(trajectory.id)
 
+                reader = thread_safe_reader(trajectory)
                 try:
                     if trajectory.shown:
                         if self.player.interpolate:
                             t = self.player.iparams.get('t', 0.5)
                             step = self.player.iparams.get('step', 1)
                             coordinates_dict[traj_index] = interpolate.linear(
-                                index, t=t, traj=trajectory, step=step)
+                                index, t=t, traj=reader, step=step)
+                        elif self._prefetch_params:
+                            coordinates_dict[traj_index] = self._get_prefetcher(
+                                trajectory).get(index, step=self.player.step
+                                                or 1)
                         else:
                             coordinates_dict[
-                                traj_index] = trajectory.get_coordinates(index)
+                                traj_index] = reader.get_coordinates(index)
                     else:
                         coordinates_dict[traj_index] = np.empty((0),
                                                                 dtype='f4')
                 except (IndexError, ValueError):
                     coordinates_dict[traj_index] = np.empty((0), dtype='f4')
 
-            self.set_coordinates(coordinates_dict,
-                    render_params=render_params,
-                    movie_making=movie_making)
+            # frames from readers and prefetchers are fresh arrays, no need
+            # to copy them again
+            self._send_coordinates(coordinates_dict,
+                                   render_params=render_params,
+                                   movie_making=movie_making,
+                                   frame=index,
+                                   copy=False)
         else:
             print("no trajectory available")
 
@@ -769,13 +1147,26 @@ class NGLWidget(DOMWidget):
         >>> # update coordinates of 1st trajectory
         >>> view.set_coordinates({0: arr})# doctest: +SKIP
         """
+        self._send_coordinates(arr_dict,
+                               movie_making=movie_making,
+                               render_params=render_params)
+
+    def _send_coordinates(self,
+                          arr_dict,
+                          movie_making=False,
+                          render_params=None,
+                          copy=True,
+                          frame=None):
         render_params = render_params or {}
         self._coordinates_dict = arr_dict
 
         buffers = []
         coordinates_meta = dict()
         for index, arr in self._coordinates_dict.items():
-            buffers.append(arr.astype('f4').tobytes())
+            arr = np.ascontiguousarray(arr, dtype='f4')
+            # the message may be sent later (from the IOPub thread), copy
+            # arrays the caller might modify in place
+            buffers.append(arr.tobytes() if copy else memoryview(arr))
             coordinates_meta[index] = index
         msg = {
                 'type': 'binary_single',
@@ -784,6 +1175,9 @@ class NGLWidget(DOMWidget):
         if movie_making:
             msg['movie_making'] = movie_making
             msg['render_params'] = render_params
+            if frame is not None:
+                # sent back with the image
+                msg['frame'] = frame
 
         self.send(
             msg,
@@ -940,22 +1334,27 @@ class NGLWidget(DOMWidget):
                           kwargs={'component_index': component},
                           **kwargs)
 
-    @observe('_image_data')
-    def _on_render_image(self, change):
-        '''update image data to widget_image
-
-        Notes
-        -----
-        method name might be changed
-        '''
-        self._widget_image._b64value = change['new']
+    @property
+    def _image_data(self):
+        # base64 PNG of the last rendered image, the frontend sends bytes
+        if isinstance(self._image, bytes):
+            return base64.b64encode(self._image).decode('ascii')
+        return ''
+
+    def get_image(self):
+        """The last image from `render_image`: PNG bytes, or a
+        (height, width, 4) uint8 RGBA array with `image_format='rgba'`.
+        Empty bytes before the first image arrived.
+        """
+        return self._image
 
     def render_image(self,
                      frame=None,
                      factor=4,
                      antialias=True,
                      trim=False,
-                     transparent=False):
+                     transparent=False,
+                     image_format='png'):
         """render and get image as ipywidgets.widget_image.Image
 
         Parameters
@@ -968,6 +1367,10 @@ class NGLWidget(DOMWidget):
         antialias : bool, default True
         trim : bool, default False
         transparent : bool, default False
+        image_format : {'png', 'rgba'}, default 'png'
+            how the frontend sends the image, as binary data. 'rgba' sends
+            raw pixels, no PNG decoding needed in the kernel; the returned
+            Image widget stays empty, use `get_image`.
 
         Examples
         --------
@@ -986,7 +1389,8 @@ class NGLWidget(DOMWidget):
         params = dict(factor=factor,
                       antialias=antialias,
                       trim=trim,
-                      transparent=transparent)
+                      transparent=transparent,
+                      format=image_format)
         iw = Image()
         iw.width = '99%'  # avoid ugly scroll bar on notebook.
         self._remote_call('_exportImage',
@@ -1024,6 +1428,37 @@ class NGLWidget(DOMWidget):
                           ],
                           kwargs=params)
 
+    def _on_rendered(self, callback, timeout=None):
+        '''call `callback()` once the frontend has applied and drawn
+        everything sent before: coordinates, representation changes (also
+        the ones still being built) and images being rendered.
+
+        If `timeout` (second) is given, call it anyway (from another thread),
+        with a warning, when no acknowledgement came in time: the widget is
+        not displayed, its views were closed, or the frontend is too old to
+        answer.
+        '''
+        token = uuid.uuid4().hex
+        self._render_acks[token] = callback
+        # goes through the remote call queue, after the calls made so far
+        self._remote_call('renderBarrier', target='Widget', args=[token])
+        if timeout is not None:
+            timer = threading.Timer(timeout,
+                                    self._render_ack,
+                                    args=[token, timeout])
+            timer.daemon = True
+            timer.start()
+
+    def _render_ack(self, token, timeout=None):
+        # only the first of the ack (from any view) and the timeout counts
+        callback = self._render_acks.pop(token, None)
+        if callback is not None:
+            if timeout is not None:
+                logging.warning(
+                    f'no render acknowledgement from the frontend after '
+                    f'{timeout} s (is the view displayed?), going on without')
+            callback()
+
     def _ngl_handle_msg(self, widget, msg, buffers):
         """store message sent from Javascript.
 
@@ -1046,7 +1481,7 @@ class NGLWidget(DOMWidget):
             self._ngl_view_id = msg['data']
         elif msg_type == 'removeComponent':
             cindex = int(msg['data'])
-            self._ngl_component_ids.pop(cindex)
+            self._release_blob(self._ngl_component_ids.pop(cindex))
         elif msg_type == 'repr_parameters':
             data_dict = self._ngl_msg.get('data')
             name = data_dict.pop('name') + '\n'
@@ -1080,9 +1515,13 @@ class NGLWidget(DOMWidget):
             if msg.get('data') == 'ok':
                 self._event.set()
         elif msg_type == 'image_data':
-            self._image_data = msg.get('data')
-            Widget.widgets[msg.get('ID')].value = base64.b64decode(
-                self._image_data)
+            self._image = _image_from_msg(msg, buffers)
+            if isinstance(self._image, bytes):
+                # PNG; raw RGBA pixels can not be shown by Image widgets
+                self._widget_image.value = self._image
+                Widget.widgets[msg.get('ID')].value = self._image
+        elif msg_type == 'render_ack':
+            self._render_ack(msg.get('data'))
 
     def _request_repr_parameters(self, component=0, repr_index=0):
         if self.n_components > 0:
@@ -1110,14 +1549,20 @@ class NGLWidget(DOMWidget):
         '''
         if not isinstance(structure, Structure):
             raise ValueError(f'{structure} is not an instance of Structure')
-        self._load_data(structure, **kwargs)
-        self._ngl_component_ids.append(structure.id)
+        self._add_loaded_component(structure.id,
+                                   self._load_data(structure, **kwargs))
         if self.n_components > 1:
             self.center_view(component=len(self._ngl_component_ids) - 1)
         self._update_component_auto_completion()
         return self[-1]
 
-    def add_trajectory(self, trajectory, **kwargs):
+    def add_trajectory(self,
+                       trajectory,
+                       start=None,
+                       stop=None,
+                       stride=None,
+                       atom_indices=None,
+                       **kwargs):
         '''add new trajectory to `view`
 
         Parameters
@@ -1125,6 +1570,12 @@ class NGLWidget(DOMWidget):
         trajectory: nglview.Trajectory or its derived class or
             a supported object, eg pytraj.Trajectory-like,
             mdtraj.Trajectory, MDAnalysis objects, etc
+        start, stop, stride : int, optional
+            Only show these frames, without copying the trajectory. See also
+            `set_frame_range`.
+        atom_indices : array-like of int or str, optional
+            Only show these atoms (or a selection string of the trajectory's
+            library), see `nglview.AtomSubsetTrajectory`.
 
         See Also
         --------
@@ -1149,15 +1600,60 @@ class NGLWidget(DOMWidget):
             trajectory = backends[package_name](trajectory)
         else:
             trajectory = trajectory
+        if atom_indices is not None:
+            trajectory = AtomSubsetTrajectory(trajectory, atom_indices)
+        if (start, stop, stride) != (None, None, None):
+            trajectory = SlicedTrajectory(trajectory, start, stop, stride)
 
-        self._load_data(trajectory, **kwargs)
+        blob = self._load_data(trajectory, **kwargs)
         setattr(trajectory, 'shown', True)
         self._trajlist.append(trajectory)
         self._update_max_frame()
-        self._ngl_component_ids.append(trajectory.id)
+        if hasattr(trajectory, 'on_frames'):
+            # e.g. StreamingTrajectory, frames are discovered while reading
+            trajectory.on_frames(lambda n_frames: self._update_max_frame())
+        self._add_loaded_component(trajectory.id, blob)
         self._update_component_auto_completion()
         return self[-1]
 
+    def set_frame_range(self, start=None, stop=None, stride=None,
+                        component=None):
+        '''Only show every `stride`-th frame from `start` to `stop` (as for
+        `slice`). The player, `max_frame` and `frame` then refer to the
+        subsampled frames. No coordinates are copied.
+
+        Parameters
+        ----------
+        start, stop, stride : int, optional
+            Relative to the full trajectory. All None to show all frames.
+        component : int, optional
+            Component index of the trajectory. Default: all trajectories.
+
+        Examples
+        --------
+        >>> view.set_frame_range(stride=100) # doctest: +SKIP
+        ... view.set_frame_range(1000, 2000)
+        '''
+        for i, traj in enumerate(self._trajlist):
+            if (component is not None and
+                    self._ngl_component_ids.index(traj.id) != component):
+                continue
+            if isinstance(traj, SlicedTrajectory):
+                # always relative to the full trajectory
+                shown = traj.shown
+                traj = traj.trajectory
+                traj.shown = shown
+            if (start, stop, stride) != (None, None, None):
+                sliced = SlicedTrajectory(traj, start, stop, stride)
+                sliced.shown = traj.shown
+                traj = sliced
+            self._trajlist[i] = traj
+        self._update_max_frame()
+        if self.frame > self.max_frame:
+            self.frame = max(self.max_frame, 0)
+        else:
+            self._set_coordinates(self.frame)
+
     def add_pdbid(self, pdbid, **kwargs):
         '''add new Structure view by fetching pdb id from rcsb
 
@@ -1202,12 +1698,35 @@ class NGLWidget(DOMWidget):
             if package_name in BACKENDS:
                 filename = BACKENDS[package_name](filename)
 
-        self._load_data(filename, **kwargs)
+        blob = self._load_data(filename, **kwargs)
         # assign an ID
-        self._ngl_component_ids.append(str(uuid.uuid4()))
+        self._add_loaded_component(str(uuid.uuid4()), blob)
         self._update_component_auto_completion()
         return self[-1]
 
+    def _add_loaded_component(self, component_id, blob):
+        self._ngl_component_ids.append(component_id)
+        if blob is not None:
+            self._ngl_component_blobs[component_id] = blob
+
+    def _release_blob(self, component_id):
+        # drop the component's reference to its data, see nglview.blob
+        blob = self._ngl_component_blobs.pop(component_id, None)
+        if blob is None:
+            return
+        if blob not in self._ngl_component_blobs.values():
+            self._ngl_blobs = [b for b in self._ngl_blobs if b is not blob]
+        BlobRegistry.release(blob)
+
+    def close(self):
+        # may run on a half initialized widget (ipywidgets' __del__)
+        for component_id in list(getattr(self, '_ngl_component_blobs', {})):
+            self._release_blob(component_id)
+        # links to a closed widget can not be embedded
+        for widget_link in getattr(self, '_player_links', []):
+            widget_link.close()
+        super().close()
+
     def _load_data(self, obj, **kwargs):
         '''
 
@@ -1215,8 +1734,13 @@ class NGLWidget(DOMWidget):
         ----------
         obj : nglview.Structure or any object having 'get_structure_string' method or
               string buffer (open(fn).read())
+
+        Returns
+        -------
+        the `_Blob` holding the data, None for paths and urls
         '''
         kwargs2 = _camelize_dict(kwargs)
+        blob_widget = None
 
         try:
             is_url = FileManager(obj).is_url
@@ -1227,7 +1751,13 @@ class NGLWidget(DOMWidget):
             kwargs2['defaultRepresentation'] = True
 
         if not is_url:
-            if hasattr(obj, 'get_structure_string'):
+            if hasattr(obj, 'get_structure_buffer'):
+                # binary MMTF topology
+                blob = obj.get_structure_buffer()
+                kwargs2['ext'] = 'mmtf'
+                passing_buffer = True
+                binary = True
+            elif hasattr(obj, 'get_structure_string'):
                 blob = obj.get_structure_string()
                 kwargs2['ext'] = obj.ext
                 passing_buffer = True
@@ -1245,13 +1775,20 @@ class NGLWidget(DOMWidget):
 
                 kwargs2['ext'] = fh.ext
                 binary = fh.is_binary
-                use_filename = fh.use_filename
 
-            if binary and not use_filename:
-                # send base64
-                blob = base64.b64encode(blob).decode('utf8')
-            blob_type = 'blob' if passing_buffer else 'path'
-            args = [{'type': blob_type, 'data': blob, 'binary': binary}]
+            if passing_buffer:
+                # the same data is only sent once per kernel, see nglview.blob
+                # (one reference per component)
+                blob_widget = BlobRegistry.add(blob, binary=binary)
+                if blob_widget not in self._ngl_blobs:
+                    self._ngl_blobs = self._ngl_blobs + [blob_widget]
+                args = [{
+                    'type': 'blob_ref',
+                    'data': 'IPY_MODEL_' + blob_widget.model_id,
+                    'binary': binary
+                }]
+            else:
+                args = [{'type': 'path', 'data': blob, 'binary': binary}]
         else:
             # is_url
             blob_type = 'url'
@@ -1264,6 +1801,7 @@ class NGLWidget(DOMWidget):
                           target='Stage',
                           args=args,
                           kwargs=kwargs2)
+        return blob_widget
 
     def remove_component(self, c):
         """remove component by its uuid.
@@ -1292,9 +1830,12 @@ class NGLWidget(DOMWidget):
             for traj in self._trajlist:
                 if traj.id == component_id:
                     self._trajlist.remove(traj)
+        if component_id in self._prefetchers:
+            self._prefetchers.pop(component_id)[1].close()
         component_index = self._ngl_component_ids.index(component_id)
         self._ngl_component_ids.remove(component_id)
         self._ngl_component_names.pop(component_index)
+        self._release_blob(component_id)
 
         self._remote_call('removeComponent',
                           target='Stage',
@@ -1509,8 +2050,7 @@ class NGLWidget(DOMWidget):
         '''for testing
         '''
         from IPython import display
-        im_bytes = base64.b64decode(self._image_data)
-        return display.Image(im_bytes)
+        return display.Image(self._image)
 
     def _clear_component_auto_completion(self):
         for index, _ in enumerate(self._ngl_component_ids):